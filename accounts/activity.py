@@ -0,0 +1,179 @@
+"""
+Buffered activity timestamps for users.
+
+Updating last_login on every login turns each one into an UPDATE of a row
+other requests are reading. Instead, each process keeps the latest
+timestamp per user and field in memory and writes them all at once, one
+`bulk_update` (an UPDATE ... CASE statement) per batch of users.
+
+A flush happens ACTIVITY_FLUSH_INTERVAL seconds after the first
+timestamp was buffered, as soon as ACTIVITY_BUFFER_SIZE users are
+buffered, and when the process exits. The stored timestamps are thus at
+most ACTIVITY_FLUSH_INTERVAL seconds stale; 0 writes them straight away,
+and None leaves them to `flush()` and a full buffer, the way tests run
+(see gift_project/runner.py). The buffer is made from the settings when
+first used and made again when they change.
+Processes flush independently, so a flush never moves a timestamp back,
+and a flush that fails buffers its timestamps again for the next one.
+
+"""
+
+
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import setting_changed
+from django.db import DatabaseError, connections
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.dispatch import receiver
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityBuffer:
+    """
+    Latest activity timestamps per user and field, waiting to be written.
+    """
+
+    def __init__(self, interval, maxsize, batch_size=500):
+        self.interval = interval
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def record(self, user_id, field='last_login', when=None):
+        """
+        Buffers `when` (now by default) as the user's latest `field`.
+        """
+        when = when or timezone.now()
+        with self._lock:
+            self._merge(user_id, {field: when})
+            full = len(self._pending) >= self.maxsize
+            if not full:
+                self._schedule()
+        if full or self.interval == 0:
+            self.flush()
+
+    def _merge(self, user_id, fields):
+        # the lock is held, the latest timestamp of each field wins
+        pending = self._pending.setdefault(user_id, {})
+        for field, when in fields.items():
+            if pending.get(field) is None or pending[field] < when:
+                pending[field] = when
+
+    def _schedule(self):
+        # the lock is held
+        if self.interval and self._timer is None:
+            self._timer = threading.Timer(self.interval, self.flush_safely)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+        Writes the buffered timestamps and returns the number of users written.
+        The timestamps are buffered again if the write fails.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+
+        User = get_user_model()
+        # users are grouped by the fields they have, one bulk_update each
+        groups = {}
+        for user_id, fields in pending.items():
+            groups.setdefault(tuple(sorted(fields)), []).append((user_id, fields))
+        try:
+            for names, users in groups.items():
+                objs = []
+                for user_id, fields in users:
+                    obj = User(pk=user_id)
+                    for name in names:
+                        # GREATEST is NULL on sqlite if either side is
+                        value = Value(fields[name], output_field=User._meta.get_field(name))
+                        setattr(obj, name, Coalesce(Greatest(F(name), value), value))
+                    objs.append(obj)
+                User.objects.bulk_update(objs, names, batch_size=self.batch_size)
+        except DatabaseError:
+            # writing a group again is harmless, GREATEST keeps what's stored
+            with self._lock:
+                for user_id, fields in pending.items():
+                    self._merge(user_id, fields)
+                self._schedule()
+            raise
+        return len(pending)
+
+    def flush_safely(self):
+        """
+        `flush` for the timer thread and process exit, where there is no one
+        to raise to.
+        """
+        try:
+            self.flush()
+        except DatabaseError:
+            logger.warning('Could not write the buffered activity timestamps', exc_info=True)
+        finally:
+            # nothing else uses this thread's connection
+            connections.close_all()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_activity_buffer():
+    """
+    Returns the process's `ActivityBuffer`, made from the settings.
+    """
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = ActivityBuffer(settings.ACTIVITY_FLUSH_INTERVAL, settings.ACTIVITY_BUFFER_SIZE)
+        return _buffer
+
+
+@receiver(setting_changed)
+def reset_activity_buffer(setting, **kwargs):
+    """
+    Drops the buffer, and what it holds, when its settings change. Only
+    tests change them, mostly around a test database that's gone after.
+    """
+    global _buffer
+    if setting not in ('ACTIVITY_FLUSH_INTERVAL', 'ACTIVITY_BUFFER_SIZE'):
+        return
+    with _buffer_lock:
+        buffer, _buffer = _buffer, None
+    if buffer is not None:
+        with buffer._lock:
+            if buffer._timer is not None:
+                buffer._timer.cancel()
+
+
+@atexit.register
+def _flush_at_exit():
+    buffer = _buffer
+    if buffer is not None and buffer.interval is not None:
+        buffer.flush_safely()
+
+
+def record_last_login(sender, user, **kwargs):
+    """
+    Buffered replacement for django's `update_last_login` receiver.
+    """
+    user.last_login = timezone.now()
+    get_activity_buffer().record(user.pk, 'last_login', user.last_login)
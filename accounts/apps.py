@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from django.contrib.auth.signals import user_logged_in
+
+        from .activity import record_last_login
+
+        # buffer last_login instead of saving the user on every login
+        user_logged_in.disconnect(dispatch_uid='update_last_login')
+        user_logged_in.connect(record_last_login, dispatch_uid='record_last_login')
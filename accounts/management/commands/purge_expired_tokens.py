@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes expired outstanding refresh tokens and their blacklist entries '
+        'in small transactions, so the tables are never locked for long.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='tokens deleted per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='seconds to wait between chunks, to leave room for other writes',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        now = timezone.now()
+        last_id = 0
+        purged = blacklisted = chunks = 0
+        start = time.perf_counter()
+
+        while True:
+            # walk the primary key instead of rescanning from the start, there
+            # is no index on expires_at
+            ids = list(
+                OutstandingToken.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'expires_at')[:chunk_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1][0]
+            expired = [pk for pk, expires_at in ids if expires_at < now]
+            if not expired:
+                continue
+
+            with transaction.atomic():
+                blacklisted += BlacklistedToken.objects.filter(token_id__in=expired).delete()[0]
+                purged += OutstandingToken.objects.filter(id__in=expired).delete()[0]
+            chunks += 1
+
+            if options['verbosity'] > 1:
+                self.stdout.write('%d tokens purged' % purged)
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            'Purged %d expired tokens (%d blacklisted) in %d chunks, %.2fs' % (
+                purged, blacklisted, chunks, time.perf_counter() - start,
+            )
+        ))
@@ -0,0 +1,54 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes expired sessions in small batches, unlike clearsessions '
+        'which removes them all in one long DELETE.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='sessions deleted per batch (default: 1000)',
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='seconds to wait between chunks, to leave room for other writes',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        now = timezone.now()
+        purged = chunks = 0
+        start = time.perf_counter()
+
+        while True:
+            # expire_date is indexed, so each batch is found without a scan and
+            # the deleted rows are never looked at again
+            keys = list(
+                Session.objects.filter(expire_date__lt=now)
+                .values_list('session_key', flat=True)[:chunk_size]
+            )
+            if not keys:
+                break
+            purged += Session.objects.filter(session_key__in=keys).delete()[0]
+            chunks += 1
+
+            if options['verbosity'] > 1:
+                self.stdout.write('%d sessions purged' % purged)
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            'Purged %d expired sessions in %d chunks, %.2fs' % (
+                purged, chunks, time.perf_counter() - start,
+            )
+        ))
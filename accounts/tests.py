@@ -1,5 +1,16 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import DatabaseError, connection
+from django.db.models import QuerySet
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from accounts.activity import ActivityBuffer, get_activity_buffer
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 
 # Create your tests here.
 
@@ -30,4 +41,134 @@ class CustomUserTests(TestCase):
         self.assertTrue(admin_user.is_active)
         self.assertTrue(admin_user.is_staff)
         self.assertTrue(admin_user.is_superuser)
-        
\ No newline at end of file
+        
+
+
+
+class PurgeExpiredTokensTests(TestCase):
+
+    def test_purge(self):
+        now = timezone.now()
+        for i in range(5):
+            expired = OutstandingToken.objects.create(
+                jti=f'expired{i}', token='token', expires_at=now - timedelta(days=1)
+            )
+            valid = OutstandingToken.objects.create(
+                jti=f'valid{i}', token='token', expires_at=now + timedelta(days=1)
+            )
+            if i % 2:
+                BlacklistedToken.objects.create(token=expired)
+                BlacklistedToken.objects.create(token=valid)
+
+        out = StringIO()
+        call_command('purge_expired_tokens', '--chunk-size', '3', stdout=out)
+
+        self.assertIn('Purged 5 expired tokens (2 blacklisted)', out.getvalue())
+        self.assertEqual(
+            set(OutstandingToken.objects.values_list('jti', flat=True)),
+            {f'valid{i}' for i in range(5)},
+        )
+        self.assertEqual(BlacklistedToken.objects.count(), 2)
+
+
+class PurgeSessionsTests(TestCase):
+
+    def test_purge(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(
+                session_key=f'expired{i}', session_data='', expire_date=now - timedelta(days=1)
+            )
+            Session.objects.create(
+                session_key=f'valid{i}', session_data='', expire_date=now + timedelta(days=1)
+            )
+
+        out = StringIO()
+        call_command('purge_sessions', '--chunk-size', '2', stdout=out)
+
+        self.assertIn('Purged 5 expired sessions in 3 chunks', out.getvalue())
+        self.assertEqual(
+            set(Session.objects.values_list('session_key', flat=True)),
+            {f'valid{i}' for i in range(5)},
+        )
+
+
+class ActivityBufferTests(TestCase):
+
+    def setUp(self):
+        # logins of earlier tests wait in the buffer, tests don't flush on a timer
+        get_activity_buffer().flush()
+        User = get_user_model()
+        self.users = [
+            User.objects.create_user(email=f'user{i}@gmail.com', password='pass2002word')
+            for i in range(3)
+        ]
+
+    def last_logins(self):
+        User = get_user_model()
+        return [User.objects.get(pk=user.pk).last_login for user in self.users]
+
+    def test_saves_leave_last_login_alone(self):
+        user = self.users[0]
+        user.is_staff = True
+        user.save()
+        self.assertIsNone(self.last_logins()[0])
+
+    def test_login_is_buffered(self):
+        self.client.login(email='user0@gmail.com', password='pass2002word')
+        self.assertIsNone(self.last_logins()[0])
+        self.assertEqual(get_activity_buffer().flush(), 1)
+        self.assertIsNotNone(self.last_logins()[0])
+
+    def test_buffer_follows_the_settings(self):
+        # the test runner leaves the writing to the tests
+        self.assertIsNone(get_activity_buffer().interval)
+        with self.settings(ACTIVITY_FLUSH_INTERVAL=0):
+            self.client.login(email='user0@gmail.com', password='pass2002word')
+            self.assertIsNotNone(self.last_logins()[0])
+        self.assertIsNone(get_activity_buffer().interval)
+
+    def test_flush_is_one_update(self):
+        buffer = ActivityBuffer(interval=60, maxsize=100)
+        now = timezone.now()
+        for user in self.users:
+            buffer.record(user.pk, when=now - timedelta(minutes=1))
+            buffer.record(user.pk, when=now)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.last_logins(), [now] * 3)
+        self.assertEqual(len(buffer), 0)
+
+    def test_never_moves_back(self):
+        buffer = ActivityBuffer(interval=0, maxsize=100)
+        now = timezone.now()
+        buffer.record(self.users[0].pk, when=now)
+        # another process flushing an older login later
+        buffer.record(self.users[0].pk, when=now - timedelta(minutes=1))
+        self.assertEqual(self.last_logins()[0], now)
+
+    def test_full_buffer_flushes(self):
+        buffer = ActivityBuffer(interval=60, maxsize=2)
+        buffer.record(self.users[0].pk)
+        self.assertEqual(len(buffer), 1)
+        buffer.record(self.users[1].pk)
+        self.assertEqual(len(buffer), 0)
+        self.assertIsNotNone(self.last_logins()[1])
+
+    def test_failed_flush_keeps_timestamps(self):
+        buffer = ActivityBuffer(interval=None, maxsize=100)
+        now = timezone.now()
+        buffer.record(self.users[0].pk, when=now - timedelta(minutes=1))
+        buffer.record(self.users[1].pk, when=now)
+        with mock.patch.object(QuerySet, 'bulk_update', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                buffer.flush()
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(self.last_logins(), [None, None, None])
+
+        # a login buffered meanwhile is kept over the older one put back
+        buffer.record(self.users[0].pk, when=now)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.last_logins(), [now, now, None])
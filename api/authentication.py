@@ -0,0 +1,119 @@
+"""
+JWT authentication that resolves the user without a query per request.
+
+Users are kept in a small in-process LRU cache keyed on the token's user id
+and jti, for JWT_USER_CACHE_TIMEOUT seconds. Each entry remembers the
+user's auth stamp, a value kept in the shared cache that is replaced
+whenever the user's password or active flag changes (see api/signals.py).
+An entry whose stamp no longer matches is dropped, so a deactivated user
+is locked out of every worker on their next request, not after the TTL.
+
+"""
+
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from .metrics import metrics
+
+
+def auth_stamp_key(user_id):
+    return 'auth:user:%s' % user_id
+
+
+def get_auth_stamp(user_id):
+    """
+    Returns the user's current auth stamp, starting a new one if the cache
+    has lost it.
+    """
+    key = auth_stamp_key(user_id)
+    stamp = cache.get(key)
+    if stamp is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        stamp = cache.get(key)
+    return stamp
+
+
+def invalidate_user(user_id):
+    """
+    Drops the cached copies of a user in every process.
+    """
+    cache.set(auth_stamp_key(user_id), time.time_ns(), timeout=None)
+
+
+class UserCache:
+    """
+    Size bounded LRU of users with a time to live, safe to share between threads.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, stamp):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, entry_stamp, expires = entry
+            if entry_stamp != stamp or expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def set(self, key, user, stamp):
+        with self._lock:
+            self._entries[key] = (user, stamp, time.monotonic() + self.timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(settings.JWT_USER_CACHE_SIZE, settings.JWT_USER_CACHE_TIMEOUT)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    `JWTAuthentication` that looks the user up in `user_cache` first.
+    """
+
+    def authenticate(self, request):
+        try:
+            return super().authenticate(request)
+        except AuthenticationFailed:
+            metrics.inc('auth_failures_total', (('kind', 'token'),))
+            raise
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        jti = validated_token.get(api_settings.JTI_CLAIM)
+        if user_id is None or jti is None or not user_cache.maxsize:
+            return super().get_user(validated_token)
+
+        key = (user_id, jti)
+        stamp = get_auth_stamp(user_id)
+        user = user_cache.get(key, stamp)
+        if user is None:
+            metrics.inc('cache_requests_total', (('cache', 'jwt_user'), ('result', 'miss')))
+            # raises for unknown and inactive users, which are never cached
+            user = super().get_user(validated_token)
+            user_cache.set(key, user, stamp)
+        else:
+            metrics.inc('cache_requests_total', (('cache', 'jwt_user'), ('result', 'hit')))
+        # views get their own copy to change as they like
+        return copy.copy(user)
@@ -0,0 +1,156 @@
+"""
+Response cache for the catalog (product and category) endpoints.
+
+Cached responses are keyed on the catalog version, a counter kept in the
+cache that is bumped whenever a product or category changes (see
+api/signals.py). Bumping the version orphans every cached response at
+once, so invalidation never has to find or delete keys; the orphans
+simply expire.
+
+"""
+
+
+import hashlib
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+class CacheStats:
+    """
+    Hit/miss counters for the response cache of this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+    def as_dict(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+stats = CacheStats()
+
+
+def get_catalog_version():
+    """
+    Returns the current catalog version, starting a new one if the cache has
+    lost it.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # start from the clock rather than 1 so a version evicted from the
+        # cache can never come back and match responses cached under it
+        cache.add(CATALOG_VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Invalidates every cached catalog response.
+
+    Inside a transaction the version is bumped right away, so the writer sees
+    its own changes, and again on commit, so a response cached by another
+    request before the commit can't outlive it.
+    """
+    _bump()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(_bump)
+
+
+def _bump():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        get_catalog_version()
+
+
+def normalize_query_params(query_params, names, integers=(), decimals=()):
+    """
+    Returns the `names` query params as a sorted tuple with blank values
+    dropped. The values of the `integers` and `decimals` ones are put in
+    canonical form where `int()` and `Decimal()` take them, as the views
+    parse them, so `?price_lt=10.0` and `?price_lt=10` share a cache entry;
+    the others are kept as they are, `?q=007` isn't `?q=7`, and neither is
+    `?page_size=1e1`, which the pagination ignores, `?page_size=10`.
+    """
+    normalized = []
+    for name in sorted(names):
+        for value in sorted(query_params.getlist(name)):
+            value = value.strip()
+            if not value:
+                continue
+            try:
+                if name in integers:
+                    value = str(int(value))
+                elif name in decimals:
+                    number = Decimal(value)
+                    if number.is_finite():
+                        value = format(number.normalize(), 'f')
+            except (ValueError, InvalidOperation):
+                pass
+            normalized.append((name, value))
+    return tuple(normalized)
+
+
+class CachedResponseMixin:
+    """
+    Caches the data of successful GET responses under the catalog version.
+
+    Only the query params listed in `cache_query_params` are part of the key,
+    so every param that changes the response must be listed. The ones also
+    listed in `cache_integer_params` or `cache_decimal_params`, which the
+    view must parse with `int()` or `Decimal()` too, are compared as
+    numbers. The data is cached rather than the rendered body, so content
+    negotiation still works on cached responses.
+    """
+
+    cache_query_params = ()
+    cache_integer_params = ()
+    cache_decimal_params = ()
+
+    def get_cache_key(self, request, kwargs):
+        params = normalize_query_params(
+            request.query_params, self.cache_query_params, self.cache_integer_params, self.cache_decimal_params,
+        )
+        # the host is part of the key because pagination links are absolute
+        route = (request.scheme, request.get_host(), sorted(kwargs.items()))
+        digest = hashlib.md5(repr((route, params)).encode()).hexdigest()
+        return 'catalog:%s:%s:%s' % (
+            get_catalog_version(), request.resolver_match.view_name, digest
+        )
+
+    def get(self, request, *args, **kwargs):
+        key = self.get_cache_key(request, kwargs)
+        data = cache.get(key)
+        if data is not None:
+            stats.hit()
+            return Response(data)
+
+        stats.miss()
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        return response
@@ -0,0 +1,46 @@
+"""
+Conditional GET support (ETag / Last-Modified) for the API views.
+
+"""
+
+
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def conditional_get(get):
+    """
+    Decorates a view's `get` method to answer `If-None-Match` and
+    `If-Modified-Since` with 304 before the object is loaded and serialized.
+
+    Like django's `condition` decorator, but both validators come from a
+    single `self.get_validators(**kwargs)` call: one cheap query returning
+    `(etag_parts, last_modified)` for the requested object, or None when it
+    doesn't exist so the view can answer as usual. The strong ETag is a hash
+    of the parts and the negotiated media type.
+    """
+
+    @wraps(get)
+    def wrapper(self, request, *args, **kwargs):
+        validators = self.get_validators(**kwargs)
+        if validators is None:
+            return get(self, request, *args, **kwargs)
+
+        etag_parts, last_modified = validators
+        etag = '"%s"' % hashlib.md5(
+            repr((etag_parts, request.accepted_media_type)).encode()
+        ).hexdigest()
+        last_modified = int(last_modified.timestamp())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = get(self, request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    return wrapper
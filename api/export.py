@@ -0,0 +1,100 @@
+"""
+Streaming catalog export.
+
+The export is written row by row from a server-side cursor, so memory use
+stays flat no matter how large the catalog is: neither the model instances
+nor the whole body ever exist at once.
+
+"""
+
+
+import csv
+import json
+
+from rest_framework import serializers
+
+
+# product fields in export order, `category` is the category's name
+EXPORT_FIELDS = ('id', 'name', 'category', 'price', 'rank', 'created_time', 'updated_time')
+EXPORT_COLUMNS = ('id', 'name', 'category__name', 'price', 'rank', 'created_time', 'updated_time')
+
+# rows fetched from the cursor per round trip
+CHUNK_SIZE = 2000
+
+# size of the pieces handed to the server, one write per row is too chatty
+BUFFER_SIZE = 64 * 1024
+
+# datetimes are written the way the API writes them
+format_datetime = serializers.DateTimeField().to_representation
+
+
+def export_rows(queryset):
+    """
+    Iterates the queryset as tuples of `EXPORT_COLUMNS`, in id order.
+    """
+    return queryset.order_by('pk').values_list(*EXPORT_COLUMNS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def ndjson_lines(rows):
+    """
+    Yields one JSON object per row. Prices and datetimes are strings, like
+    in the API.
+    """
+    # converting the values up front keeps the encoder on its C fast path
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    for pk, name, category, price, rank, created_time, updated_time in rows:
+        yield encode({
+            'id': pk,
+            'name': name,
+            'category': category,
+            'price': str(price),
+            'rank': rank,
+            'created_time': format_datetime(created_time),
+            'updated_time': format_datetime(updated_time),
+        }) + '\n'
+
+
+class _Echo:
+    """
+    File-like object that hands back what the csv writer writes to it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """
+    Yields a header line followed by one CSV line per row.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for pk, name, category, price, rank, created_time, updated_time in rows:
+        yield writer.writerow((
+            pk, name, category, price, rank, format_datetime(created_time), format_datetime(updated_time)
+        ))
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    """
+    Joins the lines into utf-8 chunks of about `size` bytes.
+    """
+    buffer = []
+    length = 0
+    for line in lines:
+        line = line.encode()
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+# output name: (line writer, content type, file extension)
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson', 'ndjson'),
+    'csv': (csv_lines, 'text/csv; charset=utf-8', 'csv'),
+}
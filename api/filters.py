@@ -0,0 +1,138 @@
+"""
+Contains the product filters and facets shared by the API endpoints
+
+"""
+
+
+from decimal import Decimal
+
+from django.db.models import Case, Count, IntegerField, Value, When
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+
+
+class ProductFilter(serializers.Serializer):
+    """
+    Validates the product filter query params.
+
+    Each param is declared as a serializer field and mapped to the lookup it
+    filters on in `lookups`, so adding a filter is one field and one entry.
+
+    Args:
+        category: id of a category, repeat it to match any of several
+        price_gt: minimum price (exclusive) of the products to be returned
+        price_lt: maximum price (exclusive) of the products to be returned
+        rank_gte: minimum rank (inclusive) of the products to be returned
+        rank_lte: maximum rank (inclusive) of the products to be returned
+
+    """
+
+    category = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+    price_gt = serializers.DecimalField(max_digits=None, decimal_places=None, required=False)
+    price_lt = serializers.DecimalField(max_digits=None, decimal_places=None, required=False)
+    rank_gte = serializers.IntegerField(required=False)
+    rank_lte = serializers.IntegerField(required=False)
+
+    lookups = {
+        'category': 'category__in',
+        'price_gt': 'price__gt',
+        'price_lt': 'price__lt',
+        'rank_gte': 'rank__gte',
+        'rank_lte': 'rank__lte',
+    }
+
+    def filter_queryset(self, queryset, exclude=()):
+        """
+        Applies the validated filters, except the ones named in `exclude`.
+        """
+        filters = {
+            self.lookups[name]: value
+            for name, value in self.validated_data.items()
+            if name not in exclude
+        }
+        return queryset.filter(**filters)
+
+
+def get_product_filter(query_params):
+    """
+    Returns a validated `ProductFilter`, raising a 400 for invalid params.
+    """
+    product_filter = ProductFilter(data=query_params)
+    product_filter.is_valid(raise_exception=True)
+    return product_filter
+
+
+def filter_products(queryset, query_params):
+    return get_product_filter(query_params).filter_queryset(queryset)
+
+
+class ProductFilterBackend(BaseFilterBackend):
+    """
+    Filter backend for the product views, see `ProductFilter` for the params.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        return filter_products(queryset, request.query_params)
+
+
+# lower bounds of the price buckets on the facets endpoint, the last bucket
+# has no upper bound
+PRICE_BUCKETS = (Decimal(0), Decimal(10), Decimal(25), Decimal(50), Decimal(100), Decimal(250), Decimal(500))
+
+
+def price_bucket():
+    """
+    Returns an expression numbering the price bucket of each product.
+    """
+    return Case(
+        *[
+            When(price__lt=upper, then=Value(number))
+            for number, upper in enumerate(PRICE_BUCKETS[1:])
+        ],
+        default=Value(len(PRICE_BUCKETS) - 1),
+        output_field=IntegerField(),
+    )
+
+
+def product_facets(queryset, query_params):
+    """
+    Counts the filtered products per category and per price bucket.
+
+    Both facets come out of one query grouped by (category, price bucket).
+    The category counts ignore the category filter, so the sidebar still
+    shows how many products picking another category would add; the price
+    buckets only count the selected categories.
+    """
+    product_filter = get_product_filter(query_params)
+    selected = set(product_filter.validated_data.get('category', ()))
+
+    rows = (
+        product_filter.filter_queryset(queryset, exclude=('category',))
+        .order_by()
+        .annotate(bucket=price_bucket())
+        .values('category', 'category__name', 'bucket')
+        .annotate(count=Count('pk'))
+        .values_list('category', 'category__name', 'bucket', 'count')
+    )
+
+    categories = {}
+    buckets = [0] * len(PRICE_BUCKETS)
+    for category, name, bucket, count in rows:
+        if category not in categories:
+            categories[category] = {'id': category, 'name': name, 'count': 0}
+        categories[category]['count'] += count
+        if not selected or category in selected:
+            buckets[bucket] += count
+
+    return {
+        'count': sum(buckets),
+        'categories': sorted(categories.values(), key=lambda c: (-c['count'], c['name'], c['id'])),
+        'price_buckets': [
+            {
+                'min': str(lower),
+                'max': str(PRICE_BUCKETS[number + 1]) if number + 1 < len(PRICE_BUCKETS) else None,
+                'count': buckets[number],
+            }
+            for number, lower in enumerate(PRICE_BUCKETS)
+        ],
+    }
@@ -0,0 +1,69 @@
+"""
+Bounded thread pool for the password hashing endpoints.
+
+Under ASGI, django 3.2 runs every sync view on one shared thread, so a
+login spending ~100ms in PBKDF2 holds up every other request behind it.
+Offloading just the hash wouldn't help, the shared thread would still
+wait for it. `hashing_pool_view` instead turns the whole view into a
+coroutine that runs the sync view on the pool, so the event loop and the
+shared thread stay free. PBKDF2 releases the GIL, so hashes on the pool
+also run in parallel with each other.
+
+The pool has PASSWORD_HASHING_WORKERS threads. That bounds how many
+hashes run at once, so a burst of logins queues up instead of taking
+every core. With 0 (the default, and what WSGI deployments want) views
+are left as they are.
+
+"""
+
+
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASHING_WORKERS, thread_name_prefix='password-hashing'
+            )
+        return _executor
+
+
+def _run(view, request, *args, **kwargs):
+    # the pool threads keep their database connections between requests, so
+    # they get the same age and health checks as the request thread's
+    close_old_connections()
+    try:
+        return view(request, *args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def hashing_pool_view(view):
+    """
+    Wraps a sync view to run on the hashing pool when it is enabled.
+    """
+    if not settings.PASSWORD_HASHING_WORKERS:
+        return view
+    executor = get_executor()
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # the request's context, such as its Server-Timing and metrics
+        # counters, goes along to the pool thread
+        context = contextvars.copy_context()
+        return await asyncio.wrap_future(executor.submit(context.run, _run, view, request, *args, **kwargs))
+
+    return wrapper
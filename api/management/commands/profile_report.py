@@ -0,0 +1,76 @@
+import pstats
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.profiling import profile_token
+
+
+SORT_KEYS = {
+    'tottime': lambda row: row[2],
+    'cumtime': lambda row: row[3],
+    'calls': lambda row: row[1],
+}
+
+
+def profile_view(path):
+    # profiles are named <view>.<timestamp>.<duration>.<pid>.prof
+    return path.name.split('.', 1)[0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Aggregates the request profiles saved by api.profiling.ProfilingMiddleware '
+        'into a report of the functions that took the most time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='directory of the profiles (default: PROFILE_DIR)')
+        parser.add_argument('--view', action='append', help='only profiles of this view, can be repeated')
+        parser.add_argument('--top', type=int, default=20, help='functions to list (default: 20)')
+        parser.add_argument(
+            '--sort', choices=sorted(SORT_KEYS), default='tottime',
+            help='time spent in the function itself, in it and what it calls, or number of calls',
+        )
+        parser.add_argument(
+            '--include', action='append',
+            help="only functions whose file path contains this, e.g. 'api/', can be repeated",
+        )
+        parser.add_argument(
+            '--token', action='store_true',
+            help='print an X-Profile header value that forces a request to be profiled, and exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(profile_token())
+            return
+        if options['top'] < 1:
+            raise CommandError('--top must be positive')
+
+        directory = Path(options['dir'] or settings.PROFILE_DIR)
+        paths = sorted(directory.glob('*.prof'))
+        if options['view']:
+            paths = [path for path in paths if profile_view(path) in options['view']]
+        if not paths:
+            raise CommandError('No profiles found in %s' % directory)
+
+        views = Counter(profile_view(path) for path in paths)
+        stats = pstats.Stats(*[str(path) for path in paths])
+
+        rows = []
+        for (filename, line, name), (primitive, calls, tottime, cumtime, callers) in stats.stats.items():
+            if options['include'] and not any(part in filename for part in options['include']):
+                continue
+            rows.append(('%s:%d(%s)' % (filename, line, name), calls, tottime, cumtime))
+        rows.sort(key=SORT_KEYS[options['sort']], reverse=True)
+
+        self.stdout.write('%d profiles, %.3fs in total' % (len(paths), stats.total_tt))
+        for view, count in views.most_common():
+            self.stdout.write('  %6d  %s' % (count, view))
+        self.stdout.write('')
+        self.stdout.write('%10s %10s %10s  %s' % ('calls', 'tottime', 'cumtime', 'function'))
+        for function, calls, tottime, cumtime in rows[:options['top']]:
+            self.stdout.write('%10d %10.4f %10.4f  %s' % (calls, tottime, cumtime, function))
@@ -0,0 +1,430 @@
+"""
+Request, query, cache and authentication metrics in Prometheus format.
+
+Recording a value must cost next to nothing, so every thread adds to its
+own dict of counters, without locks. Scraping `/metrics` adds up the dicts
+of all threads; those of stopped threads are added up into one then and
+every FOLD_EVERY new threads, so a server starting a thread per request
+keeps as many dicts as it has threads running.
+
+Workers of a multi-process server each count their own requests. With
+METRICS_DIR set, each process writes its totals to a file there, at most
+every METRICS_FLUSH_INTERVAL seconds after a request and when it exits,
+and `/metrics` adds up the files of every process, so whichever worker
+answers the scrape reports the totals of all of them. Counters must never
+go down, so the totals of stopped processes are kept: the process manager
+calls `mark_process_dead(pid)` when a worker exits, which folds its file
+into one shared by every stopped worker, e.g. in gunicorn.conf.py
+
+    def child_exit(server, worker):
+        from api.metrics import mark_process_dead
+        mark_process_dead(worker.pid)
+
+Empty the directory when deploying, like any restart it resets the counters.
+
+"""
+
+
+import atexit
+import bisect
+import itertools
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+GAUGE = 'gauge'
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    'http_requests_total': (COUNTER, 'Requests served, by URL name, method and status.'),
+    'http_request_duration_seconds': (HISTOGRAM, 'Request latency by URL name.'),
+    'db_queries_total': (COUNTER, 'Database queries run while serving requests, by URL name.'),
+    'cache_requests_total': (COUNTER, 'Cache lookups by cache and result.'),
+    'cache_hit_ratio': (GAUGE, 'Share of the cache lookups that were hits, since the counters started.'),
+    'auth_failures_total': (COUNTER, 'Failed logins (credentials) and rejected access tokens (token).'),
+}
+
+
+# new threads between two foldings of the dicts of stopped threads
+FOLD_EVERY = 64
+
+
+class Metrics:
+    """
+    Counters and histograms accumulated per thread.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        # {registration number: (thread, dict)}, a dict's own items are
+        # added and removed atomically while other threads register
+        self._stores = {}
+        self._registrations = itertools.count(1)
+        self._stopped = {}
+        self._lock = threading.Lock()
+
+    def _store(self):
+        try:
+            return self._local.store
+        except AttributeError:
+            store = self._local.store = {}
+            number = next(self._registrations)
+            self._stores[number] = (threading.current_thread(), store)
+            if number % FOLD_EVERY == 0:
+                self._fold()
+            return store
+
+    def _fold(self):
+        """
+        Adds the dicts of stopped threads up into one and returns the dicts
+        of the running ones.
+        """
+        running = []
+        with self._lock:
+            for number, (thread, store) in list(self._stores.items()):
+                if thread.is_alive():
+                    running.append(store)
+                    continue
+                # nothing adds to it anymore
+                del self._stores[number]
+                for key, value in store.items():
+                    add(self._stopped, key, value)
+        return running
+
+    def inc(self, name, labels=(), value=1):
+        """
+        Adds `value` to a counter; `labels` is a tuple of (name, value) pairs.
+        """
+        store = self._store()
+        key = (name, labels)
+        store[key] = store.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        """
+        Records `value` in a histogram.
+        """
+        store = self._store()
+        key = (name, labels)
+        histogram = store.get(key)
+        if histogram is None:
+            # a count per bucket, then one for +Inf, the sum and the count
+            histogram = store[key] = [0] * (len(buckets) + 3)
+        histogram[bisect.bisect_left(buckets, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def snapshot(self):
+        """
+        Returns the totals of every thread, {(name, labels): value or histogram}.
+        """
+        running = self._fold()
+        totals = {}
+        with self._lock:
+            for key, value in self._stopped.items():
+                add(totals, key, value)
+        for store in running:
+            # copying is atomic, the owning thread may be adding to it
+            for key, value in store.copy().items():
+                add(totals, key, value)
+        return totals
+
+    def clear(self):
+        with self._lock:
+            self._stopped.clear()
+            for _, store in list(self._stores.values()):
+                store.clear()
+
+
+def add(totals, key, value):
+    if isinstance(value, list):
+        histogram = totals.setdefault(key, [0] * len(value))
+        for i, count in enumerate(value):
+            histogram[i] += count
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+def to_rows(totals):
+    return [[name, [list(label) for label in labels], value] for (name, labels), value in totals.items()]
+
+
+def add_rows(totals, rows):
+    for name, labels, value in rows:
+        add(totals, (name, tuple(tuple(label) for label in labels)), value)
+
+
+def read_json(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    temporary = path.with_name('.%s.%d.%d' % (path.name, os.getpid(), threading.get_ident()))
+    temporary.write_text(json.dumps(data))
+    # readers never see a half written file
+    os.replace(temporary, path)
+
+
+metrics = Metrics()
+
+
+def collect():
+    """
+    Returns this process's metrics, including the response cache's counters.
+    """
+    from .cache import stats
+
+    totals = metrics.snapshot()
+    add(totals, ('cache_requests_total', (('cache', 'response'), ('result', 'hit'))), stats.hits)
+    add(totals, ('cache_requests_total', (('cache', 'response'), ('result', 'miss'))), stats.misses)
+    return totals
+
+
+# totals of the processes folded by mark_process_dead()
+STOPPED_FILE = 'stopped.json'
+
+
+class ProcessFiles:
+    """
+    Shares the totals of each process through files in METRICS_DIR.
+    """
+
+    def __init__(self):
+        # pids get reused, a new process must not overwrite an old one's file
+        self.name = '%d-%s.json' % (os.getpid(), uuid.uuid4().hex[:8])
+        self._flushed = 0
+        self._lock = threading.Lock()
+
+    def flush(self):
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        rows = to_rows(collect())
+        with self._lock:
+            self._flushed = time.monotonic()
+            write_json(directory / self.name, rows)
+
+    def maybe_flush(self):
+        if settings.METRICS_DIR and time.monotonic() - self._flushed >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def totals(self):
+        """
+        Returns the totals of every process.
+        """
+        if not settings.METRICS_DIR:
+            return collect()
+        self.flush()
+        directory = Path(settings.METRICS_DIR)
+        files = {}
+        for path in directory.glob('*.json'):
+            if path.name != STOPPED_FILE:
+                rows = read_json(path)
+                if rows is not None:
+                    files[path.name] = rows
+        # read after the files, so that a file folded into it meanwhile is
+        # either skipped or read from here, never counted twice or missed
+        stopped = read_json(directory / STOPPED_FILE) or {'files': [], 'rows': []}
+        totals = {}
+        add_rows(totals, stopped['rows'])
+        for name, rows in files.items():
+            if name not in stopped['files']:
+                add_rows(totals, rows)
+        return totals
+
+
+process_files = ProcessFiles()
+atexit.register(process_files.flush)
+
+
+def mark_process_dead(pid):
+    """
+    Folds the METRICS_DIR files of a process that has exited into the totals
+    of the stopped processes and deletes them. Call it from one process, the
+    process manager's, as its workers exit.
+    """
+    if not settings.METRICS_DIR:
+        return
+    directory = Path(settings.METRICS_DIR)
+    dead = list(directory.glob('%d-*.json' % pid))
+    if not dead:
+        return
+    stopped = read_json(directory / STOPPED_FILE) or {'files': [], 'rows': []}
+    totals = {}
+    add_rows(totals, stopped['rows'])
+    for path in dead:
+        add_rows(totals, read_json(path) or [])
+    # scrapes that read a file before it was deleted skip it by name
+    files = [name for name in stopped['files'] if (directory / name).exists()] + [path.name for path in dead]
+    write_json(directory / STOPPED_FILE, {'files': files, 'rows': to_rows(totals)})
+    for path in dead:
+        path.unlink()
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+
+
+def format_value(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition(totals):
+    """
+    Renders metrics in the Prometheus text format.
+    """
+    totals = dict(totals)
+    caches = {}
+    for (name, labels), value in totals.items():
+        if name == 'cache_requests_total':
+            labels = dict(labels)
+            counts = caches.setdefault(labels['cache'], [0, 0])
+            counts[0] += value if labels['result'] == 'hit' else 0
+            counts[1] += value
+    for cache, (hits, lookups) in caches.items():
+        if lookups:
+            totals[('cache_hit_ratio', (('cache', cache),))] = hits / lookups
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in totals.items() if metric == name)
+        if not series:
+            continue
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in series:
+            if kind != HISTOGRAM:
+                lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (math.inf,), value):
+                cumulative += count
+                bucket_labels = labels + (('le', format_value(float(bound))),)
+                lines.append('%s_bucket%s %d' % (name, format_labels(bucket_labels), cumulative))
+            lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(float(value[-2]))))
+            lines.append('%s_count%s %d' % (name, format_labels(labels), value[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+class _QueryCount:
+
+    def __init__(self):
+        self.count = 0
+
+
+_queries = ContextVar('request_queries', default=None)
+
+
+def _count_query(execute, sql, params, many, context):
+    queries = _queries.get()
+    if queries is not None:
+        queries.count += 1
+    return execute(sql, params, many, context)
+
+
+def _wrap_connection(sender, connection, **kwargs):
+    # sent again each time the connection reconnects; first in the list so
+    # that leaving an execute_wrapper() block still pops its own wrapper
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _count_query)
+
+
+def install():
+    """
+    Counts the queries of every connection, whichever thread runs them,
+    called once from ApiConfig.ready().
+    """
+    connection_created.connect(_wrap_connection, dispatch_uid='api.metrics')
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, status and query count of every request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        queries = _QueryCount()
+        token = _queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _queries.reset(token)
+        self.record(request, response, time.perf_counter() - start, queries.count)
+        return response
+
+    async def __acall__(self, request):
+        # the context var follows the request into the threads its sync
+        # parts run on, where the queries are
+        queries = _QueryCount()
+        token = _queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _queries.reset(token)
+        self.record(request, response, time.perf_counter() - start, queries.count)
+        return response
+
+    def record(self, request, response, elapsed, queries):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+        metrics.inc(
+            'http_requests_total',
+            (('view', view), ('method', request.method), ('status', str(response.status_code))),
+        )
+        metrics.observe('http_request_duration_seconds', (('view', view),), elapsed)
+        if queries:
+            metrics.inc('db_queries_total', (('view', view),), queries)
+        process_files.maybe_flush()
+
+
+def metrics_view(request):
+    """
+    Serves the metrics of every process to Prometheus. Set METRICS_TOKEN to
+    require it as a bearer token.
+    """
+    if settings.METRICS_TOKEN:
+        expected = 'Bearer %s' % settings.METRICS_TOKEN
+        if not constant_time_compare(request.headers.get('Authorization', ''), expected):
+            return HttpResponse(status=401)
+    return HttpResponse(
+        exposition(process_files.totals()), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -0,0 +1,184 @@
+"""
+Contains pagination classes for the API endpoints
+
+"""
+
+
+from base64 import b64decode, b64encode
+from collections import namedtuple
+from urllib import parse
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+KeysetCursor = namedtuple('KeysetCursor', ['reverse', 'value', 'pk'])
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on (ordering field, pk) instead of using an
+    OFFSET, so every page costs the same no matter how deep the client goes.
+
+    The client picks the ordering with `?ordering=` (prefix with `-` for
+    descending). The primary key is always used as the tie breaker, which keeps
+    the position unique even for fields like `price` or `rank` that repeat.
+
+    """
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering_param = 'ordering'
+    ordering_fields = ()
+    ordering = 'pk'
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Returns the requested ordering field as a one item tuple, falling back
+        to the default ordering when the field is not one of `ordering_fields`.
+        """
+        ordering = request.query_params.get(self.ordering_param, '').strip()
+        if ordering.lstrip('-') in self.ordering_fields:
+            return (ordering,)
+        return (self.ordering,)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.field_name = self.ordering[0].lstrip('-')
+        descending = self.ordering[0].startswith('-')
+
+        self.cursor = self.decode_cursor(request, queryset.model)
+        reverse = self.cursor is not None and self.cursor.reverse
+
+        # walking backwards is done by flipping the ordering and reversing the
+        # page again before it is returned.
+        if reverse != descending:
+            queryset = queryset.order_by('-' + self.field_name, '-pk')
+        else:
+            queryset = queryset.order_by(self.field_name, 'pk')
+
+        if self.cursor is not None:
+            queryset = queryset.filter(self._seek(self.cursor, reverse != descending))
+
+        # fetch one extra row to find out if there is a page after this one.
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = True
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = self.cursor is not None
+
+        if self.page:
+            self.next_position = self._get_position_from_instance(self.page[-1], self.ordering)
+            self.previous_position = self._get_position_from_instance(self.page[0], self.ordering)
+        elif self.cursor is not None:
+            # an empty page reached through a cursor links back to the
+            # position we came from.
+            self.next_position = self.previous_position = self.cursor[1:]
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def _seek(self, cursor, descending):
+        """
+        Builds the filter that selects the rows after the cursor position.
+
+        The redundant `gte`/`lte` bound lets the database use the
+        (field, id) index as a range scan instead of evaluating the OR.
+        """
+        if descending:
+            bound, after = '__lte', '__lt'
+        else:
+            bound, after = '__gte', '__gt'
+        return Q(**{self.field_name + bound: cursor.value}) & (
+            Q(**{self.field_name + after: cursor.value}) |
+            Q(**{self.field_name: cursor.value, 'pk' + after: cursor.pk})
+        )
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        value, pk = self.next_position
+        return self.encode_cursor(KeysetCursor(reverse=False, value=value, pk=pk))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        value, pk = self.previous_position
+        return self.encode_cursor(KeysetCursor(reverse=True, value=value, pk=pk))
+
+    def decode_cursor(self, request, model=None):
+        """
+        Given a request with a cursor, return a `KeysetCursor` instance with
+        the position converted back into python values.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            value = tokens['p'][0]
+            pk = int(tokens['k'][0])
+            if model is not None:
+                value = model._meta.get_field(self.field_name).to_python(value)
+        except (TypeError, ValueError, KeyError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return KeysetCursor(reverse=reverse, value=value, pk=pk)
+
+    def encode_cursor(self, cursor):
+        """
+        Given a KeysetCursor instance, return an url with encoded cursor.
+        """
+        tokens = {'p': str(cursor.value), 'k': str(cursor.pk)}
+        if cursor.reverse:
+            tokens['r'] = '1'
+
+        querystring = parse.urlencode(tokens, doseq=True)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, dict):
+            return instance[self.field_name], instance['pk']
+        return getattr(instance, self.field_name), instance.pk
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    """
+    Pagination for the product list, orderable by price, rank or creation time.
+    """
+
+    ordering_fields = ('price', 'rank', 'created_time')
+    ordering = '-created_time'
+
+
+class ProductSearchPagination(PageNumberPagination):
+    """
+    Pagination for search results. Ranked results have no stable position
+    to seek from, so these are paged by number; the result sets are small.
+    """
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,69 @@
+"""
+Contains the request parsers of the API
+
+"""
+
+
+import codecs
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.utils import json
+
+from .renderers import MessagePackRenderer, ORJSONRenderer, msgpack, orjson
+
+
+# orjson reads integers beyond 64 bits as floats, bodies with numbers that
+# long are left to the json module (the digits may as well be in a string);
+# every digit is turned into a 0 to find them, several times faster than a
+# regular expression
+DIGITS = bytes.maketrans(b'123456789', b'000000000')
+LONG_NUMBER = b'0' * 19
+
+
+class ORJSONParser(JSONParser):
+    """
+    `JSONParser` on orjson, accepting and returning the same data.
+
+    Bodies orjson rejects are parsed again with the json module, which is
+    a little more lenient (lone surrogates, other encodings) and gives the
+    same error messages as before, and so are bodies that may hold
+    integers over 64 bits. Without orjson installed this is a plain
+    `JSONParser`.
+    """
+
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None or not self.strict:
+            return super().parse(stream, media_type, parser_context)
+
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        body = stream.read()
+        try:
+            if codecs.lookup(encoding).name == 'utf-8' and LONG_NUMBER not in body.translate(DIGITS):
+                return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            pass
+
+        try:
+            return json.loads(body.decode(encoding), parse_constant=json.strict_constant)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parses `application/msgpack` bodies. Requires msgpack.
+    """
+
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read())
+        except (ValueError, msgpack.UnpackException) as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
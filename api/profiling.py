@@ -0,0 +1,203 @@
+"""
+Profiles of slow requests, captured from real traffic.
+
+A profiler has to be running before it is known whether a request will be
+slow, so `ProfilingMiddleware` profiles a sample of the requests,
+PROFILE_SAMPLE_RATE of them (0 turns it off), and keeps the profiles of
+those that took PROFILE_SLOW_MS or longer. A request with a valid
+X-Profile header is always profiled and kept; `manage.py profile_report
+--token` prints a header value, valid for PROFILE_TOKEN_MAX_AGE seconds.
+
+Profiles are written to PROFILE_DIR as cProfile/pstats files named after
+the view that served the request, e.g.
+
+    ProductListAPIView.1700000000123.231ms.4242.prof
+
+and only the newest PROFILE_MAX_FILES are kept. With PROFILE_COLLAPSED
+the request's stack is also sampled every PROFILE_STACK_INTERVAL
+seconds and written next to it in collapsed stack format
+(`frame;frame;frame count` lines), which flame graph tools read.
+`manage.py profile_report` aggregates the pstats files.
+
+cProfile follows a single thread. Under ASGI a profiled request runs the
+rest of the middleware chain through `async_to_sync` on the thread sync
+views run on, so its sync code is profiled there; requests that aren't
+profiled stay async.
+
+"""
+
+
+import cProfile
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+_signer = signing.TimestampSigner(salt='api.profiling')
+
+
+def profile_token():
+    """
+    Returns an X-Profile header value that forces a request to be profiled.
+    """
+    return _signer.sign('profile')
+
+
+def has_profile_token(request):
+    value = request.headers.get(PROFILE_HEADER)
+    if not value:
+        return False
+    try:
+        _signer.unsign(value, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def view_name(request):
+    """
+    Returns the name of the view class (or function) that served `request`.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    func = match.func
+    view = getattr(func, 'view_class', None) or getattr(func, 'cls', None) or func
+    return getattr(view, '__name__', 'unknown')
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return '%s:%s' % (frame.f_globals.get('__name__', code.co_filename), code.co_name)
+
+
+class StackSampler:
+    """
+    Samples one thread's stack from a background thread and counts the
+    stacks in collapsed format.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return ''.join('%s %d\n' % item for item in sorted(self.stacks.items()))
+
+
+def rotate(directory, keep):
+    """
+    Deletes all but the `keep` newest profiles in `directory`.
+    """
+    profiles = sorted(directory.glob('*.prof'), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in profiles[keep:]:
+        for stale in (path, path.with_suffix('.collapsed')):
+            try:
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def save_profile(profiler, view, elapsed, sampler=None):
+    """
+    Writes the profile of a request to PROFILE_DIR and returns its path.
+    """
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / ('%s.%d.%dms.%d.prof' % (view, time.time_ns() // 1000000, elapsed * 1000, os.getpid()))
+    profiler.dump_stats(path)
+    if sampler is not None:
+        path.with_suffix('.collapsed').write_text(sampler.collapsed())
+    rotate(directory, settings.PROFILE_MAX_FILES)
+    return path
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a sample of the requests and keeps the slow ones.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        forced = has_profile_token(request)
+        if not forced and not self.sampled():
+            return self.get_response(request)
+        return self.profile(request, self.get_response, forced)
+
+    async def __acall__(self, request):
+        forced = has_profile_token(request)
+        if not forced and not self.sampled():
+            return await self.get_response(request)
+        return await sync_to_async(self.profile)(request, async_to_sync(self.get_response), forced)
+
+    def sampled(self):
+        rate = settings.PROFILE_SAMPLE_RATE
+        return rate > 0 and (rate >= 1 or random.random() < rate)
+
+    def profile(self, request, get_response, forced):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active, newer pythons allow only one
+            return get_response(request)
+        sampler = None
+        if settings.PROFILE_COLLAPSED:
+            sampler = StackSampler(threading.get_ident(), settings.PROFILE_STACK_INTERVAL)
+            sampler.start()
+        start = time.perf_counter()
+        try:
+            response = get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+
+        if forced or elapsed * 1000 >= settings.PROFILE_SLOW_MS:
+            try:
+                save_profile(profiler, view_name(request), elapsed, sampler)
+            except OSError:
+                logger.warning('Could not save the request profile', exc_info=True)
+        return response
@@ -0,0 +1,116 @@
+"""
+Query budget instrumentation.
+
+`query_budget` counts the queries run inside a block (or decorated function)
+and fails when there are more than allowed. It hooks into the connection's
+execute wrappers, so it works without DEBUG and outside of tests.
+
+`QueryBudgetTestMixin` checks the API endpoints against the budgets declared
+in `api.urls.QUERY_BUDGETS`.
+
+"""
+
+
+from contextlib import ContextDecorator
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.urls import reverse
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    """
+    Execute wrapper that counts the queries run on a connection.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.queries = []
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connections[self.using].execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+
+
+class query_budget(ContextDecorator):
+    """
+    Raises `QueryBudgetExceeded` when the wrapped code runs more than
+    `max_queries` queries.
+
+        with query_budget(2):
+            ...
+
+        @query_budget(2)
+        def view(request):
+            ...
+
+    """
+
+    def __init__(self, max_queries, using=DEFAULT_DB_ALIAS, label=None):
+        self.max_queries = max_queries
+        self.using = using
+        self.label = label
+
+    def __enter__(self):
+        self.counter = QueryCounter(self.using).__enter__()
+        return self.counter
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.counter.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and self.counter.count > self.max_queries:
+            raise QueryBudgetExceeded(
+                '%s ran %d queries, the budget is %d:\n%s' % (
+                    self.label or 'Block',
+                    self.counter.count,
+                    self.max_queries,
+                    '\n'.join(
+                        '%d. %s' % (i, sql) for i, sql in enumerate(self.counter.queries, start=1)
+                    ),
+                )
+            )
+        return False
+
+
+class QueryBudgetTestMixin:
+    """
+    Test case mixin to request an endpoint within its declared query budget.
+    """
+
+    def assertQueryBudget(self, name, method='get', kwargs=None, client=None, **extra):
+        """
+        Requests the `api:<name>` endpoint and fails the test if it goes over
+        the budget declared for that method in `api.urls.QUERY_BUDGETS`.
+        """
+        from .urls import QUERY_BUDGETS
+
+        method = method.upper()
+        budget = QUERY_BUDGETS.get(name, {}).get(method)
+        if budget is None:
+            self.fail('No query budget declared for %s %s' % (method, name))
+
+        url = reverse('api:%s' % name, kwargs=kwargs)
+        client = client or self.client
+        try:
+            with query_budget(budget, label='%s %s' % (method, url)):
+                response = getattr(client, method.lower())(url, **extra)
+                if response.streaming:
+                    # streamed bodies are read from the database as they go out
+                    response.streaming_content = [b''.join(response.streaming_content)]
+        except QueryBudgetExceeded as e:
+            self.fail(str(e))
+        return response
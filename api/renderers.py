@@ -0,0 +1,85 @@
+"""
+Contains the response renderers of the API
+
+"""
+
+
+from decimal import Decimal
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# datetimes go through the DRF encoder so they keep their format, e.g. 'Z'
+# for UTC, and dict keys that aren't strings are converted like json does
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    `JSONRenderer` on orjson, rendering the same bytes several times faster.
+
+    Values orjson has no native support for, like Decimal, datetimes and
+    lazy strings, are converted by the DRF encoder, as they are today.
+    Output orjson can't produce identically, indented or ASCII only
+    output, and data it can't encode, like integers over 64 bits, fall
+    back to the json module. The one difference left is floats under
+    1e-4 or from 1e16 on, written as e.g. 1e16 instead of 1e+16; the API
+    has no such numbers. Without orjson installed this is a plain
+    `JSONRenderer`.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact or not self.strict:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # escaped like JSONRenderer does, to stay a strict javascript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renders `application/msgpack`, smaller than JSON and faster to encode
+    and decode, for the clients that ask for it.
+
+    The data is the same as in JSON: Decimal values are sent as strings,
+    like the serializers' DecimalFields already do, so prices keep every
+    digit, and datetimes and the other values the DRF encoder knows are
+    converted by it, as they are for JSON. Requires msgpack.
+    """
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    encoder_class = encoders.JSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=self.default)
+
+    def default(self, obj):
+        # the json encoder would send Decimal values as floats
+        if isinstance(obj, Decimal):
+            return str(obj)
+        return self.encoder_class().default(obj)
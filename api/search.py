@@ -0,0 +1,111 @@
+"""
+Product name search.
+
+PostgreSQL matches the terms against an expression GIN index on the name's
+tsvector and, when pg_trgm is installed, also matches close spellings
+through a trigram index. SQLite, used for local development, matches
+against the `product_search` FTS5 table instead. Both indexes are created
+by product/migrations/0006_product_search.py and are kept up to date by
+the database on every write, so there is nothing to rebuild.
+
+"""
+
+
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models import BooleanField, F, FloatField, Func, Q, Value
+from django.db.models.expressions import RawSQL
+
+
+SEARCH_CONFIG = 'english'
+
+_has_trigram = {}
+
+
+class TrigramWordMatch(Func):
+    """
+    `name %> query`: some part of the name is spelled like the query.
+    The indexed column has to be on the left to use the trigram index.
+    """
+
+    arg_joiner = ' %%> '
+    template = '%(expressions)s'
+    output_field = BooleanField()
+
+
+class TrigramWordSimilarity(Func):
+    function = 'word_similarity'
+    output_field = FloatField()
+
+
+def search_terms(q):
+    """
+    Splits the query into words, dropping everything the search syntaxes
+    would treat as an operator.
+    """
+    return re.findall(r'\w+', q)[:10]
+
+
+def has_trigram(using):
+    """
+    Returns whether the pg_trgm extension is installed, checked once per
+    process.
+    """
+    if using not in _has_trigram:
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _has_trigram[using] = cursor.fetchone() is not None
+    return _has_trigram[using]
+
+
+def search_products(queryset, q):
+    """
+    Filters a product queryset down to the products whose name matches the
+    query, best matches first. Every word has to match, the last one may be
+    a prefix so results show up while the client is still typing.
+    """
+    terms = search_terms(q)
+    if not terms:
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        queryset = _postgres_search(queryset, terms)
+    elif vendor == 'sqlite':
+        queryset = _sqlite_search(queryset, terms)
+    else:
+        for term in terms:
+            queryset = queryset.filter(name__icontains=term)
+        queryset = queryset.annotate(relevance=Value(0.0, output_field=FloatField()))
+    return queryset.order_by('-relevance', 'pk')
+
+
+def _postgres_search(queryset, terms):
+    query = SearchQuery(
+        ' & '.join(terms[:-1] + [terms[-1] + ':*']), config=SEARCH_CONFIG, search_type='raw'
+    )
+    queryset = queryset.alias(search=SearchVector('name', config=SEARCH_CONFIG))
+    rank = SearchRank(F('search'), query)
+
+    if not has_trigram(queryset.db):
+        return queryset.filter(search=query).annotate(relevance=rank)
+
+    # typos never match in full-text search, trigrams catch those
+    words = ' '.join(terms)
+    return queryset.filter(
+        Q(search=query) | Q(TrigramWordMatch('name', Value(words)))
+    ).annotate(relevance=rank + TrigramWordSimilarity(Value(words), 'name'))
+
+
+def _sqlite_search(queryset, terms):
+    match = ' '.join('"%s"' % term for term in terms) + '*'
+    return queryset.filter(
+        pk__in=RawSQL('SELECT rowid FROM product_search WHERE product_search MATCH %s', (match,))
+    ).annotate(relevance=RawSQL(
+        # bm25 is lower for better matches
+        'SELECT -bm25(product_search) FROM product_search '
+        'WHERE product_search MATCH %s AND rowid = product_product.id',
+        (match,), output_field=FloatField(),
+    ))
@@ -3,10 +3,13 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from product.models import *
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.db import IntegrityError, transaction
 from django.utils.encoding import force_str
 from django.utils.http import urlsafe_base64_decode
 from rest_framework import serializers
 from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt import serializers as jwt_serializers
+from .tokens import RefreshToken
 
 
 User = get_user_model()
@@ -63,6 +66,16 @@ class LoginSerializer(serializers.Serializer):
         raise serializers.ValidationError("Incorrect Credentials")
 
 
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """
+    Serializer class to refresh access tokens, checking the blacklist
+    through the in-process filter.
+
+    """
+
+    token_class = RefreshToken
+
+
 class PasswordResetSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
@@ -105,34 +118,98 @@ class ProductCreateUpdateSerializer(serializers.ModelSerializer):
             'rank'       
         )
 
+    def validate_category(self, value):
+        instance = self.instance
+        if instance is not None and value.pk != instance.category_id and instance.wishlist_conflicts(value.pk).exists():
+            raise serializers.ValidationError(
+                'Wishlists holding this product already hold a product of this category.'
+            )
+        return value
+
 
 
 class CategorySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Category
-        fields = '__all__'
+        fields = ('id', 'name')
+
 
 
 
+class BulkPrimaryKeyRelatedField(serializers.ManyRelatedField):
+    """
+    Many primary key related field that looks up all the submitted keys in a
+    single query, instead of one query per key.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        pks = []
+        for pk in data:
+            try:
+                if isinstance(pk, bool):
+                    raise TypeError
+                value = int(pk)
+                # int() truncates 1.5 to 1, numbers must be whole
+                if not isinstance(pk, str) and value != pk:
+                    raise ValueError
+                pks.append(value)
+            except (TypeError, ValueError):
+                self.child_relation.fail('incorrect_type', data_type=type(pk).__name__)
+
+        objects = self.child_relation.get_queryset().in_bulk(set(pks))
+        for pk in pks:
+            if pk not in objects:
+                self.child_relation.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in pks]
+
+
 
 class WishListSerializer(serializers.ModelSerializer):
-    products = serializers.PrimaryKeyRelatedField(many=True, queryset=Product.objects.all())
+    products = BulkPrimaryKeyRelatedField(
+        child_relation=serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
+    )
 
     class Meta:
         model = WishList
         fields = ('products',)
 
 
+    def validate_products(self, products):
+        """
+        Checks the submitted products against each other and against the
+        categories already in the wishlist, in one query.
+        """
+        categories = [product.category_id for product in products]
+        if len(set(categories)) != len(categories):
+            raise serializers.ValidationError('Cannot add multiple products from the same category')
+
+        if self.instance is not None and self.instance.products.filter(category__in=categories).exists():
+            raise serializers.ValidationError('Cannot add multiple products from the same category')
+        return products
+
+
     def update(self, instance, validated_data):
         
         products = validated_data.pop('products')
-        instance.save()
-        for product in products:
-            if not instance.products.filter(category=product.category).exists():
-                instance.products.add(product)
-            else:
-                raise serializers.ValidationError('Cannot add multiple products from the same category')
+        try:
+            with transaction.atomic():
+                WishListItem.objects.bulk_create([
+                    WishListItem(wishlist=instance, product=product, category_id=product.category_id)
+                    for product in products
+                ])
+                # bulk_create doesn't send m2m_changed
+                instance.touch()
+        except IntegrityError:
+            # a concurrent update got a product from the same category in first
+            raise serializers.ValidationError(
+                {'products': ['Cannot add multiple products from the same category']}
+            )
         return instance
 
 
@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_login_failed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from product.models import Category, Product
+
+from .authentication import invalidate_user
+from .cache import bump_catalog_version
+from .metrics import metrics
+
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_catalog_cache(sender, **kwargs):
+    """
+    Invalidates the cached product and category responses.
+    """
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Drops the user from the authentication cache when a change could lock
+    them out. Saves of other fields only, like last_login, leave it be.
+    """
+    if created:
+        return
+    if update_fields is not None and not {'password', 'is_active'}.intersection(update_fields):
+        return
+    invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(user_login_failed)
+def count_login_failure(sender, **kwargs):
+    metrics.inc('auth_failures_total', (('kind', 'credentials'),))
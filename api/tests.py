@@ -1,8 +1,53 @@
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipIf
+from asgiref.sync import async_to_sync
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient, APITestCase
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.urls import reverse
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils.translation import gettext_lazy
+from accounts.activity import get_activity_buffer
+from product import similar_products
 from product.models import *
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import UserCache, user_cache
+from .cache import stats as cache_stats
+from .hashing import hashing_pool_view
+from .metrics import FOLD_EVERY, mark_process_dead, metrics
+from .parsers import MessagePackParser, ORJSONParser
+from .renderers import MessagePackRenderer, ORJSONRenderer, msgpack, orjson
+from .serializers import ProductSerializer, WishListSerializer
+from .values import ValuesMapper
+from .export import buffered, csv_lines, export_rows, ndjson_lines
+from .search import has_trigram
+from .tokens import BLACKLIST_ENTRY_KEY, BLACKLIST_SEQUENCE_KEY, BloomFilter, _publish, blacklist_filter, filter_enabled
+from .query_budget import QueryBudgetExceeded, QueryBudgetTestMixin, query_budget
+from .urls import QUERY_BUDGETS, urlpatterns
 
 
 User = get_user_model()
@@ -58,13 +103,120 @@ class TestLoginAPI(APITestCase):
         self.assertEqual(response.data['email'], 'test@gmail.com')
         # check if user gets authenticated
         self.assertTrue(response.wsgi_request.user.is_authenticated)
+        self.assertEqual(Session.objects.count(), 1)
 
+    @override_settings(API_LOGIN_STATELESS=1)
+    def test_stateless_login(self):
+        data = {
+            'email': 'test@gmail.com',
+            'password': 'testpass'
+        }
+        response = client.post(self.url, data=data, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data['tokens'])
+        # no session is started, but the login is still recorded
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(Session.objects.count(), 0)
+        get_activity_buffer().flush()
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
+
+
+
+
+# tests for password hashing on login
+class TestLoginHashing(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@gmail.com',
+            password='testpass'
+        )
+        self.url = reverse('api:login')
+
+    def login(self, email='test@gmail.com', password='testpass'):
+        return client.post(self.url, data={'email': email, 'password': password}, format='json')
+
+    def test_login_hashes_once(self):
+        for email, status_code in (('test@gmail.com', 200), ('nobody@gmail.com', 400)):
+            with self.subTest(email=email):
+                with mock.patch.object(
+                    PBKDF2PasswordHasher, 'encode', autospec=True, side_effect=PBKDF2PasswordHasher.encode
+                ) as encode:
+                    response = self.login(email)
+                self.assertEqual(response.status_code, status_code)
+                self.assertEqual(encode.call_count, 1)
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+    ])
+    def test_outdated_hash_is_rehashed(self):
+        self.user.password = make_password('testpass', hasher='md5')
+        self.user.save()
+
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_hashing_pool(self):
+        def view(request):
+            return HttpResponse(threading.current_thread().name)
+
+        self.assertIs(hashing_pool_view(view), view)
+        with override_settings(PASSWORD_HASHING_WORKERS=2):
+            pooled = hashing_pool_view(view)
+
+        self.assertTrue(asyncio.iscoroutinefunction(pooled))
+        response = async_to_sync(pooled)(RequestFactory().get('/'))
+        self.assertTrue(response.content.startswith(b'password-hashing'))
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    def test_hashing_pool_under_asgi(self):
+        started = threading.Event()
+        hashed = threading.Event()
+
+        def login(request):
+            # stands in for a hash that takes until the other request is done
+            started.set()
+            return HttpResponse(str(hashed.wait(5)))
+
+        def other(request):
+            return HttpResponse()
+
+        with override_settings(PASSWORD_HASHING_WORKERS=2):
+            login = hashing_pool_view(login)
+
+        class urls:
+            urlpatterns = [path('login/', login), path('other/', other)]
+
+        async def requests():
+            async_client = AsyncClient()
+            login = asyncio.ensure_future(async_client.get('/login/'))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            response = await async_client.get('/other/')
+            hashed.set()
+            return response, await login
+
+        # every middleware is async, so the login waits on the pool rather
+        # than on the thread sync views run on, and the other request goes by
+        with override_settings(ROOT_URLCONF=urls), self.assertLogs('api.timing'):
+            response, login_response = async_to_sync(requests)()
+        self.assertEqual(login_response.content, b'True')
+        self.assertIn('Server-Timing', response)
+        self.assertIn('Server-Timing', login_response)
 
 
 
 
 # for jwt auth
 class TestCaseBase(APITestCase):
+    def setUp(self):
+        # cached catalog responses outlive the rolled back test data
+        cache.clear()
+
     @property
     def bearer_token(self):
         
@@ -95,10 +247,11 @@ class TestCategoryAPI(TestCaseBase):
 
         # Check the response status code and content
         self.assertEqual(response.status_code, 201)
-        self.assertEqual(response.data, {'id': 1, 'name': 'Test Category'})
+        category = Category.objects.get()
+        self.assertEqual(response.data, {'id': category.id, 'name': 'Test Category'})
 
         # Check that the category was created in the database
-        category = Category.objects.get(id=1)
+        category = Category.objects.get(id=response.data['id'])
         self.assertEqual(category.name, 'Test Category')
 
 
@@ -159,6 +312,7 @@ class TestCategoryAPI(TestCaseBase):
 # tests for product endpoints
 class TestProductAPI(TestCaseBase):
     def setUp(self):
+        super().setUp()
         self.cat = Category.objects.create(
             name = "test_category"
         )
@@ -187,7 +341,7 @@ class TestProductAPI(TestCaseBase):
         self.assertEqual(response.data['rank'], 3)
 
         # Check that the product was created in the database
-        product = Product.objects.get(id=1)
+        product = Product.objects.latest('id')
         self.assertEqual(product.name, 'Test Product')
         self.assertEqual(product.price, 100)
 
@@ -264,6 +418,7 @@ class TestGetWishlistByIdentifier(APITestCase):
 
 class TestWishListAPI(TestCaseBase):
     def setUp(self):
+        super().setUp()
         self.client = APIClient()
         self.user = User.objects.create_user(
             email='test@gmail.com', password='testpass'
@@ -326,6 +481,48 @@ class TestWishListAPI(TestCaseBase):
         self.assertEqual(response.data['products'], [self.product1.id, self.product2.id])
 
 
+    def test_add_products_from_same_category(self):
+        url = reverse('api:wishlist')
+        product3 = Product.objects.create(
+            name = "test_product3",
+            price = 15.00,
+            rank = 3,
+            category = self.cat1,
+        )
+
+        # nothing is added when one of the submitted products is rejected
+        response = self.client.patch(
+            url, data={'products': [self.product2.pk, self.product1.pk, product3.pk]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(self.wishlist.products.all()), [])
+
+        self.wishlist.products.add(self.product1)
+        response = self.client.patch(url, data={'products': [product3.pk]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(self.wishlist.products.all()), [self.product1])
+
+    def test_add_missing_product_to_wishlist(self):
+        url = reverse('api:wishlist')
+
+        response = self.client.patch(url, data={'products': [self.product1.pk, 999]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(self.wishlist.products.all()), [])
+
+    def test_add_non_integral_product_to_wishlist(self):
+        url = reverse('api:wishlist')
+
+        for pk in (self.product1.pk + 0.5, str(self.product1.pk + 0.5), True):
+            response = self.client.patch(url, data={'products': [pk]}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(list(self.wishlist.products.all()), [])
+
+        # whole numbers are fine, whatever their type
+        response = self.client.patch(url, data={'products': [float(self.product1.pk)]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(self.wishlist.products.all()), [self.product1])
+
+
     def test_remove_product_from_wishlist(self):
 
         self.wishlist.products.add(self.product1, self.product2)
@@ -337,4 +534,1406 @@ class TestWishListAPI(TestCaseBase):
 
         # Check the response status code and content
         self.assertEqual(response.status_code, 204)
-        self.assertEqual(list(self.wishlist.products.all()), [self.product2])
\ No newline at end of file
+        self.assertEqual(list(self.wishlist.products.all()), [self.product2])
+
+
+
+# tests for product list pagination
+class TestProductListPagination(APITestCase):
+    def setUp(self):
+        self.cat = Category.objects.create(
+            name = "test_category"
+        )
+        # prices repeat so the pk has to break ties between pages
+        self.products = [
+            Product.objects.create(
+                name=f'product{i}',
+                price=10 + i % 5,
+                rank=i % 3,
+                category=self.cat
+            )
+            for i in range(25)
+        ]
+        self.url = reverse('api:product-list')
+
+    def walk(self, url, link='next'):
+        names = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = [item['name'] for item in response.data['results']]
+            names = names + page if link == 'next' else page + names
+            url = response.data[link]
+        return names, response
+
+    def test_pages_follow_ordering(self):
+        names, _ = self.walk(self.url + '?ordering=price&page_size=4')
+
+        expected = sorted(self.products, key=lambda p: (p.price, p.pk))
+        self.assertEqual(names, [p.name for p in expected])
+
+    def test_previous_links_walk_back(self):
+        names, last = self.walk(self.url + '?ordering=-rank&page_size=6')
+        self.assertIsNone(last.data['next'])
+
+        # walk back from the last page using the previous links
+        back, first = self.walk(last.data['previous'], link='previous')
+        self.assertIsNone(first.data['previous'])
+        self.assertEqual(back + [item['name'] for item in last.data['results']], names)
+
+    def test_pagination_with_price_filter(self):
+        names, _ = self.walk(self.url + '?price_gt=11&price_lt=14&ordering=price&page_size=3')
+
+        expected = sorted(
+            (p for p in self.products if 11 < p.price < 14), key=lambda p: (p.price, p.pk)
+        )
+        self.assertEqual(names, [p.name for p in expected])
+
+    def test_deep_pages_do_not_use_offset(self):
+        response = client.get(self.url + '?ordering=created_time&page_size=2')
+        for _ in range(5):
+            response = client.get(response.data['next'])
+
+        with CaptureQueriesContext(connection) as queries:
+            client.get(response.data['next'])
+        self.assertNotIn('OFFSET', queries[0]['sql'].upper())
+
+    def test_invalid_cursor(self):
+        response = client.get(self.url + '?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+    def test_empty_and_single_first_pages(self):
+        response = client.get(self.url + '?price_gt=1000')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+        self.assertIsNone(response.data['next'])
+        self.assertIsNone(response.data['previous'])
+
+        response = client.get(self.url + '?page_size=100')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 25)
+        self.assertIsNone(response.data['next'])
+
+
+
+
+# tests for query budgets
+class TestQueryBudgets(QueryBudgetTestMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@gmail.com', password='testpass'
+        )
+        self.wishlist = WishList.objects.create(
+            user=self.user
+        )
+        self.refresh = RefreshToken.for_user(self.user)
+        self.auth = {"HTTP_AUTHORIZATION": f'Bearer {self.refresh.access_token}'}
+
+    def seed(self, rows, add_to_wishlist=True):
+        # one product per category so they can all go in the wishlist
+        products = []
+        for i in range(rows):
+            cat = Category.objects.create(name=f'category{i}')
+            products.append(Product.objects.create(
+                name=f'product{i}', price=i + 1, rank=i, category=cat
+            ))
+        if add_to_wishlist:
+            self.wishlist.products.add(*products)
+        return products
+
+    def test_every_endpoint_has_a_budget(self):
+        self.assertEqual({pattern.name for pattern in urlpatterns}, set(QUERY_BUDGETS))
+
+    def test_budget_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(1):
+                list(Category.objects.all())
+                list(Product.objects.all())
+
+    def test_read_endpoints_run_in_constant_queries(self):
+        for rows in (1, 30):
+            with self.subTest(rows=rows):
+                product = self.seed(rows)[-1]
+                self.assertQueryBudget('product-list', data={'page_size': 100})
+                self.assertQueryBudget('product-detail', kwargs={'pk': product.pk})
+                self.assertQueryBudget('product-similar', kwargs={'pk': product.pk}, data={'price_lt': 100})
+                self.assertQueryBudget('product-export', **self.auth)
+                self.assertQueryBudget('product-search', data={'q': 'product'})
+                self.assertQueryBudget('product-facets')
+                self.assertQueryBudget('category-list-create', **self.auth)
+                self.assertQueryBudget('category-top-products', kwargs={'pk': product.category_id})
+                self.assertQueryBudget('wishlist', **self.auth)
+                self.assertQueryBudget('wishlist-recommendations', **self.auth)
+                self.assertQueryBudget(
+                    'wishlist-view-by-identifier', kwargs={'user': self.user.email}
+                )
+
+    def test_wishlist_update_runs_in_constant_queries(self):
+        for rows in (1, 30):
+            with self.subTest(rows=rows):
+                self.wishlist.products.clear()
+                products = self.seed(rows, add_to_wishlist=False)
+                data = {'products': [product.pk for product in products]}
+
+                response = self.assertQueryBudget(
+                    'wishlist', 'patch', data=data, format='json', **self.auth
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['products']), rows)
+
+                self.wishlist.products.clear()
+                response = self.assertQueryBudget(
+                    'wishlist', 'put', data=data, format='json', **self.auth
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_write_endpoints(self):
+        product = self.seed(3)[-1]
+        category = Category.objects.create(name='Test Category')
+
+        response = self.assertQueryBudget(
+            'product-create', 'post', format='json',
+            data={'name': 'p', 'price': 1, 'rank': 1, 'category': category.pk},
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.assertQueryBudget(
+            'product-update', 'patch', kwargs={'pk': product.pk},
+            data={'name': 'Updated Product'}, format='json', **self.auth
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.assertQueryBudget(
+            'wishlist-product-delete-view', 'put', kwargs={'pk': product.pk}, **self.auth
+        )
+        self.assertEqual(response.status_code, 204)
+        response = self.assertQueryBudget(
+            'product-delete', 'delete', kwargs={'pk': product.pk}, **self.auth
+        )
+        self.assertEqual(response.status_code, 204)
+
+        response = self.assertQueryBudget(
+            'category-list-create', 'post', data={'name': 'c'}, format='json', **self.auth
+        )
+        self.assertEqual(response.status_code, 201)
+        for method, status_code in (('get', 200), ('put', 200), ('delete', 204)):
+            response = self.assertQueryBudget(
+                'category-retrive-update-destroy', method, kwargs={'pk': category.pk},
+                data={'name': 'Updated Category'}, format='json', **self.auth
+            )
+            self.assertEqual(response.status_code, status_code)
+
+    def test_category_delete_runs_in_constant_queries(self):
+        for rows in (1, 30):
+            with self.subTest(rows=rows):
+                category = Category.objects.create(name='deleted')
+                products = [
+                    Product.objects.create(name=f'product{i}', price=1, rank=i, category=category)
+                    for i in range(rows)
+                ]
+                self.wishlist.products.add(products[0])
+                before = WishList.objects.get(pk=self.wishlist.pk).updated_time
+
+                response = self.assertQueryBudget(
+                    'category-retrive-update-destroy', 'delete', kwargs={'pk': category.pk}, **self.auth
+                )
+                self.assertEqual(response.status_code, 204)
+                self.assertFalse(Product.objects.filter(category=category.pk).exists())
+                self.assertGreater(WishList.objects.get(pk=self.wishlist.pk).updated_time, before)
+
+    @override_settings(TOP_PRODUCTS_PER_CATEGORY=2)
+    def test_product_writes_with_full_top_products(self):
+        first, second = Category.objects.create(name='first'), Category.objects.create(name='second')
+        for i in range(3):
+            Product.objects.create(name=f'first{i}', price=1, rank=i, category=first)
+            Product.objects.create(name=f'second{i}', price=1, rank=i, category=second)
+        product = Product.objects.filter(category=first).order_by('rank').first()
+
+        # out of the top of one category, into the top of the other
+        response = self.assertQueryBudget(
+            'product-update', 'patch', kwargs={'pk': product.pk},
+            data={'category': second.pk, 'rank': -1}, format='json', **self.auth
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.assertQueryBudget(
+            'product-create', 'post', format='json',
+            data={'name': 'p', 'price': 1, 'rank': -2, 'category': second.pk},
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.assertQueryBudget(
+            'product-delete', 'delete', kwargs={'pk': product.pk}, **self.auth
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(TopProduct.objects.filter(category=second).count(), 2)
+
+    def test_auth_endpoints(self):
+        response = self.assertQueryBudget(
+            'signup', 'post', data={'email': 'new@gmail.com', 'password': 'testpass'}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.assertQueryBudget(
+            'login', 'post', data={'email': 'test@gmail.com', 'password': 'testpass'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.assertQueryBudget(
+            'token_refresh', 'post', data={'refresh': str(self.refresh)}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.assertQueryBudget(
+            'logout', 'post', data={'refresh': str(self.refresh)}, format='json', **self.auth
+        )
+        self.assertEqual(response.status_code, 205)
+
+        response = self.assertQueryBudget(
+            'password-reset', 'post', data={'email': 'test@gmail.com'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        uidb64, token = response.data['Mesage'].rstrip('/').split('/')[-2:]
+        response = self.assertQueryBudget(
+            'password-reset-confirm', 'post', kwargs={'uidb64': uidb64, 'token': token},
+            data={'new_password': 'newpass', 're_new_password': 'newpass'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+
+
+# tests for the catalog response cache
+class TestCatalogCache(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        self.cat = Category.objects.create(
+            name = "test_category"
+        )
+        self.product = Product.objects.create(
+            name='Test Product',
+            price=100,
+            rank=4,
+            category=self.cat
+        )
+        cache_stats.reset()
+
+    def test_hits_and_misses(self):
+        url = reverse('api:product-list')
+
+        client.get(url, {'price_lt': '200'})
+        with self.assertNumQueries(0):
+            response = client.get(url, {'price_lt': '200.00'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['name'], 'Test Product')
+        self.assertEqual(cache_stats.as_dict(), {'hits': 1, 'misses': 1})
+
+    def test_text_params_are_not_numbers(self):
+        url = reverse('api:product-search')
+
+        client.get(url, {'q': '007', 'page_size': '10'})
+        client.get(url, {'q': '7', 'page_size': '10'})
+        client.get(url, {'q': '7.0', 'page_size': '10'})
+        self.assertEqual(cache_stats.as_dict(), {'hits': 0, 'misses': 3})
+        # the page size is still compared as a number
+        client.get(url, {'q': '7', 'page_size': ' 010'})
+        self.assertEqual(cache_stats.as_dict(), {'hits': 1, 'misses': 3})
+
+    def test_numbers_the_views_reject_are_not_numbers(self):
+        for i in range(25):
+            Product.objects.create(name=f'product {i}', price=1, rank=1, category=self.cat)
+        url = reverse('api:product-list')
+
+        # the pagination ignores a page size int() doesn't take
+        self.assertEqual(len(client.get(url, {'page_size': '1e1'}).data['results']), 20)
+        self.assertEqual(len(client.get(url, {'page_size': '10'}).data['results']), 10)
+        self.assertEqual(client.get(url, {'category': self.cat.pk}).status_code, 200)
+        self.assertEqual(client.get(url, {'category': f'{self.cat.pk}e0'}).status_code, 400)
+        self.assertEqual(cache_stats.as_dict(), {'hits': 0, 'misses': 4})
+
+    def test_query_params_are_part_of_the_key(self):
+        url = reverse('api:product-list')
+
+        self.assertEqual(len(client.get(url, {'price_lt': '200'}).data['results']), 1)
+        self.assertEqual(len(client.get(url, {'price_lt': '50'}).data['results']), 0)
+        self.assertEqual(cache_stats.misses, 2)
+
+    def test_product_change_invalidates(self):
+        url = reverse('api:product-detail', kwargs={'pk': self.product.pk})
+        client.get(url)
+
+        self.product.name = 'Updated Product'
+        self.product.save()
+
+        response = client.get(url)
+        self.assertEqual(response.data['name'], 'Updated Product')
+        self.assertEqual(cache_stats.as_dict(), {'hits': 0, 'misses': 2})
+
+    def test_category_change_invalidates(self):
+        url = reverse('api:category-list-create')
+        auth = self.bearer_token
+        client.get(url, **auth)
+
+        Category.objects.create(name='Other Category')
+
+        response = client.get(url, **auth)
+        self.assertEqual(len(response.data), 2)
+
+        # the product detail shows the category name, so it is invalidated too
+        self.cat.name = 'Renamed Category'
+        self.cat.save()
+        response = client.get(reverse('api:product-detail', kwargs={'pk': self.product.pk}))
+        self.assertEqual(response.data['category'], 'Renamed Category')
+
+
+
+
+# tests for conditional GETs
+class TestConditionalGet(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email='test@gmail.com', password='testpass'
+        )
+        self.wishlist = WishList.objects.create(
+            user=self.user
+        )
+        self.cat = Category.objects.create(
+            name = "test_category"
+        )
+        self.product = Product.objects.create(
+            name='Test Product',
+            price=100,
+            rank=4,
+            category=self.cat
+        )
+
+    def test_product_detail_not_modified(self):
+        url = reverse('api:product-detail', kwargs={'pk': self.product.pk})
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(1):
+            response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        self.product.price = 150
+        self.product.save()
+        response = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['price'], '150.00')
+
+    def test_product_detail_if_modified_since(self):
+        url = reverse('api:product-detail', kwargs={'pk': self.product.pk})
+        response = client.get(url)
+
+        response = client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_product_detail_modified_by_category_rename(self):
+        hour_ago = datetime.now(dt_timezone.utc) - timedelta(hours=1)
+        Product.objects.filter(pk=self.product.pk).update(updated_time=hour_ago)
+        Category.objects.filter(pk=self.cat.pk).update(updated_time=hour_ago)
+        url = reverse('api:product-detail', kwargs={'pk': self.product.pk})
+        last_modified = client.get(url)['Last-Modified']
+
+        self.cat.name = 'Renamed Category'
+        self.cat.save()
+        response = client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['category'], 'Renamed Category')
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+
+    def test_product_detail_missing(self):
+        response = client.get(reverse('api:product-detail', kwargs={'pk': 999}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_wishlist_etag_follows_products(self):
+        url = reverse('api:wishlist-view-by-identifier', kwargs={'user': self.user.email})
+        etag = client.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.wishlist.products.add(self.product)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['products'], [self.product.pk])
+
+        # deleting the product drops it from the wishlist without m2m_changed
+        etag = response['ETag']
+        self.product.delete()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['products'], [])
+
+
+
+
+# tests for the one product per category rule
+class TestWishlistCategoryConstraint(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email='test@gmail.com', password='testpass'
+        )
+        self.wishlist = WishList.objects.create(
+            user=self.user
+        )
+        self.cat1 = Category.objects.create(name="test_category")
+        self.cat2 = Category.objects.create(name="test_category2")
+        self.product1 = Product.objects.create(name="test_product1", price=5, rank=2, category=self.cat1)
+        self.product2 = Product.objects.create(name="test_product2", price=50, rank=23, category=self.cat1)
+
+    def test_database_rejects_second_product_from_category(self):
+        self.wishlist.products.add(self.product1)
+
+        with self.assertRaises(IntegrityError):
+            self.wishlist.products.add(self.product2)
+
+    def test_changing_product_category(self):
+        product3 = Product.objects.create(name="test_product3", price=5, rank=2, category=self.cat2)
+        self.wishlist.products.add(self.product1, product3)
+
+        # moving product3 into cat1 would give the wishlist two cat1 products,
+        # a save that skips validation drops it and says so
+        item = WishListItem.objects.get(product=product3)
+        product3.category = self.cat1
+        with self.assertLogs('product.signals', 'WARNING') as logs:
+            product3.save()
+        self.assertEqual(list(self.wishlist.products.all()), [self.product1])
+        self.assertEqual(logs.records[0].wishlist_items, [item.pk])
+
+        self.product1.category = self.cat2
+        self.product1.save()
+        self.assertEqual(WishListItem.objects.get(product=self.product1).category, self.cat2)
+
+    def test_conflicting_category_change_is_rejected(self):
+        product3 = Product.objects.create(name="test_product3", price=5, rank=2, category=self.cat2)
+        self.wishlist.products.add(self.product1, product3)
+        url = reverse('api:product-update', kwargs={'pk': product3.pk})
+
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+        response = client.patch(url, data={'category': self.cat1.pk}, format='json', **auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('category', response.data)
+        product3.category = self.cat1
+        with self.assertRaises(ValidationError):
+            product3.full_clean()
+        self.assertEqual(set(self.wishlist.products.all()), {self.product1, product3})
+
+    def test_saves_keeping_the_category_skip_the_wishlist_items(self):
+        self.wishlist.products.add(self.product1)
+        product = Product.objects.get(pk=self.product1.pk)
+        product.name = 'renamed'
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+        self.assertFalse([query for query in queries if 'product_wishlist_products' in query['sql']])
+
+
+
+
+class TestConcurrentWishlistUpdates(TransactionTestCase):
+    workers = 8
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='test@gmail.com', password='testpass'
+        )
+        self.wishlist = WishList.objects.create(
+            user=self.user
+        )
+        self.cat = Category.objects.create(name="test_category")
+        self.products = [
+            Product.objects.create(name=f"test_product{i}", price=5, rank=i, category=self.cat)
+            for i in range(self.workers)
+        ]
+        self.auth = {"HTTP_AUTHORIZATION": f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def add_product(self, product):
+        try:
+            return APIClient().patch(
+                reverse('api:wishlist'), data={'products': [product.pk]}, format='json', **self.auth
+            ).status_code
+        finally:
+            connection.close()
+
+    @skipIf(connection.vendor == 'sqlite', 'SQLite locks the whole database for writes')
+    def test_parallel_updates_keep_one_product_per_category(self):
+        # every request passes the python check before any of them commits,
+        # only the unique constraint can stop the rest
+        for _ in range(3):
+            WishListItem.objects.filter(wishlist=self.wishlist).delete()
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                statuses = list(pool.map(self.add_product, self.products))
+
+            self.assertEqual(sorted(statuses), [200] + [400] * (self.workers - 1))
+            self.assertEqual(self.wishlist.products.count(), 1)
+
+
+
+
+# tests for the streaming catalog export
+class TestProductExport(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('api:product-export')
+        cat = Category.objects.create(name='test_category')
+        for i, price in enumerate(('5.00', '15.50', '25.00')):
+            Product.objects.create(name=f'product{i}', price=price, rank=i, category=cat)
+
+    def test_export_ndjson(self):
+        response = client.get(self.url, **self.bearer_token)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['product0', 'product1', 'product2'])
+        self.assertEqual(rows[1]['price'], '15.50')
+        self.assertEqual(rows[1]['category'], 'test_category')
+        product = Product.objects.get(name='product1')
+        detail = client.get(reverse('api:product-detail', kwargs={'pk': product.pk})).data
+        self.assertEqual(rows[1]['created_time'], detail['created_time'])
+        self.assertTrue(rows[1]['created_time'].endswith('Z'))
+
+    def test_export_csv_with_price_filters(self):
+        response = client.get(
+            self.url, {'output': 'csv', 'price_gt': '10', 'price_lt': '20'}, **self.bearer_token
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('products.csv', response['Content-Disposition'])
+        rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['name'], rows[0]['price']), ('product1', '15.50'))
+
+    def test_invalid_params(self):
+        auth = self.bearer_token
+        self.assertEqual(client.get(self.url, {'output': 'xml'}, **auth).status_code, 400)
+        self.assertEqual(client.get(self.url, {'price_gt': 'abc'}, **auth).status_code, 400)
+
+    def test_requires_authentication(self):
+        self.assertEqual(client.get(self.url).status_code, 401)
+
+    @skipIf(not os.path.exists('/proc/self/statm'), 'reads the resident set size from /proc')
+    def test_memory_stays_flat(self):
+        # the rows are read back through the export's own queryset, chunks
+        # and all. tracemalloc would slow this down tenfold, so the resident
+        # set size is sampled as the export goes instead.
+        def rss():
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+        rows = 50000
+        category = Category.objects.get()
+        Product.objects.bulk_create(
+            (Product(name=f'product{i}', price='19.99', rank=i % 5, category=category) for i in range(rows)),
+            batch_size=5000,
+        )
+        rows += 3
+
+        for write_lines in (ndjson_lines, csv_lines):
+            with self.subTest(write_lines.__name__):
+                start = peak = rss()
+                size = 0
+                for i, chunk in enumerate(buffered(write_lines(export_rows(Product.objects.all())))):
+                    size += len(chunk)
+                    if i % 10 == 0:
+                        peak = max(peak, rss())
+
+                self.assertGreater(size, rows * 70)
+                self.assertLess(peak - start, 4 * 1024 * 1024)
+
+
+
+
+# tests for product search
+class TestProductSearch(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('api:product-search')
+        self.toys = Category.objects.create(name='toys')
+        self.kitchen = Category.objects.create(name='kitchen')
+        for name, cat in (
+            ('Red Teddy Bear', self.toys),
+            ('Blue Kite', self.toys),
+            ('Teddy Mug', self.kitchen),
+            ('Coffee Mug', self.kitchen),
+        ):
+            Product.objects.create(name=name, price=10, rank=1, category=cat)
+
+    def search(self, q, **params):
+        response = client.get(self.url, {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def names(self, q):
+        return [product['name'] for product in self.search(q).data['results']]
+
+    def test_search(self):
+        self.assertEqual(self.names('teddy bear'), ['Red Teddy Bear'])
+        self.assertEqual(set(self.names('mugs')), {'Teddy Mug', 'Coffee Mug'})
+        self.assertEqual(self.names('guitar'), [])
+
+    def test_last_word_is_a_prefix(self):
+        self.assertEqual(set(self.names('tedd')), {'Red Teddy Bear', 'Teddy Mug'})
+        self.assertEqual(self.names('coffee m'), ['Coffee Mug'])
+
+    def test_operators_are_ignored(self):
+        self.assertEqual(self.names('"kite" -(blue*'), ['Blue Kite'])
+
+    def test_index_follows_writes(self):
+        product = Product.objects.get(name='Blue Kite')
+        product.name = 'Blue Guitar'
+        product.save()
+        Product.objects.create(name='Red Guitar', price=10, rank=1, category=self.toys)
+
+        self.assertEqual(self.names('kite'), [])
+        self.assertEqual(set(self.names('guitar')), {'Blue Guitar', 'Red Guitar'})
+
+        product.delete()
+        self.assertEqual(self.names('guitar'), ['Red Guitar'])
+
+    def test_pagination(self):
+        response = self.search('mug', page_size=1)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_query_is_required(self):
+        self.assertEqual(client.get(self.url).status_code, 400)
+        self.assertEqual(client.get(self.url, {'q': '  '}).status_code, 400)
+        self.assertEqual(self.search('!!').data['count'], 0)
+
+    def test_typos(self):
+        if connection.vendor != 'postgresql' or not has_trigram(connection.alias):
+            self.skipTest('needs the pg_trgm extension')
+        self.assertEqual(self.names('tedy ber')[0], 'Red Teddy Bear')
+
+
+
+
+# tests for product filters and facets
+class TestProductFilters(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        self.toys = Category.objects.create(name='toys')
+        self.books = Category.objects.create(name='books')
+        self.games = Category.objects.create(name='games')
+        for name, price, rank, cat in (
+            ('kite', '5.00', 1, self.toys),
+            ('teddy', '24.99', 3, self.toys),
+            ('robot', '120.00', 5, self.toys),
+            ('novel', '15.00', 2, self.books),
+            ('atlas', '600.00', 4, self.books),
+            ('chess', '30.00', 5, self.games),
+        ):
+            Product.objects.create(name=name, price=price, rank=rank, category=cat)
+
+    def names(self, **params):
+        response = client.get(reverse('api:product-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return {product['name'] for product in response.data['results']}
+
+    def test_filters(self):
+        self.assertEqual(
+            self.names(category=[self.toys.pk, self.games.pk]), {'kite', 'teddy', 'robot', 'chess'}
+        )
+        self.assertEqual(self.names(price_gt='10', price_lt='100.5'), {'teddy', 'novel', 'chess'})
+        self.assertEqual(self.names(rank_gte=3, rank_lte=4), {'teddy', 'atlas'})
+        self.assertEqual(self.names(category=self.toys.pk, rank_gte=3), {'teddy', 'robot'})
+        self.assertEqual(self.names(price_gt=''), self.names())
+
+    def test_invalid_filters(self):
+        url = reverse('api:product-list')
+        for params in (
+            {'price_gt': 'abc'}, {'price_lt': 'NaN'}, {'rank_gte': '1.5'}, {'category': 'toys'},
+        ):
+            with self.subTest(params=params):
+                response = client.get(url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(next(iter(params)), response.data)
+
+    def test_facets(self):
+        response = client.get(reverse('api:product-facets'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 6)
+        self.assertEqual(response.data['categories'], [
+            {'id': self.toys.pk, 'name': 'toys', 'count': 3},
+            {'id': self.books.pk, 'name': 'books', 'count': 2},
+            {'id': self.games.pk, 'name': 'games', 'count': 1},
+        ])
+        buckets = {bucket['min']: bucket['count'] for bucket in response.data['price_buckets']}
+        self.assertEqual(
+            buckets, {'0': 1, '10': 2, '25': 1, '50': 0, '100': 1, '250': 0, '500': 1}
+        )
+        self.assertEqual(response.data['price_buckets'][-1]['max'], None)
+
+    def test_facets_with_filters(self):
+        response = client.get(
+            reverse('api:product-facets'), {'category': self.toys.pk, 'price_lt': '100'}
+        )
+
+        # the category counts ignore the category filter, the buckets don't
+        self.assertEqual(response.data['count'], 2)
+        counts = {category['name']: category['count'] for category in response.data['categories']}
+        self.assertEqual(counts, {'toys': 2, 'books': 1, 'games': 1})
+        buckets = {bucket['min']: bucket['count'] for bucket in response.data['price_buckets']}
+        self.assertEqual(buckets['0'] + buckets['10'], 2)
+        self.assertEqual(sum(buckets.values()), 2)
+
+    def test_facets_run_in_one_query(self):
+        with self.assertNumQueries(1):
+            client.get(reverse('api:product-facets'), {'category': [self.toys.pk, self.books.pk]})
+
+
+
+
+# tests for cached jwt authentication
+class TestCachedAuthentication(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        user_cache.clear()
+        self.user = User.objects.create_user(
+            email='test@gmail.com', password='testpass'
+        )
+        refresh = RefreshToken.for_user(self.user)
+        self.auth = {"HTTP_AUTHORIZATION": f'Bearer {refresh.access_token}'}
+        self.url = reverse('api:wishlist')
+        WishList.objects.create(user=self.user)
+
+    def user_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(self.url, **self.auth)
+        return response, [
+            query for query in queries
+            if User._meta.db_table in query['sql'] and 'wishlist' not in query['sql']
+        ]
+
+    def test_user_is_cached(self):
+        response, queries = self.user_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+
+        response, queries = self.user_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_deactivated_user_is_locked_out(self):
+        self.user_queries()
+        self.user.is_active = False
+        self.user.save()
+
+        response, _ = self.user_queries()
+        self.assertEqual(response.status_code, 401)
+
+    def test_password_change_invalidates(self):
+        self.user_queries()
+        self.user.set_password('newpass')
+        self.user.save(update_fields=['password'])
+
+        response, queries = self.user_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+
+    def test_other_changes_keep_the_cache(self):
+        self.user_queries()
+        self.user.save(update_fields=['last_login'])
+
+        _, queries = self.user_queries()
+        self.assertEqual(queries, [])
+
+    def test_deleted_user(self):
+        self.user_queries()
+        self.user.delete()
+
+        response, _ = self.user_queries()
+        self.assertEqual(response.status_code, 401)
+
+    def test_cache_is_bounded(self):
+        users = UserCache(maxsize=2, timeout=60)
+        for key in 'abc':
+            users.set(key, key, stamp=1)
+
+        self.assertIsNone(users.get('a', stamp=1))
+        self.assertEqual(users.get('c', stamp=1), 'c')
+        self.assertIsNone(users.get('c', stamp=2))
+
+        users = UserCache(maxsize=2, timeout=0)
+        users.set('a', 'a', stamp=1)
+        self.assertIsNone(users.get('a', stamp=1))
+
+
+
+
+# tests for the refresh token blacklist filter
+@override_settings(TOKEN_BLACKLIST_FILTER=1)
+class TestTokenBlacklistFilter(APITestCase):
+    def setUp(self):
+        cache.clear()
+        blacklist_filter.warm()
+        self.user = User.objects.create_user(
+            email='test@gmail.com', password='testpass'
+        )
+        self.refresh = RefreshToken.for_user(self.user)
+        self.auth = {"HTTP_AUTHORIZATION": f'Bearer {self.refresh.access_token}'}
+
+    def refresh_token(self):
+        return client.post(
+            reverse('api:token_refresh'), data={'refresh': str(self.refresh)}, format='json'
+        )
+
+    def test_refresh_skips_the_blacklist_query(self):
+        with self.assertNumQueries(0):
+            response = self.refresh_token()
+        self.assertEqual(response.status_code, 200)
+
+    def test_blacklisted_token_is_rejected(self):
+        response = client.post(
+            reverse('api:logout'), data={'refresh': str(self.refresh)}, format='json', **self.auth
+        )
+        self.assertEqual(response.status_code, 205)
+        self.assertEqual(self.refresh_token().status_code, 401)
+
+    def blacklist_elsewhere(self):
+        # what another worker does: blacklist the token and publish it
+        token = OutstandingToken.objects.get(jti=self.refresh['jti'])
+        BlacklistedToken.objects.create(token=token)
+        _publish(self.refresh['jti'])
+
+    def test_blacklisted_by_another_worker(self):
+        self.refresh_token()
+        self.blacklist_elsewhere()
+        self.assertEqual(self.refresh_token().status_code, 401)
+
+    def test_evicted_entries_reload_the_filter(self):
+        self.refresh_token()
+        self.blacklist_elsewhere()
+        cache.delete(BLACKLIST_ENTRY_KEY % cache.get(BLACKLIST_SEQUENCE_KEY))
+        self.assertEqual(self.refresh_token().status_code, 401)
+
+    def test_evicted_sequence_reloads_the_filter(self):
+        for i in range(3):
+            _publish(f'other{i}')
+        self.refresh_token()
+
+        # the counter is made again and moves past the number this worker
+        # has seen, the first entry after it being this token's
+        cache.delete(BLACKLIST_SEQUENCE_KEY)
+        self.blacklist_elsewhere()
+        for i in range(3, 10):
+            _publish(f'other{i}')
+        self.assertEqual(self.refresh_token().status_code, 401)
+
+    @override_settings(TOKEN_BLACKLIST_FILTER=None)
+    def test_process_local_cache_queries_the_blacklist(self):
+        self.assertFalse(filter_enabled())
+        self.refresh_token()
+        token = OutstandingToken.objects.get(jti=self.refresh['jti'])
+        # blacklisted by another process, which this cache never hears of
+        BlacklistedToken.objects.create(token=token)
+        self.assertEqual(self.refresh_token().status_code, 401)
+
+        shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/cache'}
+        with override_settings(CACHES={'default': shared}):
+            self.assertTrue(filter_enabled())
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(10000)
+        for i in range(10000):
+            bloom.add(f'jti{i}')
+
+        self.assertTrue(all(f'jti{i}' in bloom for i in range(10000)))
+        false_positives = sum(f'other{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 100)
+
+
+
+# tests for the Server-Timing middleware
+class TestServerTiming(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='category')
+        for i in range(3):
+            Product.objects.create(name=f'product{i}', price=i, rank=i, category=category)
+        self.url = reverse('api:product-list')
+
+    def test_disabled(self):
+        response = client.get(self.url)
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    def test_timings(self):
+        with CaptureQueriesContext(connection) as queries, self.assertLogs('api.timing', 'INFO') as logs:
+            response = client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        metrics = {
+            entry.split(';')[0]: dict(part.split('=', 1) for part in entry.split(';')[1:])
+            for entry in response['Server-Timing'].split(', ')
+        }
+        self.assertEqual(set(metrics), {'db', 'serialize', 'render', 'total'})
+        self.assertEqual(metrics['db']['desc'], f'"{len(queries)} queries"')
+        self.assertGreater(float(metrics['serialize']['dur']), 0)
+        self.assertGreater(float(metrics['render']['dur']), 0)
+        self.assertGreaterEqual(
+            float(metrics['total']['dur']),
+            sum(float(metrics[name]['dur']) for name in ('db', 'serialize', 'render')),
+        )
+
+        [record] = logs.records
+        self.assertEqual(record.timings['path'], self.url)
+        self.assertEqual(record.timings['queries'], len(queries))
+        self.assertIn(f'queries={len(queries)}', record.getMessage())
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0.5)
+    def test_sampling(self):
+        with mock.patch('api.timing.random.random', side_effect=[0.7, 0.2]), self.assertLogs('api.timing') as logs:
+            self.assertNotIn('Server-Timing', client.get(self.url))
+            self.assertIn('Server-Timing', client.get(self.url))
+        self.assertEqual(len(logs.records), 1)
+
+
+
+# tests for the slow request profiler
+class TestRequestProfiling(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        overrides = override_settings(PROFILE_DIR=directory.name, PROFILE_SAMPLE_RATE=1, PROFILE_SLOW_MS=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.url = reverse('api:product-list')
+
+    def profiles(self):
+        return sorted(path.name for path in self.directory.glob('*.prof'))
+
+    def test_slow_requests_are_saved(self):
+        client.get(self.url)
+        [profile] = self.profiles()
+        self.assertTrue(profile.startswith('ProductListAPIView.'))
+
+    async def test_async_requests(self):
+        await AsyncClient().get(self.url)
+        [profile] = self.profiles()
+        self.assertTrue(profile.startswith('ProductListAPIView.'))
+
+    @override_settings(PROFILE_SLOW_MS=60000)
+    def test_fast_requests_are_dropped(self):
+        client.get(self.url)
+        self.assertEqual(self.profiles(), [])
+
+    @override_settings(PROFILE_SAMPLE_RATE=0, PROFILE_SLOW_MS=60000)
+    def test_signed_header(self):
+        client.get(self.url, HTTP_X_PROFILE='profile:forged')
+        self.assertEqual(self.profiles(), [])
+
+        token = StringIO()
+        call_command('profile_report', '--token', stdout=token)
+        client.get(self.url, HTTP_X_PROFILE=token.getvalue().strip())
+        self.assertEqual(len(self.profiles()), 1)
+
+    @override_settings(PROFILE_MAX_FILES=2, PROFILE_COLLAPSED=1, PROFILE_STACK_INTERVAL=0.001)
+    def test_rotation_and_collapsed_stacks(self):
+        for _ in range(3):
+            client.get(self.url)
+        self.assertEqual(len(self.profiles()), 2)
+        self.assertEqual(len(list(self.directory.glob('*.collapsed'))), 2)
+
+    def test_report(self):
+        for _ in range(2):
+            client.get(self.url)
+        client.get(reverse('api:product-facets'))
+
+        out = StringIO()
+        api_dir = os.path.join(settings.BASE_DIR, 'api', '')
+        call_command('profile_report', '--dir', str(self.directory), '--include', api_dir, '--top', '5', stdout=out)
+        report = out.getvalue()
+        self.assertIn('3 profiles', report)
+        self.assertIn('2  ProductListAPIView', report)
+        self.assertIn('1  ProductFacetsAPIView', report)
+        functions = report.split('function\n', 1)[1].splitlines()
+        self.assertEqual(len(functions), 5)
+        self.assertTrue(all(api_dir in line for line in functions))
+
+        with self.assertRaises(CommandError):
+            call_command('profile_report', '--dir', str(self.directory), '--view', 'Missing', stdout=out)
+
+
+
+# tests for the prometheus metrics
+class TestMetrics(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        metrics.clear()
+        cache_stats.reset()
+        self.url = reverse('api:product-list')
+
+    def scrape(self, **extra):
+        response = client.get('/metrics', **extra)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode().splitlines()
+
+    def test_requests(self):
+        for _ in range(3):
+            client.get(self.url)
+        client.get(reverse('api:wishlist'), HTTP_AUTHORIZATION='Bearer invalid')
+
+        lines = self.scrape()
+        self.assertIn('http_requests_total{view="api:product-list",method="GET",status="200"} 3', lines)
+        self.assertIn('http_requests_total{view="api:wishlist",method="GET",status="401"} 1', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="api:product-list",le="+Inf"} 3', lines)
+        self.assertIn('http_request_duration_seconds_count{view="api:product-list"} 3', lines)
+        # the first request misses the response cache, the others hit it
+        self.assertIn('db_queries_total{view="api:product-list"} 1', lines)
+        self.assertIn('cache_requests_total{cache="response",result="hit"} 2', lines)
+        self.assertIn('cache_hit_ratio{cache="response"} 0.6666666666666666', lines)
+        self.assertIn('auth_failures_total{kind="token"} 1', lines)
+
+    async def test_async_requests(self):
+        # the view's queries run on another thread than the middleware
+        await AsyncClient().get(self.url)
+
+        lines = self.scrape()
+        self.assertIn('http_requests_total{view="api:product-list",method="GET",status="200"} 1', lines)
+        self.assertIn('db_queries_total{view="api:product-list"} 1', lines)
+
+    def test_threads_add_up(self):
+        def record():
+            for _ in range(1000):
+                metrics.inc('auth_failures_total', (('kind', 'credentials'),))
+                metrics.observe('http_request_duration_seconds', (('view', 'test'),), 0.02)
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        lines = self.scrape()
+        self.assertIn('auth_failures_total{kind="credentials"} 4000', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="test",le="0.01"} 0', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="test",le="0.025"} 4000', lines)
+        # the stopped threads' dicts are added up into one
+        self.assertFalse([thread for thread, _ in metrics._stores.values() if thread in threads])
+        self.assertIn('auth_failures_total{kind="credentials"} 4000', self.scrape())
+
+    def test_stopped_threads_are_folded_without_scrapes(self):
+        # a thread per request, like runserver
+        for _ in range(200):
+            thread = threading.Thread(target=metrics.inc, args=('auth_failures_total', (('kind', 'token'),)))
+            thread.start()
+            thread.join()
+
+        self.assertLessEqual(len(metrics._stores), FOLD_EVERY + threading.active_count())
+        self.assertIn('auth_failures_total{kind="token"} 200', self.scrape())
+
+    def test_processes_add_up(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            # another worker's totals
+            other = [['auth_failures_total', [['kind', 'credentials']], 5]]
+            Path(directory, '1-other.json').write_text(json.dumps(other))
+            metrics.inc('auth_failures_total', (('kind', 'credentials'),), 2)
+
+            self.assertIn('auth_failures_total{kind="credentials"} 7', self.scrape())
+
+    def test_stopped_processes_are_folded(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            for name, value in (('1-first.json', 5), ('1-second.json', 1), ('2-other.json', 3)):
+                rows = [['auth_failures_total', [['kind', 'credentials']], value]]
+                Path(directory, name).write_text(json.dumps(rows))
+
+            mark_process_dead(1)
+            self.assertEqual(
+                sorted(path.name for path in Path(directory).glob('*.json')),
+                ['2-other.json', 'stopped.json'],
+            )
+            self.assertIn('auth_failures_total{kind="credentials"} 9', self.scrape())
+            mark_process_dead(2)
+            self.assertIn('auth_failures_total{kind="credentials"} 9', self.scrape())
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(client.get('/metrics').status_code, 401)
+        self.scrape(HTTP_AUTHORIZATION='Bearer secret')
+
+
+
+# tests for the values() fast path of the list endpoints
+class TestValuesListFastPath(TestCaseBase):
+    def setUp(self):
+        super().setUp()
+        self.categories = categories = [
+            Category.objects.create(name=name) for name in ('Books', 'Café "gifts"', '玩具')
+        ]
+        for i in range(45):
+            Product.objects.create(
+                name=f'product {i} ☃', price=Decimal(i * 37 % 1000) / 7 if i % 3 else i,
+                rank=i % 4, category=categories[i % 3],
+            )
+
+    def get_both(self, url, **extra):
+        cache.clear()
+        fast = client.get(url, **extra)
+        cache.clear()
+        with override_settings(API_VALUES_SERIALIZERS=0):
+            slow = client.get(url, **extra)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_product_list_is_identical(self):
+        url = reverse('api:product-list')
+        filtered = f'?category={self.categories[1].pk}&price_lt=50'
+        for query in ('', '?ordering=price', '?ordering=-rank&page_size=7', filtered):
+            response = self.get_both(url + query)
+            # walk every page, the cursors must match too
+            while response.data['next']:
+                response = self.get_both(response.data['next'])
+
+    def test_category_list_is_identical(self):
+        self.get_both(reverse('api:category-list-create'), **self.bearer_token)
+
+    def test_no_model_instances(self):
+        with mock.patch.object(Product, 'from_db') as from_db, CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('api:product-list'))
+        self.assertEqual(len(response.data['results']), 20)
+        from_db.assert_not_called()
+        self.assertEqual(len(queries), 1)
+
+    def test_unsupported_serializer(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ValuesMapper(WishListSerializer)
+
+
+
+# tests for the orjson renderer and parser
+@skipIf(orjson is None, 'orjson is not installed')
+class TestORJSON(TestCaseBase):
+    def assertSameRendering(self, data, accepted_media_type=None):
+        self.assertEqual(
+            ORJSONRenderer().render(data, accepted_media_type),
+            JSONRenderer().render(data, accepted_media_type),
+        )
+
+    def test_renderer(self):
+        now = datetime(2023, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc)
+        self.assertSameRendering(OrderedDict([
+            ('price', Decimal('19.90')),
+            ('aware', now),
+            ('local', now.astimezone(dt_timezone(timedelta(hours=1)))),
+            ('naive', now.replace(tzinfo=None)),
+            ('date', now.date()),
+            ('time', now.time()),
+            ('duration', timedelta(days=1, seconds=5)),
+            ('id', uuid.UUID(int=1)),
+            ('lazy', gettext_lazy('This field is required.')),
+            ('error', ErrorDetail('invalid', code='invalid')),
+            ('text', 'Caf\u00e9 "gifts" \u73a9\u5177 \u2028 \u2029\n'),
+            ('nested', [{1: True, 'none': None}, (1.5, -2)]),
+            ('big', 2 ** 70),
+        ]))
+        self.assertSameRendering({'a': [1, 2]}, 'application/json; indent=4')
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_responses(self):
+        category = Category.objects.create(name='Café')
+        for i in range(5):
+            Product.objects.create(name=f'product {i}', price=Decimal('9.99') * i, rank=i, category=category)
+
+        for url in (reverse('api:product-list'), reverse('api:product-facets')):
+            response = client.get(url)
+            self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_parser(self):
+        bodies = [
+            b'{"name": "Caf\\u00e9", "price": 19.99, "tags": [1, null, true]}',
+            '{"name": "玩具"}'.encode(),
+            b'{"id": 123456789012345678901234567890}',
+            b'{"text": "\\ud800"}',
+        ]
+        for body in bodies:
+            self.assertEqual(ORJSONParser().parse(BytesIO(body)), JSONParser().parse(BytesIO(body)))
+
+        for body in (b'{"a": NaN}', b'[1,]', b'\xef\xbb\xbf{}', b'\xff'):
+            with self.assertRaises(ParseError) as fast:
+                ORJSONParser().parse(BytesIO(body))
+            with self.assertRaises(ParseError) as slow:
+                JSONParser().parse(BytesIO(body))
+            self.assertEqual(str(fast.exception), str(slow.exception))
+
+
+
+# tests for msgpack content negotiation
+@skipIf(msgpack is None, 'msgpack is not installed')
+class TestMessagePack(TestCaseBase):
+    def test_renderer(self):
+        now = datetime(2023, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc)
+        data = {
+            'price': Decimal('12345678901234567890.123456789'),
+            'time': now,
+            'id': uuid.UUID(int=1),
+            'lazy': gettext_lazy('This field is required.'),
+            'nested': [{'none': None, 'flag': True}, (1.5, -2)],
+        }
+        self.assertEqual(msgpack.unpackb(MessagePackRenderer().render(data)), {
+            'price': '12345678901234567890.123456789',
+            'time': json.loads(JSONRenderer().render(now)),
+            'id': str(uuid.UUID(int=1)),
+            'lazy': 'This field is required.',
+            'nested': [{'none': None, 'flag': True}, [1.5, -2]],
+        })
+        self.assertEqual(MessagePackRenderer().render(None), b'')
+
+    def test_responses(self):
+        category = Category.objects.create(name='Café')
+        for i in range(5):
+            Product.objects.create(name=f'product {i}', price=Decimal('9.99') * i, rank=i, category=category)
+
+        url = reverse('api:product-list')
+        response = client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), client.get(url).json())
+        self.assertEqual(msgpack.unpackb(client.get(url, {'format': 'msgpack'}).content), client.get(url).json())
+
+        # json stays the default
+        self.assertEqual(client.get(url, HTTP_ACCEPT='*/*')['Content-Type'], 'application/json')
+
+    def test_parser(self):
+        auth = self.bearer_token
+        category = Category.objects.create(name='Gifts')
+        body = msgpack.packb({'name': 'Café', 'price': '19.99', 'rank': 3, 'category': category.pk})
+        response = client.post(
+            reverse('api:product-create'), data=body, content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack', **auth
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Product.objects.get().price, Decimal('19.99'))
+        self.assertEqual(msgpack.unpackb(response.content)['price'], '19.99')
+
+        for body in (b'\xc1', b'\x92\x01', b'\x80\x01'):
+            with self.assertRaises(ParseError):
+                MessagePackParser().parse(BytesIO(body))
+        response = client.post(
+            reverse('api:category-list-create'), data=b'\xc1', content_type='application/msgpack', **auth
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+
+# tests for the top products of a category
+class TestCategoryTopProducts(TestCaseBase):
+    def test_top_products(self):
+        category = Category.objects.create(name='toys')
+        products = [
+            Product.objects.create(name=f'product {i}', price=i + 1, rank=(i * 7) % 12, category=category)
+            for i in range(12)
+        ]
+        url = reverse('api:category-top-products', kwargs={'pk': category.pk})
+
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        best = sorted(products, key=lambda product: (product.rank, product.pk))[:settings.TOP_PRODUCTS_PER_CATEGORY]
+        self.assertEqual(response.json(), json.loads(JSONRenderer().render(ProductSerializer(best, many=True).data)))
+
+        # writes show up right away
+        response = client.patch(
+            reverse('api:product-update', kwargs={'pk': best[0].pk}),
+            data={'rank': 100}, format='json', **self.bearer_token
+        )
+        self.assertEqual(response.status_code, 200)
+        names = [product['name'] for product in client.get(url).data]
+        self.assertNotIn(best[0].name, names)
+        self.assertEqual(len(names), settings.TOP_PRODUCTS_PER_CATEGORY)
+
+    def test_empty_and_missing_categories(self):
+        category = Category.objects.create(name='empty')
+        response = client.get(reverse('api:category-top-products', kwargs={'pk': category.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [])
+
+        response = client.get(reverse('api:category-top-products', kwargs={'pk': category.pk + 1}))
+        self.assertEqual(response.status_code, 404)
+
+
+
+# tests for wishlist recommendations
+class TestWishlistRecommendations(TestCaseBase):
+    def test_recommendations(self):
+        auth = self.bearer_token
+        user = User.objects.get()
+        wishlist = WishList.objects.create(user=user)
+        toys, books, games = (Category.objects.create(name=name) for name in ('toys', 'books', 'games'))
+        kite, teddy = (Product.objects.create(name=name, price=1, rank=1, category=toys) for name in ('kite', 'teddy'))
+        novel, atlas = (Product.objects.create(name=name, price=1, rank=1, category=books) for name in ('novel', 'atlas'))
+        chess = Product.objects.create(name='chess', price=1, rank=1, category=games)
+        wishlist.products.add(kite, novel)
+
+        for product, recommended, score in [
+            (kite, teddy, 9), (kite, atlas, 5), (kite, chess, 2), (novel, chess, 4), (teddy, chess, 50),
+        ]:
+            Recommendation.objects.create(product=product, recommended=recommended, score=score)
+
+        url = reverse('api:wishlist-recommendations')
+        response = client.get(url, **auth)
+        self.assertEqual(response.status_code, 200)
+        # toys and books are filled, the scores of chess add up
+        self.assertEqual([product['name'] for product in response.data], ['chess'])
+
+        wishlist.products.remove(novel)
+        self.assertEqual([product['name'] for product in client.get(url, **auth).data], ['atlas', 'chess'])
+
+        with self.settings(RECOMMENDATIONS_LIMIT=1):
+            self.assertEqual(len(client.get(url, **auth).data), 1)
+        self.assertEqual(client.get(url).status_code, 401)
+
+
+# tests for the similar products of a product
+class TestProductSimilar(TestCaseBase):
+    def test_similar_products(self):
+        toys, books = (Category.objects.create(name=name) for name in ('toys', 'books'))
+        bear = Product.objects.create(name='teddy bear', price=20, rank=1, category=toys)
+        red, blue = (Product.objects.create(name=name, price=price, rank=1, category=toys)
+                     for name, price in (('red teddy bear', 30), ('blue teddy', 10)))
+        book = Product.objects.create(name='teddy bear stories', price=15, rank=1, category=books)
+        for similar, score in ((red, 0.9), (blue, 0.5), (book, 0.7)):
+            SimilarProduct.objects.create(product=bear, similar=similar, score=score)
+        SimilarProduct.objects.create(product=red, similar=bear, score=0.9)
+
+        url = reverse('api:product-similar', kwargs={'pk': bear.pk})
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product['name'] for product in response.data], [red.name, book.name, blue.name])
+        self.assertEqual(response.data[0], ProductSerializer(red).data)
+
+        # filtered after the similar products are looked up
+        self.assertEqual([product['name'] for product in client.get(url, {'price_lt': 25}).data], [book.name, blue.name])
+        self.assertEqual([product['name'] for product in client.get(url, {'category': toys.pk}).data], [red.name, blue.name])
+        self.assertEqual(client.get(url, {'price_lt': 'cheap'}).status_code, 400)
+
+    def test_products_without_similar_products(self):
+        product = Product.objects.create(name='chess', price=1, rank=1, category=Category.objects.create(name='games'))
+        response = client.get(reverse('api:product-similar', kwargs={'pk': product.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [])
+
+        response = client.get(reverse('api:product-similar', kwargs={'pk': product.pk + 1}))
+        self.assertEqual(response.status_code, 404)
+
+    @skipIf(similar_products.np is None, 'numpy and scipy are not installed')
+    def test_build_refreshes_cached_responses(self):
+        category = Category.objects.create(name='toys')
+        bear = Product.objects.create(name='teddy bear', price=1, rank=1, category=category)
+        url = reverse('api:product-similar', kwargs={'pk': bear.pk})
+        self.assertEqual(client.get(url).data, [])
+
+        # renaming doesn't touch the catalog version, only the build does
+        Product.objects.create(name='kite', price=1, rank=1, category=category)
+        with tempfile.TemporaryDirectory() as directory:
+            state = os.path.join(directory, 'similar_products.npz')
+            call_command('build_similar_products', '--state', state, stdout=StringIO())
+            self.assertEqual(client.get(url).data, [])
+            Product.objects.create(name='red teddy bear', price=1, rank=1, category=category)
+            call_command('build_similar_products', '--state', state, stdout=StringIO())
+        self.assertEqual([product['name'] for product in client.get(url).data], ['red teddy bear'])
@@ -0,0 +1,219 @@
+"""
+Per-request breakdown of where the time went, as a Server-Timing header.
+
+`ServerTimingMiddleware` times a sample of the requests, SERVER_TIMING_SAMPLE_RATE
+of them (0 turns it off, 1 times every request). For those it measures
+
+    db          time spent running queries, and how many, through an
+                execute wrapper on every database connection
+    serialize   time spent in DRF serializers' `.data` or the values() fast
+                path, less the queries run while serializing (querysets
+                are often evaluated there)
+    render      time spent rendering the response
+    total       time spent in the rest of the stack, from this middleware on
+
+and adds them to the response as a Server-Timing header, which browsers
+show in their network tab, and logs them on the api.timing logger.
+
+Requests that aren't sampled cost one random number; serializers and
+queries outside a sampled request one context variable lookup. The
+context variable follows a request under ASGI into the threads its sync
+views run on. Queries run after the response leaves the middleware, such
+as those of a streaming response, aren't counted.
+
+"""
+
+
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from rest_framework import serializers
+
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Durations, in seconds, measured for one request.
+    """
+
+    def __init__(self):
+        self.db = 0.0
+        self.queries = 0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.total = 0.0
+        self._serializing = False
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+    def as_dict(self):
+        return {
+            'total_ms': round(self.total * 1000, 2),
+            'db_ms': round(self.db * 1000, 2),
+            'queries': self.queries,
+            'serialize_ms': round(self.serialize * 1000, 2),
+            'render_ms': round(self.render * 1000, 2),
+        }
+
+    def header(self):
+        return ', '.join([
+            'db;dur=%.2f;desc="%d queries"' % (self.db * 1000, self.queries),
+            'serialize;dur=%.2f' % (self.serialize * 1000),
+            'render;dur=%.2f' % (self.render * 1000),
+            'total;dur=%.2f' % (self.total * 1000),
+        ])
+
+
+def current_timings():
+    """
+    Returns the timings of the request being sampled, if any.
+    """
+    return _current.get()
+
+
+@contextmanager
+def serializing():
+    """
+    Counts the time spent in the block as serialization, for code that
+    serializes without a serializer's `.data`.
+    """
+    timings = _current.get()
+    # nested serializers are part of the outer one's time
+    if timings is None or timings._serializing:
+        yield
+        return
+    timings._serializing = True
+    db = timings.db
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serialize += time.perf_counter() - start - (timings.db - db)
+        timings._serializing = False
+
+
+def _timed_data(prop):
+    fget = prop.fget
+
+    @wraps(fget)
+    def data(self):
+        if _current.get() is None:
+            return fget(self)
+        with serializing():
+            return fget(self)
+
+    return property(data)
+
+
+def _timed_execute(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings.execute(execute, sql, params, many, context)
+
+
+def _wrap_connection(sender, connection, **kwargs):
+    # sent again each time the connection reconnects; first in the list so
+    # that leaving an execute_wrapper() block still pops its own wrapper
+    if _timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _timed_execute)
+
+
+def install():
+    """
+    Times the `.data` of every serializer and the queries of every
+    connection, called once from ApiConfig.ready().
+    """
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        if not getattr(cls.data.fget, '__wrapped__', None):
+            cls.data = _timed_data(cls.data)
+    connection_created.connect(_wrap_connection, dispatch_uid='api.timing')
+
+
+class ServerTimingMiddleware:
+    """
+    Adds a Server-Timing header to a sample of the responses. Goes first in
+    MIDDLEWARE so that it times everything below it.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings.total = time.perf_counter() - start
+            _current.reset(token)
+        return self.add_timings(request, response, timings)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings.total = time.perf_counter() - start
+            _current.reset(token)
+        return self.add_timings(request, response, timings)
+
+    def sampled(self):
+        rate = settings.SERVER_TIMING_SAMPLE_RATE
+        return rate > 0 and (rate >= 1 or random.random() < rate)
+
+    def add_timings(self, request, response, timings):
+        response['Server-Timing'] = timings.header()
+        fields = timings.as_dict()
+        logger.info(
+            'method=%s path=%s status=%s %s',
+            request.method, request.path, response.status_code,
+            ' '.join('%s=%s' % item for item in fields.items()),
+            extra={'timings': dict(fields, method=request.method, path=request.path, status=response.status_code)},
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after the template response hooks
+        timings = _current.get()
+        if timings is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                timings.render += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,203 @@
+"""
+Refresh tokens with an in-process filter in front of the blacklist table.
+
+Every refresh and logout checks whether the refresh token was blacklisted.
+Almost none are, so each worker keeps a Bloom filter of the blacklisted
+jtis and only asks the database about tokens the filter might contain.
+
+The filter must never miss a blacklisted token. Every blacklisting is
+published to the other workers through the shared cache, once committed,
+as a numbered entry holding the jti. Before each check a worker reads the
+latest number and adds the entries it hasn't seen to its filter. If an
+entry was evicted, it reloads the filter from the database instead. That
+is one cache read per check and no queries at all. The numbers start from
+a random base each time the counter is made, so a worker also reloads
+when the counter itself was evicted and made again.
+
+That takes a cache every worker shares, such as memcached. With a process
+local one (locmem, the default CACHES, or dummy) workers wouldn't hear of
+each other's blacklistings, so every check queries the table, unless
+TOKEN_BLACKLIST_FILTER says otherwise for a single process deployment.
+"""
+
+
+import hashlib
+import logging
+import math
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+
+logger = logging.getLogger(__name__)
+
+BLACKLIST_SEQUENCE_KEY = 'token_blacklist:sequence'
+BLACKLIST_ENTRY_KEY = 'token_blacklist:entry:%d'
+
+# a worker further behind than this reloads the filter instead
+MAX_CATCH_UP = 1000
+
+
+class BloomFilter:
+    """
+    Set membership with false positives but no false negatives, in
+    about 1.8 bytes per item at a 0.1% false positive rate.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # derive all the positions from two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+# the numbers of one counter share their bits above these
+EPOCH_SHIFT = 32
+
+
+def filter_enabled():
+    """
+    Returns whether the checks go through the filter, by default only when
+    the cache is shared between processes.
+    """
+    if settings.TOKEN_BLACKLIST_FILTER is not None:
+        return bool(settings.TOKEN_BLACKLIST_FILTER)
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def _publish(jti):
+    # a counter made again after an eviction starts elsewhere, so workers
+    # don't take its numbers for ones they've already seen
+    cache.add(BLACKLIST_SEQUENCE_KEY, random.getrandbits(31) << EPOCH_SHIFT, timeout=None)
+    number = cache.incr(BLACKLIST_SEQUENCE_KEY)
+    cache.set(BLACKLIST_ENTRY_KEY % number, jti, settings.TOKEN_BLACKLIST_ENTRY_TIMEOUT)
+
+
+class BlacklistFilter:
+    """
+    This process's Bloom filter of blacklisted jtis, kept in sync with the
+    blacklist table.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._filter = None
+        self._sequence = None
+
+    def warm(self):
+        """
+        Loads every unexpired blacklisted jti into a new filter.
+        """
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        # read the number before the table, entries published meanwhile are
+        # picked up by the next check
+        self._sequence = cache.get(BLACKLIST_SEQUENCE_KEY, 0)
+        jtis = list(
+            BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+            .values_list('token__jti', flat=True)
+        )
+        # leave room to grow, the filter is rebuilt once it is full
+        self._filter = BloomFilter(max(self.capacity, 2 * len(jtis)))
+        for jti in jtis:
+            self._filter.add(jti)
+
+    def _sync(self):
+        sequence = cache.get(BLACKLIST_SEQUENCE_KEY, 0)
+        if (
+            self._filter is None or self._filter.count > self._filter.capacity
+            or sequence >> EPOCH_SHIFT != self._sequence >> EPOCH_SHIFT or sequence < self._sequence
+        ):
+            self._load()
+        elif sequence - self._sequence > MAX_CATCH_UP:
+            self._load()
+        elif sequence > self._sequence:
+            keys = [BLACKLIST_ENTRY_KEY % number for number in range(self._sequence + 1, sequence + 1)]
+            entries = cache.get_many(keys)
+            if len(entries) < len(keys):
+                self._load()
+                return
+            for jti in entries.values():
+                self._add(jti)
+            self._sequence = sequence
+
+    def _add(self, jti):
+        # this process sees its own entries again, don't count them twice
+        if jti not in self._filter:
+            self._filter.add(jti)
+
+    def __contains__(self, jti):
+        with self._lock:
+            self._sync()
+            return jti in self._filter
+
+    def add(self, jti):
+        """
+        Adds a jti blacklisted by this process and tells the other ones once
+        the blacklisting is committed.
+        """
+        with self._lock:
+            if self._filter is not None:
+                self._add(jti)
+        transaction.on_commit(lambda: _publish(jti))
+
+
+blacklist_filter = BlacklistFilter(settings.TOKEN_BLACKLIST_FILTER_CAPACITY)
+
+
+def warm_blacklist_filter():
+    """
+    Loads the filter when a worker starts rather than on its first refresh.
+    A database that isn't reachable yet only postpones that to the first check.
+    """
+    try:
+        blacklist_filter.warm()
+    except DatabaseError:
+        logger.warning('Could not load the token blacklist filter', exc_info=True)
+    finally:
+        # the connection belongs to no request, don't leave it open
+        connections.close_all()
+
+
+class RefreshToken(tokens.RefreshToken):
+    """
+    `RefreshToken` that only queries the blacklist for the tokens
+    `blacklist_filter` might contain, when `filter_enabled()`.
+    """
+
+    def check_blacklist(self):
+        if not filter_enabled() or self.payload[api_settings.JTI_CLAIM] in blacklist_filter:
+            super().check_blacklist()
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM])
+        return result
@@ -1,4 +1,5 @@
 from .views import *
+from .hashing import hashing_pool_view
 from django.urls import path
 from rest_framework_simplejwt.views import (
     TokenRefreshView,
@@ -8,8 +9,8 @@ app_name = 'api'
 
 urlpatterns = [
     # auth
-    path('signup/', SignupAPIView.as_view(), name='signup'),
-    path('login/', LoginAPIView.as_view(), name="login"),
+    path('signup/', hashing_pool_view(SignupAPIView.as_view()), name='signup'),
+    path('login/', hashing_pool_view(LoginAPIView.as_view()), name="login"),
     path('logout/', LogoutAPIView.as_view(), name="logout"),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path("password-reset/", PasswordResetView.as_view(), name="password-reset"),
@@ -18,18 +19,65 @@ urlpatterns = [
 
     # product
     path('product/', ProductListAPIView.as_view(), name='product-list'),
+    path('product/facets/', ProductFacetsAPIView.as_view(), name='product-facets'),
+    path('product/search/', ProductSearchAPIView.as_view(), name='product-search'),
     path('product/detail/<int:pk>/', ProductDetailAPIView.as_view(), name='product-detail'),
+    path('product/<int:pk>/similar/', ProductSimilarAPIView.as_view(), name='product-similar'),
     path('product/delete/<int:pk>/', ProductDeleteAPIView.as_view(), name='product-delete'),
     path('product/update/<int:pk>/', ProductUpdateAPIView.as_view(), name='product-update'),
     path('product/create/', ProductCreateAPIView.as_view(), name='product-create'),
+    path('product/export/', ProductExportAPIView.as_view(), name='product-export'),
 
     # category
     path('category/', CategoryListCreateAPIView.as_view(), name='category-list-create'),
     path('category/<int:pk>/', CategoryRetrieveUpdateDestroyAPIView.as_view(), name='category-retrive-update-destroy'),
+    path('category/<int:pk>/top/', CategoryTopProductsAPIView.as_view(), name='category-top-products'),
 
     # wishlist
     path('wishlist/', WishlistView.as_view(), name='wishlist'),
+    path('wishlist/recommendations/', WishlistRecommendationsView.as_view(), name='wishlist-recommendations'),
     path('wishlist/<user>/', WishlistByIdentifierView.as_view(), name='wishlist-view-by-identifier'),
     path('wishlist/product_delete/<int:pk>/', WishlistRemoveProductView.as_view(), name='wishlist-product-delete-view'),
       
-]
\ No newline at end of file
+]
+
+
+# maximum number of queries each endpoint may run per method, regardless of
+# how many rows are involved. Enforced by the query budget tests in api/tests.py
+QUERY_BUDGETS = {
+    'signup': {'POST': 4},
+    'login': {'POST': 10},
+    'logout': {'POST': 7},
+    'token_refresh': {'POST': 1},
+    'password-reset': {'POST': 1},
+    'password-reset-confirm': {'POST': 2},
+
+    'product-list': {'GET': 1},
+    'product-facets': {'GET': 1},
+    # the first search of a process also checks for pg_trgm
+    'product-search': {'GET': 3},
+    'product-detail': {'GET': 2},
+    # a product without similar products is looked up to tell it from a missing one
+    'product-similar': {'GET': 2},
+    # writes also update the top products of the categories involved, see
+    # product/top_products.py, up to 6 queries when a product changes category,
+    # which is also checked against the wishlists holding the product.
+    # Deletes delete the product's recommendations and similar products too
+    'product-delete': {'DELETE': 12},
+    'product-update': {'PATCH': 13},
+    'product-create': {'POST': 5},
+    'product-export': {'GET': 2},
+
+    'category-list-create': {'GET': 2, 'POST': 2},
+    # deleting a category deletes its top products, recommendations and similar
+    # products too, and touches the wishlists holding its products, in the same
+    # number of queries whatever the number of products
+    'category-retrive-update-destroy': {'GET': 2, 'PUT': 3, 'DELETE': 12},
+    # a category without products is looked up to tell it from a missing one
+    'category-top-products': {'GET': 2},
+
+    'wishlist': {'GET': 3, 'PUT': 9, 'PATCH': 9},
+    'wishlist-recommendations': {'GET': 1},
+    'wishlist-view-by-identifier': {'GET': 3},
+    'wishlist-product-delete-view': {'PUT': 5},
+}
@@ -0,0 +1,119 @@
+"""
+Read-only fast path for list endpoints.
+
+Listing through a ModelSerializer builds a model instance (and one per
+select_related row) for every row and resolves every field through DRF's
+attribute machinery. `ValuesListMixin` instead fetches the serialized
+fields with `.values()`, related fields joined in SQL, and converts each
+value with the serializer's own field, so the output is the same, byte
+for byte. Only fields that represent a single column qualify, i.e. not
+relations, nested serializers or method fields.
+
+API_VALUES_SERIALIZERS=0 turns the fast path off everywhere.
+
+"""
+
+
+import copy
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .timing import serializing
+
+
+# fields whose to_representation is exactly this builtin
+BUILTIN_REPRESENTATIONS = {
+    serializers.CharField: str,
+    serializers.IntegerField: int,
+}
+
+UNSUPPORTED_FIELDS = (
+    serializers.BaseSerializer,
+    serializers.RelatedField,
+    serializers.ManyRelatedField,
+    serializers.SerializerMethodField,
+    serializers.HiddenField,
+)
+
+
+class ValuesMapper:
+    """
+    Turns `.values()` rows into the representation of `serializer_class`.
+    """
+
+    def __init__(self, serializer_class):
+        self.fields = []
+        for field in serializer_class().fields.values():
+            if field.write_only:
+                continue
+            if isinstance(field, UNSUPPORTED_FIELDS) or field.source == '*':
+                raise ImproperlyConfigured(
+                    '%s.%s cannot be read from .values()' % (serializer_class.__name__, field.field_name)
+                )
+            self.fields.append((field.field_name, '__'.join(field.source_attrs), field))
+        self.lookups = tuple(lookup for _, lookup, _ in self.fields)
+
+    def compile(self):
+        """
+        Returns the (name, lookup, converter) of each field for the current
+        request.
+        """
+        compiled = []
+        for name, lookup, field in self.fields:
+            converter = BUILTIN_REPRESENTATIONS.get(type(field))
+            if converter is None:
+                if isinstance(field, serializers.DateTimeField) and not hasattr(field, 'timezone'):
+                    # the current timezone is looked up for every value
+                    # otherwise, it can't change within a request
+                    field = copy.copy(field)
+                    field.timezone = field.default_timezone()
+                converter = field.to_representation
+            compiled.append((name, lookup, converter))
+        return compiled
+
+    def represent(self, row, fields=None):
+        data = {}
+        for name, lookup, to_representation in fields or self.compile():
+            value = row[lookup]
+            # None is never passed to a field, like in Serializer.to_representation
+            data[name] = None if value is None else to_representation(value)
+        return data
+
+    def represent_many(self, rows):
+        fields = self.compile()
+        represent = self.represent
+        with serializing():
+            return [represent(row, fields) for row in rows]
+
+
+@lru_cache(maxsize=None)
+def get_values_mapper(serializer_class):
+    return ValuesMapper(serializer_class)
+
+
+class ValuesListMixin:
+    """
+    Serves list GETs from `.values()` rows instead of serializer instances.
+    Works with unpaginated lists and the keyset pagination.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not settings.API_VALUES_SERIALIZERS:
+            return super().list(request, *args, **kwargs)
+
+        mapper = get_values_mapper(self.get_serializer_class())
+        # the keyset pagination reads its position from the rows
+        pagination = self.pagination_class
+        lookups = dict.fromkeys(
+            mapper.lookups + tuple(getattr(pagination, 'ordering_fields', ())) + ('pk',)
+        )
+        queryset = self.filter_queryset(self.get_queryset()).values(*lookups)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(mapper.represent_many(page))
+        return Response(mapper.represent_many(queryset))
@@ -9,10 +9,23 @@ from rest_framework import status, views, mixins
 from rest_framework.generics import *
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.contrib.auth import authenticate, login
+from .tokens import RefreshToken
+from django.conf import settings
+from django.contrib.auth import login
+from django.contrib.auth.signals import user_logged_in
 from .serializers import *
+from rest_framework.exceptions import ValidationError
+from .pagination import ProductCursorPagination, ProductSearchPagination
+from .cache import CachedResponseMixin
+from .conditional import conditional_get
+from .export import EXPORT_FORMATS, buffered, export_rows
+from .filters import ProductFilterBackend, filter_products, product_facets
+from .search import search_products
+from .values import ValuesListMixin
+from product.top_products import deleting_category
 from django.contrib.auth.tokens import default_token_generator
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils.encoding import force_bytes
@@ -93,11 +106,17 @@ class LoginAPIView(GenericAPIView):
 
         """
 
+        # validating the credentials is the one password hash of the request,
+        # and rehashes the password if it was stored with an outdated hasher
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data
-        authenticate(user)
-        login(request, user)
+        if settings.API_LOGIN_STATELESS:
+            # clients get the tokens only, there is no session to start.
+            # last_login is still kept by the user_logged_in receivers.
+            user_logged_in.send(sender=user.__class__, request=request, user=user)
+        else:
+            login(request, user)
         serializer = UserSerializer(user)
         token = RefreshToken.for_user(user)
         data = serializer.data
@@ -217,48 +236,154 @@ class PasswordResetConfirmView(CreateAPIView):
 
 
 # product
-class ProductListAPIView(ListAPIView):
+class ProductListAPIView(CachedResponseMixin, ValuesListMixin, ListAPIView):
     """
     This method sends the get request to the endpoint and returns a list of the products.
 
+    The list is paginated with an opaque cursor, use `?ordering=price|rank|created_time`
+    (prefix with `-` for descending) and follow the `next`/`previous` links.
+
+    Takes optional arguments for filtering the list
+        category: id of a category, repeat it to match any of several
+        price_gt: Minimum price of products to be returned
+        price_lt: maximum price of products to be returned
+        rank_gte: minimum rank of products to be returned
+        rank_lte: maximum rank of products to be returned
+
     """
     permission_classes = (AllowAny,)
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+    filter_backends = (ProductFilterBackend,)
+    cache_query_params = (
+        'category', 'price_gt', 'price_lt', 'rank_gte', 'rank_lte', 'ordering', 'cursor', 'page_size',
+    )
+    cache_integer_params = ('category', 'rank_gte', 'rank_lte', 'page_size')
+    cache_decimal_params = ('price_gt', 'price_lt')
 
-    def get_queryset(self):
+
+class ProductFacetsAPIView(CachedResponseMixin, views.APIView):
+    """
+
+        This endpoint view counts the products per category and price range,
+        for the sidebar next to the product list
+
+    """
+    permission_classes = (AllowAny,)
+    cache_query_params = ('category', 'price_gt', 'price_lt', 'rank_gte', 'rank_lte')
+    cache_integer_params = ('category', 'rank_gte', 'rank_lte')
+    cache_decimal_params = ('price_gt', 'price_lt')
+
+    def get(self, request, *args, **kwargs):
         """
 
-         This method overrides the get queryset method.
+         Takes the same filters as the product list.
+
+        Returns:
+            the number of matching products, their counts per category and
+            per price bucket. The category counts ignore the category filter.
+
+        """
+        return Response(product_facets(Product.objects.all(), request.query_params))
+
+
+class ProductSearchAPIView(CachedResponseMixin, ListAPIView):
+    """
+
+        This endpoint view searches the products by name, best matches first
+
+    """
+    permission_classes = (AllowAny,)
+    serializer_class = ProductSerializer
+    pagination_class = ProductSearchPagination
+    cache_query_params = ('q', 'page', 'page_size')
+    cache_integer_params = ('page', 'page_size')
+
+    def get_queryset(self):
+        """
 
          Args:
-            Takes optional arguments for filtering the queryset
-            price_gt: Minimum price of products to be returned
-            price_lt: maximum price of products to be returned
+            q: the words to look for in the product names, the last one
+               may be incomplete
 
         Returns:
-            list of products
-            if there is a query string, it returns list of products based on the the query string
+            list of matching products, paginated by page number
+
         """
-        queryset = super().get_queryset()
-        price_gt = self.request.query_params.get('price_gt')
-        price_lt = self.request.query_params.get('price_lt')
-        if price_gt:
-            queryset = queryset.filter(price__gt=price_gt)
-        if price_lt:
-            queryset = queryset.filter(price__lt=price_lt)
-        return queryset
+        q = self.request.query_params.get('q', '').strip()
+        if not q:
+            raise ValidationError({'q': ['This query param is required.']})
+        return search_products(Product.objects.select_related('category'), q)
 
 
-class ProductDetailAPIView(RetrieveAPIView):
+class ProductDetailAPIView(CachedResponseMixin, RetrieveAPIView):
     """
 
         This endpoint view gets the details for a particular product
 
     """
     permission_classes = (AllowAny,)
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('category')
+    serializer_class = ProductSerializer
+
+    def get_validators(self, pk):
+        """
+
+        Both validators cover the category name as well, since renaming the
+        category changes the response without touching the product.
+
+        """
+        row = Product.objects.filter(pk=pk).values_list(
+            'updated_time', 'category__name', 'category__updated_time'
+        ).first()
+        if row is None:
+            return None
+        updated_time, category, category_updated_time = row
+        return (pk, updated_time.isoformat(), category), max(updated_time, category_updated_time)
+
+    @conditional_get
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class ProductSimilarAPIView(CachedResponseMixin, ValuesListMixin, ListAPIView):
+    """
+
+        This endpoint view lists the products with names most like a product's,
+        most similar first, at most SIMILAR_PRODUCTS_PER_PRODUCT of them. Built
+        offline by `manage.py build_similar_products`, see product/similar_products.py
+
+        Takes the optional filters of the product list, applied to the similar
+        products kept, e.g. price_lt to stay within a budget
+            category: id of a category, repeat it to match any of several
+            price_gt: Minimum price of products to be returned
+            price_lt: maximum price of products to be returned
+            rank_gte: minimum rank of products to be returned
+            rank_lte: maximum rank of products to be returned
+
+    """
+    permission_classes = (AllowAny,)
     serializer_class = ProductSerializer
+    pagination_class = None
+    filter_backends = (ProductFilterBackend,)
+    cache_query_params = ('category', 'price_gt', 'price_lt', 'rank_gte', 'rank_lte')
+    cache_integer_params = ('category', 'rank_gte', 'rank_lte')
+    cache_decimal_params = ('price_gt', 'price_lt')
+
+    def get_queryset(self):
+        return (
+            Product.objects.select_related('category')
+            .filter(similar_to__product=self.kwargs['pk'])
+            .order_by('-similar_to__score', 'pk')
+        )
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        # only a product without similar products needs checking
+        if not response.data and not Product.objects.filter(pk=self.kwargs['pk']).exists():
+            raise Http404
+        return response
 
 
 class ProductDeleteAPIView(DestroyAPIView):
@@ -293,8 +418,47 @@ class ProductCreateAPIView(CreateAPIView):
 
 
 
+class ProductExportAPIView(views.APIView):
+    """
+
+        This endpoint view streams the whole catalog for downstream systems
+
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        """
+
+         This method streams every product as it is read from the database,
+         so the export never holds the catalog in memory.
+
+         Args:
+            output: `ndjson` (default, one JSON object per line) or `csv`
+            and the same filters as the product list
+
+        Returns:
+            the products in id order, with the category's name.
+
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            return Response(
+                {"output": [f"Must be one of: {', '.join(EXPORT_FORMATS)}."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        write_lines, content_type, extension = EXPORT_FORMATS[output]
+
+        queryset = filter_products(Product.objects.all(), request.query_params)
+        response = StreamingHttpResponse(
+            buffered(write_lines(export_rows(queryset))), content_type=content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="products.{extension}"'
+        return response
+
+
+
 # category
-class CategoryListCreateAPIView(ListCreateAPIView):
+class CategoryListCreateAPIView(CachedResponseMixin, ValuesListMixin, ListCreateAPIView):
     """
 
         This endpoint view creates a creates a category and lists categories
@@ -315,6 +479,39 @@ class CategoryRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    def perform_destroy(self, instance):
+        # its products go with it, the category's signals do once what their
+        # own would do for each of them
+        with deleting_category(instance.pk):
+            instance.delete()
+
+
+class CategoryTopProductsAPIView(CachedResponseMixin, ValuesListMixin, ListAPIView):
+    """
+
+        This endpoint view lists the best ranked products of a category, lowest
+        rank first, at most TOP_PRODUCTS_PER_CATEGORY of them. They are kept
+        up to date as products change, see product/top_products.py
+
+    """
+    permission_classes = (AllowAny,)
+    serializer_class = ProductSerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        return (
+            Product.objects.select_related('category')
+            .filter(top__category=self.kwargs['pk'])
+            .order_by('top__rank', 'pk')
+        )
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        # only a category without products needs checking
+        if not response.data and not Category.objects.filter(pk=self.kwargs['pk']).exists():
+            raise Http404
+        return response
+
 
 class WishlistByIdentifierView(views.APIView):
     """
@@ -327,11 +524,25 @@ class WishlistByIdentifierView(views.APIView):
     def get_object(self, pk):
        
         try:
-            return WishList.objects.get(user__email=pk)
+            return WishList.objects.select_related('user').get(user__email=pk)
         except WishList.DoesNotExist:
             raise Http404
 
 
+    def get_validators(self, user):
+        """
+
+        The wishlist's updated_time changes whenever its products do.
+
+        """
+        row = WishList.objects.filter(user__email=user).values_list('pk', 'updated_time').first()
+        if row is None:
+            return None
+        pk, updated_time = row
+        return (pk, updated_time.isoformat()), updated_time
+
+
+    @conditional_get
     def get(self, request, user, format=None):
         """
 
@@ -375,6 +586,30 @@ class WishlistView(RetrieveUpdateDestroyAPIView):
         return obj
 
 
+class WishlistRecommendationsView(ListAPIView):
+    """
+
+        This endpoint view recommends products for the logged in user's wishlist:
+        the products most often wished for together with the ones in it, from the
+        categories it doesn't have a product in yet. Built offline by
+        `manage.py build_recommendations`, see product/recommendations.py
+
+    """
+    serializer_class = ProductSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = None
+
+    def get_queryset(self):
+        items = WishListItem.objects.filter(wishlist__user=self.request.user)
+        return (
+            Product.objects.select_related('category')
+            .filter(recommended_in__product__in=items.values('product'))
+            .exclude(category__in=items.values('category'))
+            .annotate(score=Sum('recommended_in__score'))
+            .order_by('-score', 'pk')[:settings.RECOMMENDATIONS_LIMIT]
+        )
+
+
 class WishlistRemoveProductView(RetrieveUpdateDestroyAPIView):
     """
 
@@ -410,7 +645,6 @@ class WishlistRemoveProductView(RetrieveUpdateDestroyAPIView):
         product = Product.objects.get(pk=pk)
         products = wishlist.products
         products.remove(product)
-        wishlist.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
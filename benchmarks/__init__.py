@@ -0,0 +1,59 @@
+"""
+Benchmark scripts for the API.
+
+Each benchmark runs against a throwaway test database created from the
+configured DATABASES, so it never touches real data, e.g.
+
+    python -m benchmarks.pagination
+
+"""
+
+
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+
+def setup():
+    """
+    Configures django for a standalone benchmark script.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gift_project.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """
+    Creates the test database for the duration of the block.
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        from accounts.activity import get_activity_buffer
+
+        # buffered logins would otherwise be written to the real database
+        # when the process exits
+        get_activity_buffer().flush()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def timeit(func, repeat=50):
+    """
+    Calls `func` `repeat` times and returns the median duration in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
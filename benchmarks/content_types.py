@@ -0,0 +1,69 @@
+"""
+Compares the product list endpoint's responses in JSON and in MessagePack.
+
+    python -m benchmarks.content_types [products]
+
+Walks every page of 100 products, then reports the total payload size,
+raw and gzipped, and the time to encode and decode the pages with the
+json module, orjson and msgpack. Decoded pages are checked to be identical.
+
+"""
+
+
+import gzip
+import json
+import sys
+
+from benchmarks import setup, test_database, timeit
+
+
+def main(total=10000):
+    setup()
+
+    import msgpack
+    from django.urls import reverse
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.test import APIClient
+
+    from api.renderers import MessagePackRenderer, ORJSONRenderer, orjson
+    from product.models import Category, Product
+
+    with test_database():
+        Category.objects.bulk_create([Category(name=f'category{i}') for i in range(20)])
+        categories = list(Category.objects.all())
+        Product.objects.bulk_create(
+            [
+                Product(name=f'product{i}', price=i % 99991 / 100, rank=i % 50, category=categories[i % 20])
+                for i in range(total)
+            ],
+            batch_size=5000,
+        )
+
+        client = APIClient()
+        pages = []
+        url = reverse('api:product-list') + '?page_size=100'
+        while url:
+            response = client.get(url)
+            pages.append(response.data)
+            url = response.data['next']
+
+        formats = {
+            'json': (JSONRenderer(), json.loads),
+            'orjson': (ORJSONRenderer(), orjson.loads if orjson else json.loads),
+            'msgpack': (MessagePackRenderer(), msgpack.unpackb),
+        }
+        decoded = {}
+        for name, (renderer, loads) in formats.items():
+            bodies = [renderer.render(page) for page in pages]
+            decoded[name] = [loads(body) for body in bodies]
+            size = sum(len(body) for body in bodies)
+            gzipped = sum(len(gzip.compress(body)) for body in bodies)
+            encode_ms = timeit(lambda: [renderer.render(page) for page in pages], repeat=10)
+            decode_ms = timeit(lambda: [loads(body) for body in bodies], repeat=10)
+            print(f'{name:<8} {len(pages)} pages: {size // 1024}KB, {gzipped // 1024}KB gzipped, '
+                  f'encode {encode_ms:.1f}ms, decode {decode_ms:.1f}ms')
+        assert decoded['json'] == decoded['orjson'] == decoded['msgpack']
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
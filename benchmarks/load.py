@@ -0,0 +1,314 @@
+"""
+Load test of every API route, reported as JSON so runs can be compared
+across commits.
+
+    python -m benchmarks.load [requests] [concurrency] [products] > run.json
+
+Seeds a throwaway database with `manage.py seed_benchmark`, then sends
+`requests` requests to every route and method listed in QUERY_BUDGETS,
+shuffled together, from `concurrency` threads through the WSGI handler.
+For each route it reports the p50/p95/p99 latency, the queries per
+request and the responses that weren't 2xx, and for the whole run the
+requests per second. It runs against whatever DATABASES is configured
+to, postgres or, with db_engine=sqlite3, sqlite. sqlite allows one writer
+at a time, so there the requests that aren't GETs take turns and the
+report says `"serialized_writes": true`; their latency leaves out the
+wait.
+
+Requests that change a wishlist or a password borrow a user no other
+thread is using, so concurrent requests don't fail each other.
+
+"""
+
+
+import json
+import queue
+import random
+import subprocess
+import sys
+import threading
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from contextlib import nullcontext
+from pathlib import Path
+
+from benchmarks import setup, test_database
+
+
+PASSWORD = 'benchpass'
+
+
+def percentile(values, p):
+    """
+    Nearest rank percentile of sorted `values`.
+    """
+    if not values:
+        return None
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Workload:
+    """
+    Builds the requests for each route. `<url name>_<method>` returns the
+    path and payload of one request by `user`, an (id, email) pair.
+    """
+
+    def __init__(self):
+        from django.contrib.auth import get_user_model
+        from product.models import Category, Product
+
+        self.products = list(Product.objects.values_list('id', 'category_id'))
+        self.categories = list(Category.objects.values_list('id', 'name'))
+        self.users = list(
+            get_user_model().objects.filter(email__startswith='benchmark').values_list('id', 'email')
+        )
+        self.access_tokens = {}
+        self.by_category = defaultdict(list)
+        for pk, category in self.products:
+            self.by_category[category].append(pk)
+
+    def url(self, name, *args):
+        from django.urls import reverse
+        return reverse('api:%s' % name, args=args)
+
+    def refresh_token(self, user):
+        from django.contrib.auth import get_user_model
+        from api.tokens import RefreshToken
+        return str(RefreshToken.for_user(get_user_model()(pk=user[0])))
+
+    def access_token(self, user):
+        # a client keeps using its token, which keeps the user cache warm
+        if user[0] not in self.access_tokens:
+            from django.contrib.auth import get_user_model
+            from rest_framework_simplejwt.tokens import AccessToken
+            self.access_tokens[user[0]] = str(AccessToken.for_user(get_user_model()(pk=user[0])))
+        return self.access_tokens[user[0]]
+
+    # auth
+    def signup_post(self, user):
+        return self.url('signup'), {'email': 'signup-%s@example.com' % uuid.uuid4().hex, 'password': PASSWORD}
+
+    def login_post(self, user):
+        return self.url('login'), {'email': user[1], 'password': PASSWORD}
+
+    def logout_post(self, user):
+        return self.url('logout'), {'refresh': self.refresh_token(user)}
+
+    def token_refresh_post(self, user):
+        return self.url('token_refresh'), {'refresh': self.refresh_token(user)}
+
+    def password_reset_post(self, user):
+        return self.url('password-reset'), {'email': user[1]}
+
+    def password_reset_confirm_post(self, user):
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.tokens import default_token_generator
+        from django.utils.encoding import force_bytes
+        from django.utils.http import urlsafe_base64_encode
+
+        token = default_token_generator.make_token(get_user_model().objects.get(pk=user[0]))
+        path = self.url('password-reset-confirm', urlsafe_base64_encode(force_bytes(user[0])), token)
+        return path, {'new_password': PASSWORD, 're_new_password': PASSWORD}
+
+    # product
+    def product_list_get(self, user):
+        ordering = random.choice(('price', '-price', 'rank', '-rank', 'created_time'))
+        return '%s?ordering=%s&page_size=20' % (self.url('product-list'), ordering), None
+
+    def product_facets_get(self, user):
+        return '%s?category=%d' % (self.url('product-facets'), random.choice(self.categories)[0]), None
+
+    def product_search_get(self, user):
+        from product.management.commands.seed_benchmark import NOUNS
+        return '%s?q=%s' % (self.url('product-search'), random.choice(NOUNS)), None
+
+    def product_detail_get(self, user):
+        return self.url('product-detail', random.choice(self.products)[0]), None
+
+    def product_similar_get(self, user):
+        return '%s?price_lt=500' % self.url('product-similar', random.choice(self.products)[0]), None
+
+    def product_delete_delete(self, user):
+        from product.models import Product
+        product = Product.objects.create(
+            name='deleted product', price=1, rank=1, category_id=random.choice(self.categories)[0]
+        )
+        return self.url('product-delete', product.pk), None
+
+    def product_update_patch(self, user):
+        return self.url('product-update', random.choice(self.products)[0]), {'rank': random.randint(1, 100)}
+
+    def product_create_post(self, user):
+        data = {
+            'name': 'new product', 'category': random.choice(self.categories)[0],
+            'price': '%d.99' % random.randint(1, 999), 'rank': random.randint(1, 100),
+        }
+        return self.url('product-create'), data
+
+    def product_export_get(self, user):
+        return '%s?output=ndjson' % self.url('product-export'), None
+
+    # category
+    def category_list_create_get(self, user):
+        return self.url('category-list-create'), None
+
+    def category_list_create_post(self, user):
+        return self.url('category-list-create'), {'name': 'new category'}
+
+    def category_retrive_update_destroy_get(self, user):
+        return self.url('category-retrive-update-destroy', random.choice(self.categories)[0]), None
+
+    def category_retrive_update_destroy_put(self, user):
+        pk, name = random.choice(self.categories)
+        return self.url('category-retrive-update-destroy', pk), {'name': name}
+
+    def category_retrive_update_destroy_delete(self, user):
+        from product.models import Category
+        return self.url('category-retrive-update-destroy', Category.objects.create(name='deleted category').pk), None
+
+    def category_top_products_get(self, user):
+        return self.url('category-top-products', random.choice(self.categories)[0]), None
+
+    # wishlist
+    def wishlist_get(self, user):
+        return self.url('wishlist'), None
+
+    def wishlist_put(self, user):
+        from product.models import WishListItem
+        WishListItem.objects.filter(wishlist__user_id=user[0]).delete()
+        categories = random.sample(list(self.by_category), min(5, len(self.by_category)))
+        return self.url('wishlist'), {'products': [random.choice(self.by_category[c]) for c in categories]}
+
+    wishlist_patch = wishlist_put
+
+    def wishlist_recommendations_get(self, user):
+        return self.url('wishlist-recommendations'), None
+
+    def wishlist_view_by_identifier_get(self, user):
+        return self.url('wishlist-view-by-identifier', user[1]), None
+
+    def wishlist_product_delete_view_put(self, user):
+        from product.models import WishList, WishListItem
+        item = WishListItem.objects.filter(wishlist__user_id=user[0]).first()
+        if item is None:
+            product, category = random.choice(self.products)
+            item = WishListItem.objects.create(
+                wishlist=WishList.objects.get(user_id=user[0]), product_id=product, category_id=category
+            )
+        return self.url('wishlist-product-delete-view', item.product_id), None
+
+
+def main(requests=50, concurrency=8, products=10000):
+    setup()
+
+    from django.core.management import call_command
+    from django.db import connection, connections
+    from rest_framework.test import APIClient
+
+    from api.query_budget import QueryCounter
+    from api.urls import QUERY_BUDGETS
+
+    serialized_writes = connection.vendor == 'sqlite'
+    if serialized_writes:
+        # the in-memory test database fails concurrent requests with "database
+        # table is locked" where a file makes them wait for the lock
+        directory = tempfile.TemporaryDirectory()
+        connection.settings_dict['TEST']['NAME'] = str(Path(directory.name) / 'load.sqlite3')
+    write_lock = threading.Lock() if serialized_writes else nullcontext()
+
+    with test_database():
+        users = max(100, concurrency)
+        call_command('seed_benchmark', users=users, products=products, stdout=sys.stderr)
+        workload = Workload()
+
+        tasks = [
+            (name, method, getattr(workload, '%s_%s' % (name.replace('-', '_'), method.lower())))
+            for name, methods in QUERY_BUDGETS.items()
+            for method in methods
+        ] * requests
+        random.shuffle(tasks)
+        pending = queue.Queue()
+        for task in tasks:
+            pending.put(task)
+        free_users = queue.Queue()
+        for user in workload.users:
+            free_users.put(user)
+        results = defaultdict(list)
+        lock = threading.Lock()
+
+        def worker():
+            client = APIClient(raise_request_exception=False)
+            try:
+                while True:
+                    try:
+                        name, method, build = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    user = free_users.get()
+                    try:
+                        with write_lock if method != 'GET' else nullcontext():
+                            path, data = build(user)
+                            headers = {'HTTP_AUTHORIZATION': 'Bearer %s' % workload.access_token(user)}
+                            with QueryCounter() as counter:
+                                start = time.perf_counter()
+                                response = getattr(client, method.lower())(path, data, format='json', **headers)
+                                if response.streaming:
+                                    for _ in response.streaming_content:
+                                        pass
+                                elapsed = time.perf_counter() - start
+                    finally:
+                        free_users.put(user)
+                    with lock:
+                        results['%s %s' % (name, method)].append((elapsed * 1000, counter.count, response.status_code))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+
+        routes = {}
+        for route in sorted(results):
+            timings = sorted(ms for ms, _, _ in results[route])
+            routes[route] = {
+                'requests': len(timings),
+                'errors': sum(1 for _, _, status in results[route] if status >= 400),
+                'p50_ms': round(percentile(timings, 50), 2),
+                'p95_ms': round(percentile(timings, 95), 2),
+                'p99_ms': round(percentile(timings, 99), 2),
+                'queries_per_request': round(sum(q for _, q, _ in results[route]) / len(timings), 2),
+            }
+
+        json.dump({
+            'commit': git_commit(),
+            'database': connection.vendor,
+            'serialized_writes': serialized_writes,
+            'concurrency': concurrency,
+            'products': products,
+            'users': users,
+            'requests': len(tasks),
+            'duration_s': round(duration, 2),
+            'requests_per_s': round(len(tasks) / duration, 1),
+            'routes': routes,
+        }, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
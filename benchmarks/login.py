@@ -0,0 +1,122 @@
+"""
+Measures login throughput and how much a burst of logins delays other
+requests.
+
+    python -m benchmarks.login [logins] [workers]
+
+First the logins run one after the other through the WSGI handler, which
+gives the logins per second a single core sustains, the password hashes
+and the queries per login. They run twice: as a baseline with django's own
+receiver saving last_login on every login, as before the activity buffer,
+and then with the buffer. Then the same number of logins is sent at once
+through the ASGI handler together with a product list request, and the
+time that request takes is reported. `workers` sets
+PASSWORD_HASHING_WORKERS; with 0 the logins hold up the product list
+until they are all done.
+
+"""
+
+
+import asyncio
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from unittest import mock
+
+from benchmarks import setup, test_database
+
+
+@contextmanager
+def synchronous_last_login():
+    """
+    Puts django's `update_last_login` receiver back in place of the buffered one.
+    """
+    from django.contrib.auth.models import update_last_login
+    from django.contrib.auth.signals import user_logged_in
+
+    from accounts.activity import record_last_login
+
+    user_logged_in.disconnect(dispatch_uid='record_last_login')
+    user_logged_in.connect(update_last_login, dispatch_uid='update_last_login')
+    try:
+        yield
+    finally:
+        user_logged_in.disconnect(dispatch_uid='update_last_login')
+        user_logged_in.connect(record_last_login, dispatch_uid='record_last_login')
+
+
+def main(logins=20, workers=0):
+    os.environ['PASSWORD_HASHING_WORKERS'] = str(workers)
+    setup()
+
+    from asgiref.sync import sync_to_async
+    from django.conf import settings
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import get_hasher
+    from django.db import connections
+    from django.test import AsyncClient
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    from api.query_budget import QueryCounter
+
+    hasher = get_hasher()
+    print(f'hasher: {hasher.algorithm}, {getattr(hasher, "iterations", "-")} iterations')
+    print(f'hashing workers: {settings.PASSWORD_HASHING_WORKERS}')
+
+    with test_database():
+        get_user_model().objects.create_user(email='bench@gmail.com', password='benchpass')
+        url = reverse('api:login')
+        data = {'email': 'bench@gmail.com', 'password': 'benchpass'}
+
+        client = APIClient()
+        client.post(url, data, format='json')
+        for name, last_login in (('baseline', synchronous_last_login), ('buffered', nullcontext)):
+            with last_login(), QueryCounter() as counter, mock.patch.object(
+                type(hasher), 'encode', autospec=True, side_effect=type(hasher).encode
+            ) as encode:
+                start = time.perf_counter()
+                for _ in range(logins):
+                    assert client.post(url, data, format='json').status_code == 200
+                elapsed = time.perf_counter() - start
+            print(
+                f'sequential, {name}: {logins / elapsed:.1f} logins/s, '
+                f'{encode.call_count / logins:g} hashes and {counter.count / logins:g} queries per login'
+            )
+
+        async def burst():
+            async_client = AsyncClient()
+
+            async def timed(coroutine):
+                start = time.perf_counter()
+                response = await coroutine
+                return response, time.perf_counter() - start
+
+            requests = [
+                timed(async_client.post(url, data, content_type='application/json'))
+                for _ in range(logins)
+            ]
+            # give the logins a head start so they are queued first
+            tasks = [asyncio.ensure_future(request) for request in requests]
+            await asyncio.sleep(0.01)
+            product_list = await timed(async_client.get(reverse('api:product-list')))
+            results = await asyncio.gather(*tasks)
+            # the test client leaves the connection of the thread running the
+            # sync views open, which would keep the test database in use
+            await sync_to_async(connections.close_all, thread_sensitive=True)()
+            return product_list, results
+
+        start = time.perf_counter()
+        (response, product_list_elapsed), results = asyncio.run(burst())
+        elapsed = time.perf_counter() - start
+        assert response.status_code == 200
+        assert all(login.status_code == 200 for login, _ in results)
+        print(
+            f'burst: {logins / elapsed:.1f} logins/s, '
+            f'product list answered in {product_list_elapsed * 1000:.0f}ms'
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,55 @@
+"""
+Counts the database writes of one login, with and without sessions.
+
+    python -m benchmarks.login_writes [logins]
+
+Logs the same user in `logins` times in the default mode and with
+API_LOGIN_STATELESS, and reports the INSERT, UPDATE and DELETE statements
+per login along with the session rows left behind.
+
+"""
+
+
+import sys
+from collections import Counter
+
+from benchmarks import setup, test_database
+
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def main(logins=20):
+    setup()
+
+    from django.contrib.auth import get_user_model
+    from django.contrib.sessions.models import Session
+    from django.test import override_settings
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    from api.query_budget import QueryCounter
+
+    with test_database():
+        get_user_model().objects.create_user(email='bench@gmail.com', password='benchpass')
+        url = reverse('api:login')
+        data = {'email': 'bench@gmail.com', 'password': 'benchpass'}
+
+        for stateless in (0, 1):
+            Session.objects.all().delete()
+            with override_settings(API_LOGIN_STATELESS=stateless):
+                with QueryCounter() as counter:
+                    for _ in range(logins):
+                        # a new client each time, like a new device logging in
+                        assert APIClient().post(url, data, format='json').status_code == 200
+            statements = Counter(sql.lstrip().split(None, 1)[0].upper() for sql in counter.queries)
+            writes = ', '.join(f'{statements[kind] / logins:g} {kind}' for kind in WRITES)
+            print(
+                f'{"stateless" if stateless else "sessions"}: '
+                f'{counter.count / logins:g} queries per login ({writes}), '
+                f'{Session.objects.count()} session rows'
+            )
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,51 @@
+"""
+Compares the latency of the first and a deep page of the product list.
+
+With keyset pagination page 1000 should cost the same as page 1.
+
+    python -m benchmarks.pagination [products] [page_size]
+
+"""
+
+
+import sys
+
+from benchmarks import setup, test_database, timeit
+
+
+def main(total=50000, page_size=20):
+    setup()
+
+    from rest_framework.test import APIClient
+    from django.urls import reverse
+    from product.models import Category, Product
+
+    with test_database():
+        Category.objects.bulk_create([Category(name=f'category{i}') for i in range(20)])
+        categories = list(Category.objects.all())
+        Product.objects.bulk_create(
+            [
+                Product(name=f'product{i}', price=i % 997, rank=i % 50, category=categories[i % 20])
+                for i in range(total)
+            ],
+            batch_size=5000,
+        )
+
+        client = APIClient()
+        url = reverse('api:product-list')
+        for ordering in ('price', '-rank', 'created_time'):
+            first = f'{url}?ordering={ordering}&page_size={page_size}'
+
+            # walk to the deepest page the catalog allows, up to page 1000
+            deep = first
+            depth = min(1000, total // page_size)
+            for _ in range(depth - 1):
+                deep = client.get(deep).data['next']
+
+            first_ms = timeit(lambda: client.get(first))
+            deep_ms = timeit(lambda: client.get(deep))
+            print(f'ordering={ordering:<14} page 1: {first_ms:.2f}ms  page {depth}: {deep_ms:.2f}ms')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,82 @@
+"""
+Times building the wishlist recommendations, in full and incrementally,
+and serving them.
+
+    python -m benchmarks.recommendations [users] [products] [wishlist size]
+
+Seeds the users' wishlists with seed_benchmark, builds the recommendations
+from all of them, then changes 1% of the wishlists and builds again from
+the changes only. The incremental build is checked against a full one.
+
+"""
+
+
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks import setup, test_database, timeit
+
+
+def main(users=20000, products=10000, wishlist_size=8):
+    # everything is seeded moments before the first build, the incremental
+    # build would read it all again
+    os.environ['INCREMENTAL_BUILD_OVERLAP'] = '0'
+    setup()
+
+    import time
+
+    from django.core.management import call_command
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from api.query_budget import QueryCounter
+    from product.models import Recommendation, WishList, WishListItem
+    from product.recommendations import build_recommendations
+
+    with test_database(), tempfile.TemporaryDirectory() as directory:
+        state = str(Path(directory) / 'recommendations.npz')
+        call_command(
+            'seed_benchmark', '--users', str(users), '--categories', '20', '--products', str(products),
+            '--wishlist-size', str(wishlist_size), '--password', 'benchpass', verbosity=0,
+        )
+        print(f'{WishListItem.objects.count()} wishlist items in {users} wishlists, {products} products')
+
+        start = time.perf_counter()
+        result = build_recommendations(full=True, path=state)
+        print(f'full build: {(time.perf_counter() - start) * 1000:.0f}ms, '
+              f'{result.products} products, {result.rows} recommendations')
+
+        # swap one product of 1% of the wishlists for another of the same category
+        rng = random.Random(0)
+        changed = rng.sample(list(WishList.objects.values_list('pk', flat=True)), users // 100)
+        for pk in changed:
+            item = WishListItem.objects.filter(wishlist=pk).first()
+            other = rng.choice(list(item.category.product_set.exclude(pk=item.product_id).values_list('pk', flat=True)[:50]))
+            item.wishlist.products.remove(item.product_id)
+            item.wishlist.products.add(other)
+
+        start = time.perf_counter()
+        result = build_recommendations(path=state)
+        print(f'incremental build, {result.wishlists} wishlists changed: {(time.perf_counter() - start) * 1000:.0f}ms, '
+              f'{result.products} products rewritten')
+        incremental = set(Recommendation.objects.values_list('product', 'recommended', 'score'))
+        build_recommendations(full=True, path=state)
+        assert set(Recommendation.objects.values_list('product', 'recommended', 'score')) == incremental
+
+        client = APIClient()
+        wishlist = WishList.objects.select_related('user').first()
+        client.credentials(HTTP_AUTHORIZATION='Bearer %s' % AccessToken.for_user(wishlist.user))
+        url = reverse('api:wishlist-recommendations')
+        with QueryCounter() as counter:
+            response = client.get(url)
+        assert response.status_code == 200, response.data
+        print(f'recommendations endpoint: {timeit(lambda: client.get(url)):.2f}ms, '
+              f'{len(response.data)} products, {counter.count} queries')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,70 @@
+"""
+Compares rendering and parsing a large product list with drf's JSON
+renderer and parser and their orjson versions.
+
+    python -m benchmarks.renderers [products]
+
+Two payloads are rendered: the product list as ProductSerializer returns
+it, with prices and times already strings, and raw `.values()` rows,
+where every price is a Decimal and every time a datetime for the encoder
+to convert. The outputs are checked to be identical.
+
+"""
+
+
+import sys
+from decimal import Decimal
+from io import BytesIO
+
+from benchmarks import setup, timeit
+
+
+def main(total=10000):
+    setup()
+
+    from datetime import timedelta
+
+    from django.utils import timezone
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+
+    from api.parsers import ORJSONParser
+    from api.renderers import ORJSONRenderer
+    from api.serializers import ProductSerializer
+    from product.models import Category, Product
+
+    now = timezone.now()
+    categories = [Category(pk=i, name=f'category {i}') for i in range(20)]
+    products = [
+        Product(
+            pk=i, name=f'product {i}', price=Decimal(i % 99999) / 100, rank=i % 50,
+            category=categories[i % 20], created_time=now - timedelta(seconds=i),
+        )
+        for i in range(total)
+    ]
+    payloads = {
+        'serialized': {'next': None, 'previous': None, 'results': ProductSerializer(products, many=True).data},
+        'values': [
+            {'id': p.pk, 'name': p.name, 'price': p.price, 'rank': p.rank, 'created_time': p.created_time}
+            for p in products
+        ],
+    }
+
+    for name, payload in payloads.items():
+        rendered = JSONRenderer().render(payload)
+        assert ORJSONRenderer().render(payload) == rendered
+        json_ms = timeit(lambda: JSONRenderer().render(payload), repeat=10)
+        orjson_ms = timeit(lambda: ORJSONRenderer().render(payload), repeat=10)
+        print(f'render {name:<10} {total} products, {len(rendered) // 1024}KB: '
+              f'json {json_ms:.1f}ms, orjson {orjson_ms:.1f}ms ({json_ms / orjson_ms:.1f}x)')
+
+    body = JSONRenderer().render(payloads['serialized'])
+    assert ORJSONParser().parse(BytesIO(body)) == JSONParser().parse(BytesIO(body))
+    json_ms = timeit(lambda: JSONParser().parse(BytesIO(body)), repeat=10)
+    orjson_ms = timeit(lambda: ORJSONParser().parse(BytesIO(body)), repeat=10)
+    print(f'parse  serialized {total} products: json {json_ms:.1f}ms, orjson {orjson_ms:.1f}ms '
+          f'({json_ms / orjson_ms:.1f}x)')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,78 @@
+"""
+Compares serializing products through ProductSerializer and through the
+values() fast path.
+
+    python -m benchmarks.serializers [products]
+
+Times turning the whole product table into data both ways, then a page
+of 100 products through the product list endpoint with the fast path off
+and on. Rendered outputs are checked to be identical.
+
+"""
+
+
+import sys
+
+from benchmarks import setup, test_database, timeit
+
+
+def main(total=10000):
+    setup()
+
+    from django.core.cache import cache
+    from django.test import override_settings
+    from django.urls import reverse
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.test import APIClient
+
+    from api.serializers import ProductSerializer
+    from api.values import get_values_mapper
+    from product.models import Category, Product
+
+    with test_database():
+        Category.objects.bulk_create([Category(name=f'category{i}') for i in range(20)])
+        categories = list(Category.objects.all())
+        Product.objects.bulk_create(
+            [
+                Product(name=f'product{i}', price=i % 997, rank=i % 50, category=categories[i % 20])
+                for i in range(total)
+            ],
+            batch_size=5000,
+        )
+
+        queryset = Product.objects.select_related('category').order_by('pk')
+        mapper = get_values_mapper(ProductSerializer)
+        lookups = mapper.lookups
+
+        def serializer():
+            return ProductSerializer(queryset, many=True).data
+
+        def values():
+            return mapper.represent_many(queryset.values(*lookups))
+
+        renderer = JSONRenderer()
+        assert renderer.render(serializer()) == renderer.render(values())
+        serializer_ms = timeit(serializer, repeat=5)
+        values_ms = timeit(values, repeat=5)
+        print(f'{total} products: serializer {serializer_ms:.1f}ms, values {values_ms:.1f}ms '
+              f'({serializer_ms / values_ms:.1f}x)')
+
+        client = APIClient()
+        url = reverse('api:product-list') + '?page_size=100&ordering=price'
+
+        def page():
+            # skip the response cache, it would hide the serialization
+            cache.clear()
+            return client.get(url)
+
+        with override_settings(API_VALUES_SERIALIZERS=0):
+            slow = page().content
+            slow_ms = timeit(page)
+        fast = page().content
+        fast_ms = timeit(page)
+        assert slow == fast
+        print(f'product list, 100 per page: serializer {slow_ms:.2f}ms, values {fast_ms:.2f}ms')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
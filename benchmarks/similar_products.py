@@ -0,0 +1,95 @@
+"""
+Times building the similar products, in full and incrementally, and
+serving them.
+
+    python -m benchmarks.similar_products [products] [changed products]
+
+Seeds the products with seed_benchmark, builds the similar products of all
+of them, then renames, deletes and creates some and builds again from the
+changes only. The incremental build is checked against computing every
+product's similar products again with the same weights.
+
+"""
+
+
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks import setup, test_database, timeit
+
+
+def main(products=10000, changed=100):
+    # everything is seeded moments before the first build, the incremental
+    # build would read it all again
+    os.environ['INCREMENTAL_BUILD_OVERLAP'] = '0'
+    setup()
+
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.urls import reverse
+    from django.utils import timezone
+    from rest_framework.test import APIClient
+
+    from api.query_budget import QueryCounter
+    from product.management.commands.seed_benchmark import ADJECTIVES, NOUNS
+    from product.models import Product, SimilarProduct
+    from product.similar_products import (
+        build_similar_products, count_matrix, load_state, read_names, tfidf_vectors, top_similar,
+    )
+
+    with test_database(), tempfile.TemporaryDirectory() as directory:
+        state = str(Path(directory) / 'similar_products.npz')
+        call_command('seed_benchmark', '--users', '0', '--products', str(products), verbosity=0)
+
+        start = time.perf_counter()
+        result = build_similar_products(full=True, path=state)
+        print(f'full build: {(time.perf_counter() - start) * 1000:.0f}ms, '
+              f'{result.products} products, {result.rows} similar products')
+
+        rng = random.Random(0)
+        pks = rng.sample(list(Product.objects.values_list('pk', flat=True)), changed)
+        for pk in pks[:changed // 2]:
+            name = '%s %s %s' % (rng.choice(ADJECTIVES), rng.choice(ADJECTIVES), rng.choice(NOUNS))
+            Product.objects.filter(pk=pk).update(name=name, updated_time=timezone.now())
+        Product.objects.filter(pk__in=pks[changed // 2:]).delete()
+        category = Product.objects.values_list('category', flat=True).first()
+        Product.objects.bulk_create(
+            Product(name='%s %s new' % (rng.choice(ADJECTIVES), rng.choice(NOUNS)), price=1, rank=1, category_id=category)
+            for _ in range(changed // 2)
+        )
+
+        start = time.perf_counter()
+        result = build_similar_products(path=state)
+        print(f'incremental build, {result.read} products changed: {(time.perf_counter() - start) * 1000:.0f}ms, '
+              f'{result.products} products rewritten')
+
+        counts, idf, _, _, _ = load_state(state)
+        ids, names = read_names(Product.objects.all())
+        similar, scores = top_similar(
+            tfidf_vectors(count_matrix(ids, names, counts.shape[0]), idf), ids, settings.SIMILAR_PRODUCTS_PER_PRODUCT,
+        )
+        expected = {
+            (product, other, score)
+            for product, row, row_scores in zip(ids.tolist(), similar.tolist(), scores.tolist())
+            for other, score in zip(row, row_scores) if other >= 0
+        }
+        assert set(SimilarProduct.objects.values_list('product', 'similar', 'score')) == expected
+
+        client = APIClient()
+        url = reverse('api:product-similar', kwargs={'pk': int(ids[0])})
+        with QueryCounter() as counter:
+            response = client.get(url, {'price_lt': 500})
+        assert response.status_code == 200, response.data
+        # a new rank_gte for every request keeps them uncached, like the first
+        # request after a build, every rank is above it
+        uncached = lambda: client.get(url, {'price_lt': 500, 'rank_gte': -rng.randrange(10 ** 9)})
+        print(f'similar products endpoint: {timeit(uncached):.2f}ms, '
+              f'{len(response.data)} products, {counter.count} queries')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -12,8 +12,11 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 from datetime import timedelta
+import importlib.util
 import os
 
+from django.conf import global_settings
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -52,6 +55,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.timing.ServerTimingMiddleware',
+    'api.profiling.ProfilingMiddleware',
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,6 +67,46 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# 0 makes the list views with a values() fast path use their serializers
+# instead, see api/values.py
+API_VALUES_SERIALIZERS = int(os.environ.get('API_VALUES_SERIALIZERS', default=1))
+
+# fraction of the requests that get a Server-Timing header and a log line
+# with their db, serializer and render times, see api/timing.py
+SERVER_TIMING_SAMPLE_RATE = float(os.environ.get('SERVER_TIMING_SAMPLE_RATE', default=0))
+
+# fraction of the requests run under cProfile, of which those taking at least
+# PROFILE_SLOW_MS are saved to PROFILE_DIR, see api/profiling.py
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', default=0))
+PROFILE_SLOW_MS = int(os.environ.get('PROFILE_SLOW_MS', default=500))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+# older profiles are deleted
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', default=200))
+# 1 also samples the stack every PROFILE_STACK_INTERVAL seconds into a
+# collapsed stack file for flame graphs
+PROFILE_COLLAPSED = int(os.environ.get('PROFILE_COLLAPSED', default=0))
+PROFILE_STACK_INTERVAL = float(os.environ.get('PROFILE_STACK_INTERVAL', default=0.005))
+# seconds an X-Profile header value stays valid
+PROFILE_TOKEN_MAX_AGE = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', default=3600))
+
+# directory where each worker process shares its metrics with the others,
+# leave empty when a single process serves the app. See api/metrics.py
+METRICS_DIR = os.environ.get('METRICS_DIR', default='')
+METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', default=5))
+# bearer token /metrics requires, if set
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 ROOT_URLCONF = 'gift_project.urls'
 
 TEMPLATES = [
@@ -81,6 +127,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'gift_project.wsgi.application'
 
+TEST_RUNNER = 'gift_project.runner.TestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -105,9 +153,59 @@ DATABASES = {
         'PORT': os.environ.get('db_port')
 } }
 
+# db_engine=sqlite3 runs on a local file instead (db_name, default db.sqlite3),
+# e.g. for the benchmarks on a machine without postgres
+if os.environ.get('db_engine') == 'sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('db_name', default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+
+
+
+
+
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# point this at a shared backend (memcached, redis) when running several workers
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# seconds a cached product/category response is kept, writes invalidate it sooner
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', default=300))
+
+# best ranked products kept per category for the top products endpoint, run
+# `manage.py refresh_top_products` after changing it. See product/top_products.py
+TOP_PRODUCTS_PER_CATEGORY = int(os.environ.get('TOP_PRODUCTS_PER_CATEGORY', default=10))
 
+# seconds before the start of the last build from which the incremental
+# builds read changes again, longer than the longest transaction saving a
+# wishlist or product (whose updated_time is set when it's saved, not when
+# it commits) plus the clock skew between the hosts saving them
+INCREMENTAL_BUILD_OVERLAP = int(os.environ.get('INCREMENTAL_BUILD_OVERLAP', default=300))
 
+# products wished for together with each product kept by `manage.py
+# build_recommendations` (rebuild with --full after changing it), and how many
+# the wishlist recommendations return. See product/recommendations.py
+RECOMMENDATIONS_PER_PRODUCT = int(os.environ.get('RECOMMENDATIONS_PER_PRODUCT', default=50))
+RECOMMENDATIONS_LIMIT = int(os.environ.get('RECOMMENDATIONS_LIMIT', default=10))
+# matrices the incremental builds start from
+RECOMMENDATIONS_STATE = os.environ.get('RECOMMENDATIONS_STATE', default=str(BASE_DIR / 'recommendations.npz'))
+
+# products with the most similar names kept for each product by `manage.py
+# build_similar_products` (rebuild with --full after changing it), see
+# product/similar_products.py
+SIMILAR_PRODUCTS_PER_PRODUCT = int(os.environ.get('SIMILAR_PRODUCTS_PER_PRODUCT', default=20))
+# matrices the incremental builds start from
+SIMILAR_PRODUCTS_STATE = os.environ.get('SIMILAR_PRODUCTS_STATE', default=str(BASE_DIR / 'similar_products.npz'))
 
 
 
@@ -130,6 +228,23 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/3.2/topics/auth/passwords/
+# new passwords are hashed with PASSWORD_HASHER, passwords stored with any of
+# the other hashers are rehashed with it on the next successful login
+
+PASSWORD_HASHER = os.environ.get(
+    'PASSWORD_HASHER', default='django.contrib.auth.hashers.PBKDF2PasswordHasher'
+)
+PASSWORD_HASHERS = [PASSWORD_HASHER] + [
+    hasher for hasher in global_settings.PASSWORD_HASHERS if hasher != PASSWORD_HASHER
+]
+
+# size of the thread pool the login and signup endpoints hash passwords on,
+# 0 runs them inline. Set it when serving through ASGI, see api/hashing.py
+PASSWORD_HASHING_WORKERS = int(os.environ.get('PASSWORD_HASHING_WORKERS', default=0))
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 
@@ -161,12 +276,56 @@ AUTH_USER_MODEL = 'accounts.CustomUserAccount'
 # drf
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    ]
+        'api.authentication.CachedJWTAuthentication',
+    ],
+    # drf's defaults, with the json renderer and parser on orjson
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# MessagePack for the clients that send or accept application/msgpack, when
+# msgpack is installed
+if importlib.util.find_spec('msgpack'):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].insert(1, 'api.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].insert(1, 'api.parsers.MessagePackParser')
+
 # jwt config
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=30),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=3),
-}
\ No newline at end of file
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.TokenRefreshSerializer',
+}
+
+# 1 makes the login endpoint issue tokens without starting a django session,
+# for deployments whose clients only ever use the returned JWT
+API_LOGIN_STATELESS = int(os.environ.get('API_LOGIN_STATELESS', default=0))
+
+# last_login is buffered in each process and written at most this many seconds
+# later (0 writes it on login), or once ACTIVITY_BUFFER_SIZE users are waiting;
+# the test runner sets None, which leaves the writing to the tests
+ACTIVITY_FLUSH_INTERVAL = int(os.environ.get('ACTIVITY_FLUSH_INTERVAL', default=30))
+ACTIVITY_BUFFER_SIZE = int(os.environ.get('ACTIVITY_BUFFER_SIZE', default=1000))
+
+# users resolved from access tokens are cached in each process for this many
+# seconds, up to JWT_USER_CACHE_SIZE of them (0 turns the cache off)
+JWT_USER_CACHE_TIMEOUT = int(os.environ.get('JWT_USER_CACHE_TIMEOUT', default=60))
+JWT_USER_CACHE_SIZE = int(os.environ.get('JWT_USER_CACHE_SIZE', default=1024))
+
+# blacklisted refresh tokens each process filters in memory before the filter
+# is resized, and seconds the cache keeps each blacklisting for the other
+# processes to pick up (see api/tokens.py)
+TOKEN_BLACKLIST_FILTER_CAPACITY = int(os.environ.get('TOKEN_BLACKLIST_FILTER_CAPACITY', default=100000))
+TOKEN_BLACKLIST_ENTRY_TIMEOUT = int(os.environ.get('TOKEN_BLACKLIST_ENTRY_TIMEOUT', default=86400))
+# 1 checks refresh tokens against that filter, which needs a cache shared by
+# every process when there are several, 0 queries the blacklist every time;
+# unset, the filter is used unless CACHES is process local
+TOKEN_BLACKLIST_FILTER = os.environ.get('TOKEN_BLACKLIST_FILTER')
+if TOKEN_BLACKLIST_FILTER is not None:
+    TOKEN_BLACKLIST_FILTER = int(TOKEN_BLACKLIST_FILTER)
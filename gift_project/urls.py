@@ -19,6 +19,8 @@ from django.urls import path, include
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view as swagger_get_schema_view
 
+from api.metrics import metrics_view
+
 
 schema_view = swagger_get_schema_view(
     openapi.Info(
@@ -32,6 +34,7 @@ schema_view = swagger_get_schema_view(
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/', 
         include([
             path('', include('api.urls')),
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gift_project.settings')
 
 application = get_wsgi_application()
+
+from api.tokens import warm_blacklist_filter
+
+warm_blacklist_filter()
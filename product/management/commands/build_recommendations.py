@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from product.recommendations import build_recommendations, np
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds the "also wished for" product recommendations from the '
+        'wishlists. Only the wishlists changed since the last build are read, '
+        'unless --full is given or the saved state is missing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='rebuild from every wishlist instead of the changes since the last build',
+        )
+        parser.add_argument(
+            '--state',
+            help='file the incremental builds start from (default: RECOMMENDATIONS_STATE)',
+        )
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('build_recommendations requires numpy and scipy')
+
+        start = time.perf_counter()
+        result = build_recommendations(full=options['full'], path=options['state'])
+        self.stdout.write(self.style.SUCCESS(
+            '%s build: read %d wishlists, rewrote the recommendations of %d products, '
+            '%d recommendations in all, in %.2fs' % (
+                'Full' if result.full else 'Incremental', result.wishlists, result.products,
+                result.rows, time.perf_counter() - start,
+            )
+        ))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cache import bump_catalog_version
+from product.similar_products import build_similar_products, np
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds the similar products of every product from the product names. '
+        'Only the products changed since the last build are read, unless '
+        '--full is given or the saved state is missing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='rebuild from every product instead of the changes since the last build',
+        )
+        parser.add_argument(
+            '--state',
+            help='file the incremental builds start from (default: SIMILAR_PRODUCTS_STATE)',
+        )
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('build_similar_products requires numpy and scipy')
+
+        start = time.perf_counter()
+        result = build_similar_products(full=options['full'], path=options['state'])
+        # the similar products endpoint is cached with the catalog
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            '%s build: read %d products, rewrote the similar products of %d products, '
+            '%d similar products in all, in %.2fs' % (
+                'Full' if result.full else 'Incremental', result.read, result.products,
+                result.rows, time.perf_counter() - start,
+            )
+        ))
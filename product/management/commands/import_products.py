@@ -0,0 +1,202 @@
+import csv
+import json
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.cache import bump_catalog_version
+from product.models import Category, Product
+from product.top_products import refresh_top_products
+
+
+NAME_MAX_LENGTH = Product._meta.get_field('name').max_length
+PRICE_FIELD = Product._meta.get_field('price')
+PRICE_STEP = Decimal(1).scaleb(-PRICE_FIELD.decimal_places)
+PRICE_LIMIT = Decimal(10) ** (PRICE_FIELD.max_digits - PRICE_FIELD.decimal_places)
+
+
+class RowError(ValueError):
+    pass
+
+
+def clean_row(row):
+    """
+    Validates a raw row and returns (name, category name, price, rank).
+    """
+    if not isinstance(row, dict):
+        raise RowError('not an object')
+    try:
+        name = str(row['name']).strip()
+        category = str(row['category']).strip()
+        price = row['price']
+        rank = row['rank']
+    except KeyError:
+        raise RowError('name, category, price and rank are required')
+
+    if not name or len(name) > NAME_MAX_LENGTH:
+        raise RowError('invalid name %r' % name)
+    if not category or len(category) > NAME_MAX_LENGTH:
+        raise RowError('invalid category %r' % category)
+
+    try:
+        price = Decimal(str(price).strip())
+    except InvalidOperation:
+        raise RowError('invalid price %r' % price)
+    if not price.is_finite() or price < 0 or price >= PRICE_LIMIT or price != price.quantize(PRICE_STEP):
+        raise RowError('invalid price %r' % str(price))
+
+    try:
+        if isinstance(rank, bool):
+            raise ValueError
+        rank = int(str(rank).strip())
+    except ValueError:
+        raise RowError('invalid rank %r' % rank)
+
+    return name, category, price.quantize(PRICE_STEP), rank
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        yield row
+
+
+def read_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            yield None
+            continue
+        try:
+            yield json.loads(line, parse_float=Decimal)
+        except ValueError:
+            yield line
+
+
+class Command(BaseCommand):
+    help = 'Imports products from a CSV or JSON lines file with name, category, price and rank.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="file to import, '-' reads stdin")
+        parser.add_argument(
+            '--format', choices=('csv', 'jsonl'),
+            help='input format, guessed from the file extension by default',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='rows written per insert and transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--upsert', action='store_true',
+            help='update the price and rank of products that already exist with the same name and category',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if Path(path).suffix in ('.jsonl', '.ndjson') else 'csv')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        self.batch_size = options['batch_size']
+        self.upsert = options['upsert']
+        self.verbosity = options['verbosity']
+
+        # the first category with a name wins, like the api would resolve it
+        self.categories = dict(Category.objects.order_by('-id').values_list('name', 'id'))
+        self.created = self.updated = self.skipped = 0
+
+        start = time.perf_counter()
+        if path == '-':
+            self.import_stream(sys.stdin, fmt)
+        else:
+            try:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    self.import_stream(stream, fmt)
+            except OSError as e:
+                raise CommandError(e)
+        elapsed = time.perf_counter() - start
+
+        rows = self.created + self.updated
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d products (%d created, %d updated, %d skipped) in %.2fs, %.0f rows/s' % (
+                rows, self.created, self.updated, self.skipped, elapsed, rows / elapsed if elapsed else 0,
+            )
+        ))
+
+    def import_stream(self, stream, fmt):
+        reader = read_jsonl(stream) if fmt == 'jsonl' else read_csv(stream)
+        batch = []
+        # csv line numbers start after the header
+        for number, row in enumerate(reader, start=2 if fmt == 'csv' else 1):
+            if row is None:
+                continue
+            try:
+                batch.append(clean_row(row))
+            except RowError as e:
+                self.skipped += 1
+                self.stderr.write('Line %d skipped: %s' % (number, e))
+                continue
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                batch = []
+        if batch:
+            self.write_batch(batch)
+
+    def write_batch(self, batch):
+        with transaction.atomic():
+            self.create_categories({category for _, category, _, _ in batch})
+            products = [
+                Product(name=name, category_id=self.categories[category], price=price, rank=rank)
+                for name, category, price, rank in batch
+            ]
+            if self.upsert:
+                products = self.update_existing(products)
+            Product.objects.bulk_create(products, batch_size=self.batch_size)
+            self.created += len(products)
+            refresh_top_products({self.categories[category] for _, category, _, _ in batch})
+        # bulk writes don't send the signals that invalidate the cached catalog
+        # or update the top products
+        bump_catalog_version()
+
+        if self.verbosity > 1:
+            self.stdout.write('%d rows written' % (self.created + self.updated))
+
+    def create_categories(self, names):
+        missing = names.difference(self.categories)
+        if missing:
+            Category.objects.bulk_create([Category(name=name) for name in missing])
+            # not every database returns the ids from bulk_create
+            self.categories.update(
+                Category.objects.filter(name__in=missing).order_by('-id').values_list('name', 'id')
+            )
+
+    def update_existing(self, products):
+        """
+        Updates the products that already exist in one query and returns the
+        ones left to create. Within a batch the last row for a product wins.
+        """
+        latest = {}
+        for product in products:
+            latest[(product.name, product.category_id)] = product
+
+        existing = Product.objects.filter(
+            name__in={name for name, _ in latest},
+            category_id__in={category for _, category in latest},
+        ).values_list('name', 'category_id', 'id')
+
+        now = timezone.now()
+        to_update = []
+        for name, category, pk in existing:
+            product = latest.pop((name, category), None)
+            if product is not None:
+                product.pk = pk
+                product.updated_time = now
+                to_update.append(product)
+
+        if to_update:
+            Product.objects.bulk_update(to_update, ['price', 'rank', 'updated_time'], batch_size=self.batch_size)
+            self.updated += len(to_update)
+        return list(latest.values())
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.cache import bump_catalog_version
+from product.models import TopProduct
+from product.top_products import refresh_top_products
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the best ranked products of each category from the product '
+        'table, e.g. after changing TOP_PRODUCTS_PER_CATEGORY or updating '
+        'ranks in bulk.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--category', type=int, action='append', dest='categories',
+            help='id of a category to rebuild, repeat it for several (default: every category)',
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        refresh_top_products(options['categories'])
+        bump_catalog_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt the top products, %d rows, in %.2fs' % (
+                TopProduct.objects.count(), time.perf_counter() - start,
+            )
+        ))
@@ -0,0 +1,143 @@
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.cache import bump_catalog_version
+from product.models import Category, Product, WishList, WishListItem
+from product.top_products import refresh_top_products
+
+
+User = get_user_model()
+
+# product names are made of these, so searches and facets have realistic hits
+ADJECTIVES = (
+    'red', 'blue', 'green', 'vintage', 'wireless', 'leather', 'wooden', 'silver',
+    'organic', 'portable', 'handmade', 'classic', 'smart', 'cozy', 'mini', 'deluxe',
+)
+NOUNS = (
+    'watch', 'lamp', 'mug', 'headphones', 'backpack', 'scarf', 'notebook', 'speaker',
+    'candle', 'wallet', 'blanket', 'camera', 'teapot', 'sneakers', 'puzzle', 'plant',
+)
+
+
+def benchmark_email(prefix, number):
+    return '%s%d@example.com' % (prefix, number)
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the database with synthetic users, wishlists, categories and '
+        'products for benchmarks. Every user has the same password.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='users to create, each with a wishlist (default: 1000)')
+        parser.add_argument('--categories', type=int, default=20, help='categories to create (default: 20)')
+        parser.add_argument('--products', type=int, default=10000, help='products to create (default: 10000)')
+        parser.add_argument(
+            '--wishlist-size', type=int, default=5,
+            help='products in each wishlist, at most one per category (default: 5)',
+        )
+        parser.add_argument('--password', default='benchpass', help='password of the users (default: benchpass)')
+        parser.add_argument(
+            '--prefix', default='benchmark',
+            help="users get the emails <prefix><n>@example.com (default: 'benchmark')",
+        )
+        parser.add_argument('--seed', type=int, default=0, help='random seed, the same seed gives the same data')
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='rows written per insert (default: 2000)',
+        )
+
+    def handle(self, *args, **options):
+        for name in ('users', 'categories', 'products', 'wishlist_size'):
+            if options[name] < 0:
+                raise CommandError('--%s must not be negative' % name.replace('_', '-'))
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if options['products'] and not options['categories']:
+            raise CommandError('products need at least one category')
+        if User.objects.filter(email=benchmark_email(options['prefix'], 0)).exists():
+            raise CommandError("users with the prefix '%s' already exist, pick another --prefix" % options['prefix'])
+
+        self.batch_size = options['batch_size']
+        self.random = random.Random(options['seed'])
+        start = time.perf_counter()
+
+        with transaction.atomic():
+            categories = self.create_categories(options['categories'])
+            products = self.create_products(options['products'], categories)
+            refresh_top_products(products)
+            users = self.create_users(options['users'], options['prefix'], options['password'])
+            items = self.create_wishlists(users, products, options['wishlist_size'])
+        # bulk writes don't send the signals that invalidate the cached catalog
+        # or update the top products
+        bump_catalog_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Created %d users, %d categories, %d products and %d wishlist items in %.2fs' % (
+                len(users), len(categories), sum(map(len, products.values())), items,
+                time.perf_counter() - start,
+            )
+        ))
+
+    def create_categories(self, count):
+        first = Category.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        Category.objects.bulk_create(
+            [Category(name='%s %ss' % (self.random.choice(ADJECTIVES), NOUNS[i % len(NOUNS)])) for i in range(count)],
+            batch_size=self.batch_size,
+        )
+        # not every database returns the ids from bulk_create
+        return list(Category.objects.filter(id__gt=first).order_by('id').values_list('id', flat=True))
+
+    def create_products(self, count, categories):
+        """
+        Returns the ids of the new products by category.
+        """
+        first = Product.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        Product.objects.bulk_create(
+            (
+                Product(
+                    name='%s %s %d' % (self.random.choice(ADJECTIVES), self.random.choice(NOUNS), i),
+                    price=Decimal(self.random.randint(100, 100000)).scaleb(-2),
+                    rank=self.random.randint(1, 100),
+                    category_id=categories[i % len(categories)],
+                )
+                for i in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+        products = {}
+        for pk, category in Product.objects.filter(id__gt=first).values_list('id', 'category_id').iterator():
+            products.setdefault(category, []).append(pk)
+        return products
+
+    def create_users(self, count, prefix, password):
+        # hashing once keeps seeding fast, every user gets the same hash
+        password = make_password(password)
+        first = User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        User.objects.bulk_create(
+            (User(email=benchmark_email(prefix, i), password=password) for i in range(count)),
+            batch_size=self.batch_size,
+        )
+        return list(User.objects.filter(id__gt=first).order_by('id').values_list('id', flat=True))
+
+    def create_wishlists(self, users, products, size):
+        first = WishList.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        WishList.objects.bulk_create((WishList(user_id=user) for user in users), batch_size=self.batch_size)
+        wishlists = WishList.objects.filter(id__gt=first).values_list('id', flat=True).iterator()
+
+        categories = list(products)
+        size = min(size, len(categories))
+        items = [
+            WishListItem(wishlist_id=wishlist, product_id=self.random.choice(products[category]), category_id=category)
+            for wishlist in wishlists
+            for category in self.random.sample(categories, size)
+        ]
+        WishListItem.objects.bulk_create(items, batch_size=self.batch_size)
+        return len(items)
@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0003_product_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wishlist',
+            name='updated_time',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
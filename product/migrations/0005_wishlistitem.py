@@ -0,0 +1,70 @@
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_category(apps, schema_editor):
+    """
+    Copies each product's category onto its wishlist items, dropping any
+    extra products from an already filled category before the unique
+    constraint goes on.
+    """
+    WishListItem = apps.get_model('product', 'WishListItem')
+    Product = apps.get_model('product', 'Product')
+
+    WishListItem.objects.update(
+        category=Subquery(Product.objects.filter(pk=OuterRef('product')).values('category')[:1])
+    )
+    keep = (
+        WishListItem.objects.values('wishlist', 'category')
+        .annotate(first=Min('id'))
+        .values_list('first', flat=True)
+    )
+    WishListItem.objects.exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0004_wishlist_updated_time'),
+    ]
+
+    operations = [
+        # take over the table of the auto generated through model as is
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='WishListItem',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product.product')),
+                        ('wishlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product.wishlist')),
+                    ],
+                    options={
+                        'db_table': 'product_wishlist_products',
+                        'unique_together': {('wishlist', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='wishlist',
+                    name='products',
+                    field=models.ManyToManyField(blank=True, through='product.WishListItem', to='product.Product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='wishlistitem',
+            name='category',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='product.category'),
+        ),
+        migrations.RunPython(fill_category, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='wishlistitem',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product.category'),
+        ),
+        migrations.AddConstraint(
+            model_name='wishlistitem',
+            constraint=models.UniqueConstraint(fields=('wishlist', 'category'), name='wishlist_one_product_per_category'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.db import migrations
+
+
+# the expression must match the one api/search.py builds with SearchVector,
+# otherwise the planner won't use the index
+POSTGRES_SEARCH_INDEX = (
+    "CREATE INDEX product_name_search_idx ON product_product "
+    "USING gin (to_tsvector('english'::regconfig, COALESCE(name, '')))"
+)
+POSTGRES_TRIGRAM_INDEX = (
+    "CREATE INDEX product_name_trgm_idx ON product_product "
+    "USING gin (name gin_trgm_ops)"
+)
+
+# external content table over product_product kept up to date by triggers.
+# Note that the sqlite schema editor drops the triggers whenever it has to
+# rebuild product_product, so such migrations need to recreate them.
+SQLITE_SEARCH_TABLE = [
+    "CREATE VIRTUAL TABLE product_search USING fts5("
+    "name, content='product_product', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER product_search_insert AFTER INSERT ON product_product BEGIN "
+    "INSERT INTO product_search(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER product_search_delete AFTER DELETE ON product_product BEGIN "
+    "INSERT INTO product_search(product_search, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER product_search_update AFTER UPDATE OF name ON product_product BEGIN "
+    "INSERT INTO product_search(product_search, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO product_search(rowid, name) VALUES (new.id, new.name); END",
+    "INSERT INTO product_search(product_search) VALUES ('rebuild')",
+]
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Indexes product names for full-text search. PostgreSQL also gets a
+    trigram index for typos when the pg_trgm extension is available.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_SEARCH_INDEX)
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+            has_trigram = cursor.fetchone() is not None
+        if has_trigram:
+            schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            schema_editor.execute(POSTGRES_TRIGRAM_INDEX)
+    elif vendor == 'sqlite':
+        for sql in SQLITE_SEARCH_TABLE:
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS product_name_trgm_idx')
+        schema_editor.execute('DROP INDEX IF EXISTS product_name_search_idx')
+    elif vendor == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute('DROP TRIGGER IF EXISTS product_search_%s' % trigger)
+        schema_editor.execute('DROP TABLE IF EXISTS product_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0005_wishlistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
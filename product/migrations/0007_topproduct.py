@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_top_products(apps, schema_editor):
+    """
+    Copies the best ranked products of every category into TopProduct.
+    """
+    Category = apps.get_model('product', 'Category')
+    Product = apps.get_model('product', 'Product')
+    TopProduct = apps.get_model('product', 'TopProduct')
+
+    rows = []
+    for category in Category.objects.values_list('pk', flat=True):
+        best = Product.objects.filter(category=category).order_by('rank', 'pk').values_list('pk', 'rank')
+        rows.extend(
+            TopProduct(product_id=pk, category_id=category, rank=rank)
+            for pk, rank in best[:settings.TOP_PRODUCTS_PER_CATEGORY]
+        )
+    TopProduct.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0006_product_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'rank', 'id'], name='product_category_rank_id_idx'),
+        ),
+        migrations.CreateModel(
+            name='TopProduct',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='top', serialize=False, to='product.product')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='top_products', to='product.category')),
+                ('rank', models.IntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='topproduct',
+            index=models.Index(fields=['category', 'rank', 'product'], name='top_product_category_rank_idx'),
+        ),
+        migrations.RunPython(fill_top_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0009_similarproduct'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='updated_time',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -1,4 +1,6 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -6,6 +8,8 @@ User = get_user_model()
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
+    # the product detail's Last-Modified covers its category's name too
+    updated_time = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -20,17 +24,185 @@ class Product(models.Model):
     created_time = models.DateTimeField(auto_now_add=True)
     updated_time = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # back the keyset pagination orderings on the product list, the id
+        # breaks ties between equal prices/ranks
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['rank', 'id'], name='product_rank_id_idx'),
+            models.Index(fields=['created_time', 'id'], name='product_created_id_idx'),
+            # finds the best ranked products of a category, see product/top_products.py
+            models.Index(fields=['category', 'rank', 'id'], name='product_category_rank_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # saves that leave the category alone skip the wishlist items, see
+        # product/signals.py
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+
+    def category_changed(self):
+        """
+        Returns whether the category may differ from the stored one.
+        """
+        loaded = getattr(self, '_loaded_category_id', None)
+        return loaded is None or loaded != self.category_id
+
+    def wishlist_conflicts(self, category_id):
+        """
+        Returns the wishlist items of this product whose wishlist already
+        holds another product of `category_id`.
+        """
+        return WishListItem.objects.filter(product=self).exclude(category=category_id).filter(
+            wishlist__in=WishListItem.objects.filter(category=category_id).values('wishlist')
+        )
+
+    def clean(self):
+        if self.pk is not None and self.category_changed() and self.wishlist_conflicts(self.category_id).exists():
+            raise ValidationError({
+                'category': 'Wishlists holding this product already hold a product of that category.',
+            })
+
+
+
+class TopProduct(models.Model):
+    """
+    One of the best ranked products of its category.
+
+    Holds the TOP_PRODUCTS_PER_CATEGORY products of each category with the
+    lowest rank, kept up to date as products change, see product/top_products.py.
+    """
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='top')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='top_products')
+    # copied from the product, so the rows of a category can be ranked on their own
+    rank = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'rank', 'product'], name='top_product_category_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} in the top of {self.category}"
+
+
+
+class Recommendation(models.Model):
+    """
+    A product often wished for together with another one.
+
+    Built offline from the wishlists by `manage.py build_recommendations`,
+    see product/recommendations.py.
+    """
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_in')
+    # wishlists holding both products
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [('product', 'recommended')]
+
+    def __str__(self):
+        return f"{self.recommended} for {self.product}"
+
+
+
+class SimilarProduct(models.Model):
+    """
+    A product with a name like another one's.
+
+    Built offline from the product names by `manage.py build_similar_products`,
+    see product/similar_products.py.
+    """
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similar_products')
+    similar = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similar_to')
+    # cosine similarity of the names' n-gram vectors, from 0 to 1
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = [('product', 'similar')]
+
+    def __str__(self):
+        return f"{self.similar} like {self.product}"
+
 
 
 class WishList(models.Model):
 
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    products = models.ManyToManyField(Product, blank=True)
+    products = models.ManyToManyField(Product, blank=True, through='WishListItem')
+    # also bumped when the products change, see product/signals.py
+    updated_time = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.user.email}'s wishlist"
-    
-    
\ No newline at end of file
+
+    def touch(self):
+        """
+        Bumps updated_time without saving the rest of the wishlist.
+        """
+        self.updated_time = timezone.now()
+        WishList.objects.filter(pk=self.pk).update(updated_time=self.updated_time)
+
+
+
+class WishListItemQuerySet(models.QuerySet):
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Copies the product's category onto the items that don't have one yet,
+        so `wishlist.products.add()` keeps working with the through model.
+        """
+        objs = list(objs)
+        missing = [obj for obj in objs if obj.category_id is None]
+        if missing:
+            categories = dict(
+                Product.objects.filter(pk__in={obj.product_id for obj in missing})
+                .values_list('pk', 'category_id')
+            )
+            for obj in missing:
+                obj.category_id = categories.get(obj.product_id)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+
+class WishListItem(models.Model):
+    """
+    A product in a wishlist.
+
+    The product's category is copied onto the item so the database enforces
+    one product per category in a wishlist, even under concurrent updates.
+    """
+
+    # the table was created for the auto generated through model, keep its integer id
+    id = models.AutoField(primary_key=True)
+    wishlist = models.ForeignKey(WishList, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+
+    objects = WishListItemQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'product_wishlist_products'
+        unique_together = [('wishlist', 'product')]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['wishlist', 'category'], name='wishlist_one_product_per_category'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product} in {self.wishlist}"
+
+    def save(self, *args, **kwargs):
+        if self.category_id is None:
+            self.category_id = self.product.category_id
+        super().save(*args, **kwargs)
@@ -0,0 +1,259 @@
+"""
+"People who wished for this also wished for" recommendations.
+
+`manage.py build_recommendations` counts, for every pair of products, the
+wishlists holding both. With A the wishlist × product matrix of the
+wishlist items, 1 where a wishlist holds a product, the counts are the
+co-occurrence matrix C = AᵀA, which scipy computes on sparse matrices;
+wishlist and product ids are used as row and column numbers as they are.
+Each product then keeps its RECOMMENDATIONS_PER_PRODUCT most frequent
+companions as Recommendation rows.
+
+A wishlist holds one product per category, so products never co-occur
+with products of their own category and every recommendation is for
+another category. The wishlist recommendations endpoint adds up the
+recommendations of the wishlist's products and leaves out the categories
+the wishlist already has a product in, in one query.
+
+Builds are incremental: A, C and the time the build started are saved to
+RECOMMENDATIONS_STATE, and the next build only reads the items of the
+wishlists updated since (less INCREMENTAL_BUILD_OVERLAP seconds, for saves
+that committed late) or deleted, takes their old rows' co-occurrences out
+of C, adds their new ones and rewrites the recommendations of the products
+they held or hold whose most frequent companions changed.
+
+Requires numpy and scipy.
+
+"""
+
+
+import os
+from datetime import datetime, timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Recommendation, WishList, WishListItem
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+
+# ids per query when deleting by id, below sqlite's limit on query params
+CHUNK_SIZE = 500
+
+# params per INSERT, also below that limit
+INSERT_PARAMS = 900
+
+
+class BuildResult:
+    """
+    What a build read and wrote.
+    """
+
+    def __init__(self, full, wishlists, products, rows):
+        self.full = full
+        self.wishlists = wishlists
+        self.products = products
+        self.rows = rows
+
+
+def read_items(items):
+    """
+    Returns the (wishlist id, product id) pairs of a WishListItem queryset
+    as an n×2 array.
+    """
+    pairs = items.order_by().values_list('wishlist_id', 'product_id').iterator(chunk_size=10000)
+    return np.fromiter(chain.from_iterable(pairs), dtype=np.int64).reshape(-1, 2)
+
+
+def read_ids(queryset):
+    return np.fromiter(queryset.order_by().values_list('pk', flat=True).iterator(chunk_size=10000), dtype=np.int64)
+
+
+def wishlist_matrix(rows, products, shape):
+    """
+    Returns the 0/1 matrix with a 1 at each (row, product).
+    """
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, products)), shape=shape)
+
+
+def cooccurrence(matrix):
+    """
+    Returns the number of rows of `matrix` holding both products of each pair.
+    """
+    counts = (matrix.T @ matrix).tocsr()
+    # a product is no companion of its own
+    counts = (counts - sparse.diags(counts.diagonal(), dtype=counts.dtype)).tocsr()
+    counts.eliminate_zeros()
+    return counts
+
+
+def top_companions(counts, products, k):
+    """
+    Returns the k most frequent companions of each of `products`, as
+    (product, companion, count) arrays, the most frequent first and the
+    lowest id first among equal counts.
+    """
+    rows = counts[products]
+    lengths = np.diff(rows.indptr)
+    row_numbers = np.repeat(np.arange(len(products)), lengths)
+    # sorting on the row number first keeps each row where it was
+    order = np.lexsort((rows.indices, -rows.data, row_numbers))
+    position = np.arange(rows.nnz) - np.repeat(rows.indptr[:-1], lengths)
+    keep = order[position < k]
+    return np.repeat(products, lengths)[position < k], rows.indices[keep], rows.data[keep]
+
+
+def insert_rows(model, fields, columns):
+    """
+    Inserts rows of `model` with plain multi-row INSERTs, `columns` holding
+    the values of each of `fields`: bulk_create builds a model instance and
+    compiles every value of every row, which took most of the time of a
+    full build.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in fields)
+    placeholders = '(%s)' % ', '.join(['%s'] * len(fields))
+    rows = list(zip(*(column.tolist() for column in columns)))
+    size = max(1, INSERT_PARAMS // len(fields))
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), size):
+            batch = rows[start:start + size]
+            cursor.execute(
+                'INSERT INTO %s (%s) VALUES %s' % (table, names, ', '.join([placeholders] * len(batch))),
+                list(chain.from_iterable(batch)),
+            )
+
+
+def changed_products(before, after):
+    """
+    Returns the products whose companions differ between two
+    `top_companions()` results, most products' don't when a few wishlists
+    change.
+    """
+    differences = set(zip(*(column.tolist() for column in before))) ^ set(zip(*(column.tolist() for column in after)))
+    return np.array(sorted({product for product, _, _ in differences}), dtype=np.int64)
+
+
+def write_recommendations(products, companions, full):
+    """
+    Replaces the recommendations of `products`, every product's if `full`.
+    """
+    with transaction.atomic():
+        if full:
+            Recommendation.objects.all().delete()
+        else:
+            for start in range(0, len(products), CHUNK_SIZE):
+                Recommendation.objects.filter(product__in=products[start:start + CHUNK_SIZE].tolist()).delete()
+        insert_rows(Recommendation, ('product', 'recommended', 'score'), companions)
+
+
+def grow(matrix, shape):
+    if matrix.shape != shape:
+        matrix.resize(shape)
+    return matrix
+
+
+def save_state(path, wishlists, counts, built_at):
+    """
+    Saves the matrices the next build starts from, replacing the previous
+    ones at once so that an interrupted build leaves them whole.
+    """
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as f:
+        np.savez(
+            f, built_at=built_at.isoformat(), per_product=settings.RECOMMENDATIONS_PER_PRODUCT,
+            a_data=wishlists.data, a_indices=wishlists.indices, a_indptr=wishlists.indptr, a_shape=wishlists.shape,
+            c_data=counts.data, c_indices=counts.indices, c_indptr=counts.indptr, c_shape=counts.shape,
+        )
+    os.replace(temporary, path)
+
+
+def load_state(path):
+    """
+    Returns the wishlist matrix, the co-occurrence matrix and the start of
+    the build that saved them, or None when there's nothing to start from.
+    """
+    try:
+        state = np.load(path)
+    except (OSError, ValueError):
+        return None
+    with state:
+        # recommendations kept with another limit need a full build
+        if state['per_product'] != settings.RECOMMENDATIONS_PER_PRODUCT:
+            return None
+        wishlists = sparse.csr_matrix(
+            (state['a_data'], state['a_indices'], state['a_indptr']), shape=tuple(state['a_shape'])
+        )
+        counts = sparse.csr_matrix(
+            (state['c_data'], state['c_indices'], state['c_indptr']), shape=tuple(state['c_shape'])
+        )
+        built_at = datetime.fromisoformat(str(state['built_at']))
+    return wishlists, counts, built_at
+
+
+def build_recommendations(full=False, path=None):
+    """
+    Builds the recommendations, from the changes since the last build
+    unless `full` or there's no saved state. Returns a `BuildResult`.
+    """
+    path = path or settings.RECOMMENDATIONS_STATE
+    state = None if full else load_state(path)
+    # wishlists changed while this build reads them are read again by the next
+    started = timezone.now()
+    k = settings.RECOMMENDATIONS_PER_PRODUCT
+
+    if state is None:
+        items = read_items(WishListItem.objects.all())
+        shape = (int(items[:, 0].max(initial=-1)) + 1, int(items[:, 1].max(initial=-1)) + 1)
+        wishlists = wishlist_matrix(items[:, 0], items[:, 1], shape)
+        counts = cooccurrence(wishlists)
+        products = np.flatnonzero(np.diff(counts.indptr))
+        write_recommendations(products, top_companions(counts, products, k), full=True)
+        read = len(np.unique(items[:, 0]))
+    else:
+        wishlists, counts, started_at = state
+        # a wishlist saved before that but committed after the last build
+        # read the changes is read now; reading one again changes nothing
+        since = started_at - timedelta(seconds=settings.INCREMENTAL_BUILD_OVERLAP)
+        # the items are read after the ids, so every changed wishlist's are
+        changed = read_ids(WishList.objects.filter(updated_time__gte=since))
+        items = read_items(WishListItem.objects.filter(wishlist__updated_time__gte=since))
+        held = np.flatnonzero(np.diff(wishlists.indptr))
+        deleted = np.setdiff1d(held, read_ids(WishList.objects.all()))
+        stale = np.union1d(np.union1d(changed, items[:, 0]), deleted)
+
+        rows = max(wishlists.shape[0], int(stale.max(initial=-1)) + 1)
+        columns = max(wishlists.shape[1], int(items[:, 1].max(initial=-1)) + 1)
+        wishlists = grow(wishlists, (rows, columns))
+        counts = grow(counts, (columns, columns))
+
+        old = wishlists[stale]
+        new = wishlist_matrix(np.searchsorted(stale, items[:, 0]), items[:, 1], (len(stale), columns))
+        # only the co-occurrences of products held by these wishlists changed
+        products = np.union1d(old.indices, new.indices)
+        before = top_companions(counts, products, k)
+        counts = (counts - cooccurrence(old) + cooccurrence(new)).tocsr()
+        counts.eliminate_zeros()
+        after = top_companions(counts, products, k)
+        products = changed_products(before, after)
+
+        keep = np.ones(rows, dtype=np.int32)
+        keep[stale] = 0
+        wishlists = (
+            sparse.diags(keep, dtype=np.int32) @ wishlists + wishlist_matrix(items[:, 0], items[:, 1], (rows, columns))
+        ).tocsr()
+        wishlists.eliminate_zeros()
+
+        rewritten = np.isin(after[0], products)
+        write_recommendations(products, tuple(column[rewritten] for column in after), full=False)
+        read = len(stale)
+
+    save_state(path, wishlists, counts, started)
+    return BuildResult(state is None, read, len(products), Recommendation.objects.count())
@@ -0,0 +1,92 @@
+import logging
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Category, Product, WishList, WishListItem
+from .top_products import is_being_deleted, product_deleted, product_saved
+
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(m2m_changed, sender=WishList.products.through)
+def touch_wishlist_on_products_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Bumps the wishlist's updated_time when products are added or removed.
+    """
+    if reverse and action == 'pre_clear':
+        # product.wishlist_set.clear() doesn't say which wishlists it unlinks
+        WishList.objects.filter(products=instance).update(updated_time=timezone.now())
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            WishList.objects.filter(pk__in=pk_set or ()).update(updated_time=timezone.now())
+        else:
+            instance.touch()
+
+
+@receiver(pre_delete, sender=Product)
+def touch_wishlists_on_product_delete(sender, instance, **kwargs):
+    """
+    Deleting a product drops it from wishlists without m2m_changed firing.
+    """
+    # the category's receiver touches them all at once
+    if is_being_deleted(instance.category_id):
+        return
+    WishList.objects.filter(products=instance).update(updated_time=timezone.now())
+
+
+@receiver(pre_delete, sender=Category)
+def touch_wishlists_on_category_delete(sender, instance, **kwargs):
+    """
+    Deleting a category deletes its products, and drops them from wishlists.
+    """
+    WishList.objects.filter(products__category=instance).update(updated_time=timezone.now())
+
+
+@receiver(post_save, sender=Product)
+def sync_wishlist_item_category(sender, instance, created, update_fields, **kwargs):
+    """
+    Keeps the category copied onto wishlist items in step with the product.
+
+    The admin and the API refuse a category some wishlist holding the
+    product already has a product of (see `Product.clean`); saves that skip
+    validation drop the product from those wishlists, so the one product
+    per category rule keeps holding, and log the items dropped.
+    """
+    if update_fields is not None and 'category' not in update_fields:
+        return
+    changed = instance.category_changed()
+    instance._loaded_category_id = instance.category_id
+    if created or not changed:
+        return
+
+    conflicting = instance.wishlist_conflicts(instance.category_id)
+    items = list(conflicting.values_list('pk', 'wishlist'))
+    if items:
+        conflicting.delete()
+        WishList.objects.filter(pk__in=[wishlist for _, wishlist in items]).update(updated_time=timezone.now())
+        logger.warning(
+            'Moving product %s to category %s removed it from wishlists %s, which held a product of that category',
+            instance.pk, instance.category_id, ', '.join(str(wishlist) for _, wishlist in items),
+            extra={'product': instance.pk, 'category': instance.category_id, 'wishlist_items': [pk for pk, _ in items]},
+        )
+    WishListItem.objects.filter(product=instance).exclude(category=instance.category_id).update(
+        category=instance.category_id
+    )
+
+
+@receiver(post_save, sender=Product)
+def update_top_products(sender, instance, update_fields, **kwargs):
+    """
+    Keeps the best ranked products of the product's category up to date.
+    """
+    if update_fields is not None and not {'rank', 'category'}.intersection(update_fields):
+        return
+    product_saved(instance)
+
+
+@receiver(post_delete, sender=Product)
+def refill_top_products(sender, instance, **kwargs):
+    product_deleted(instance)
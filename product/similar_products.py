@@ -0,0 +1,307 @@
+"""
+Products with similar names, for the similar products endpoint.
+
+`manage.py build_similar_products` turns every product name into a TF-IDF
+vector of its character trigrams, hashed into NGRAM_COLUMNS columns with
+crc32 so that no vocabulary has to be kept, and keeps the
+SIMILAR_PRODUCTS_PER_PRODUCT products of highest cosine similarity of each
+product as SimilarProduct rows. The vectors are rows of one sparse float32
+matrix, product ids used as row numbers as they are, and the similarities
+are computed a block of products at a time as a product of that matrix
+with its transpose. The endpoint filters the kept products on price and
+category, so a filter leaves fewer of them rather than looking further.
+
+Builds are incremental: the trigram counts, the IDF weights and the
+neighbours of every product are saved to SIMILAR_PRODUCTS_STATE, and the
+next build only reads the products updated since (less
+INCREMENTAL_BUILD_OVERLAP seconds, for saves that committed late) or
+deleted, computes their similarities with every product and recomputes
+the neighbours of the products they enter or leave. The IDF weights are those of the last
+full build so that the vectors of the other products stay the same;
+trigrams no product had then get the highest weight. Run a full build
+after large imports.
+
+Requires numpy and scipy.
+
+"""
+
+
+import os
+import zlib
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, SimilarProduct
+from .recommendations import CHUNK_SIZE, grow, insert_rows, read_ids
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+
+NGRAM_SIZE = 3
+NGRAM_COLUMNS = 2 ** 18
+
+# similarities computed at a time, float32 each, about 32MB
+BLOCK_SIZE = 2 ** 23
+
+# the same similarity computed from either product's side can differ in
+# the last bits
+TOLERANCE = 1e-6
+
+
+class BuildResult:
+    """
+    What a build read and wrote.
+    """
+
+    def __init__(self, full, read, products, rows):
+        self.full = full
+        self.read = read
+        self.products = products
+        self.rows = rows
+
+
+def ngram_columns(name):
+    """
+    Returns the columns of the trigrams of a name, case and runs of spaces
+    ignored, with a space before and after it so short names and the ends
+    of words count.
+    """
+    text = ' %s ' % ' '.join(name.lower().split())
+    return [zlib.crc32(text[i:i + NGRAM_SIZE].encode()) % NGRAM_COLUMNS for i in range(len(text) - NGRAM_SIZE + 1)]
+
+
+def read_names(queryset):
+    """
+    Returns the ids and names of a Product queryset.
+    """
+    rows = list(queryset.order_by().values_list('pk', 'name').iterator(chunk_size=10000))
+    return np.array([pk for pk, _ in rows], dtype=np.int64), [name for _, name in rows]
+
+
+def count_matrix(ids, names, rows):
+    """
+    Returns the matrix of the trigram counts of each name, in the row of its id.
+    """
+    row_numbers = []
+    columns = []
+    for pk, name in zip(ids.tolist(), names):
+        grams = ngram_columns(name)
+        row_numbers.extend([pk] * len(grams))
+        columns.extend(grams)
+    counts = sparse.csr_matrix(
+        (np.ones(len(columns), dtype=np.float32), (row_numbers, columns)), shape=(rows, NGRAM_COLUMNS)
+    )
+    counts.sum_duplicates()
+    return counts
+
+
+def idf_weights(counts, products):
+    """
+    Returns the smoothed inverse document frequency of each column.
+    """
+    documents = np.bincount(counts.indices, minlength=NGRAM_COLUMNS)
+    return (np.log((1 + products) / (1 + documents)) + 1).astype(np.float32)
+
+
+def tfidf_vectors(counts, idf):
+    """
+    Returns the TF-IDF vectors of the counts, scaled to length 1 so that
+    their dot products are cosine similarities.
+    """
+    vectors = (counts @ sparse.diags(idf)).tocsr()
+    # the order of the columns sets the order floats are added up in, and
+    # with it the last bits of the similarities
+    vectors.sort_indices()
+    lengths = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+    scale = np.divide(1, lengths, out=np.zeros_like(lengths), where=lengths > 0)
+    vectors = (sparse.diags(scale.astype(np.float32)) @ vectors).tocsr()
+    vectors.sort_indices()
+    return vectors
+
+
+def similarity_blocks(vectors, products):
+    """
+    Yields the position in `products` of each block of them and the dense
+    block of their similarities with every product, 0 with themselves.
+    """
+    transposed = vectors.T.tocsc()
+    step = max(1, BLOCK_SIZE // max(1, vectors.shape[0]))
+    for start in range(0, len(products), step):
+        chunk = products[start:start + step]
+        block = (vectors[chunk] @ transposed).toarray()
+        block[np.arange(len(chunk)), chunk] = 0
+        yield start, block
+
+
+def top_k(block, k):
+    """
+    Returns the ids and similarities of the k most similar products of each
+    row of a block, as two len(block) × k arrays padded with -1 and 0: the
+    most similar first and the lowest id first among equal similarities.
+    """
+    ids = np.full((len(block), k), -1, dtype=np.int64)
+    scores = np.zeros((len(block), k), dtype=np.float32)
+    if block.shape[1] > k:
+        kth = -np.partition(-block, k - 1, axis=1)[:, k - 1]
+    else:
+        kth = np.zeros(len(block), dtype=block.dtype)
+    # every product tied with the kth, only the lowest ids make it
+    rows, columns = np.nonzero((block > 0) & (block >= kth[:, None]))
+    values = block[rows, columns]
+    order = np.lexsort((columns, -values, rows))
+    rows, columns, values = rows[order], columns[order], values[order]
+    position = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = position < k
+    ids[rows[keep], position[keep]] = columns[keep]
+    scores[rows[keep], position[keep]] = values[keep]
+    return ids, scores
+
+
+def top_similar(vectors, products, k):
+    """
+    Returns the `top_k()` arrays of `products`.
+    """
+    ids = np.full((len(products), k), -1, dtype=np.int64)
+    scores = np.zeros((len(products), k), dtype=np.float32)
+    for start, block in similarity_blocks(vectors, products):
+        ids[start:start + len(block)], scores[start:start + len(block)] = top_k(block, k)
+    return ids, scores
+
+
+def write_similar_products(products, ids, scores, full):
+    """
+    Replaces the similar products of `products`, every product's if `full`.
+    `ids` and `scores` are their `top_k()` arrays.
+    """
+    kept = ids >= 0
+    columns = (np.repeat(products, kept.sum(axis=1)), ids[kept], scores[kept])
+    with transaction.atomic():
+        if full:
+            SimilarProduct.objects.all().delete()
+        else:
+            for start in range(0, len(products), CHUNK_SIZE):
+                SimilarProduct.objects.filter(product__in=products[start:start + CHUNK_SIZE].tolist()).delete()
+        insert_rows(SimilarProduct, ('product', 'similar', 'score'), columns)
+
+
+def save_state(path, counts, idf, ids, scores, built_at):
+    """
+    Saves the matrices the next build starts from, replacing the previous
+    ones at once so that an interrupted build leaves them whole.
+    """
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'wb') as f:
+        np.savez(
+            f, built_at=built_at.isoformat(), per_product=settings.SIMILAR_PRODUCTS_PER_PRODUCT,
+            data=counts.data, indices=counts.indices, indptr=counts.indptr, shape=counts.shape,
+            idf=idf, ids=ids, scores=scores,
+        )
+    os.replace(temporary, path)
+
+
+def load_state(path):
+    """
+    Returns the count matrix, the IDF weights, the neighbours and the start
+    of the build that saved them, or None when there's nothing to start from.
+    """
+    try:
+        state = np.load(path)
+    except (OSError, ValueError):
+        return None
+    with state:
+        # neighbours kept with another limit need a full build
+        if state['per_product'] != settings.SIMILAR_PRODUCTS_PER_PRODUCT:
+            return None
+        counts = sparse.csr_matrix(
+            (state['data'], state['indices'], state['indptr']), shape=tuple(state['shape'])
+        )
+        built_at = datetime.fromisoformat(str(state['built_at']))
+        return counts, state['idf'], state['ids'], state['scores'], built_at
+
+
+def changed_rows(before, after):
+    """
+    Returns the row numbers where two pairs of `top_k()` arrays differ.
+    """
+    return np.flatnonzero((before[0] != after[0]).any(axis=1) | (before[1] != after[1]).any(axis=1))
+
+
+def build_similar_products(full=False, path=None):
+    """
+    Builds the similar products, from the changes since the last build
+    unless `full` or there's no saved state. Returns a `BuildResult`.
+    """
+    path = path or settings.SIMILAR_PRODUCTS_STATE
+    state = None if full else load_state(path)
+    # products changed while this build reads them are read again by the next
+    started = timezone.now()
+    k = settings.SIMILAR_PRODUCTS_PER_PRODUCT
+
+    if state is None:
+        products, names = read_names(Product.objects.all())
+        rows = int(products.max(initial=-1)) + 1
+        counts = count_matrix(products, names, rows)
+        idf = idf_weights(counts, len(products))
+        vectors = tfidf_vectors(counts, idf)
+        ids = np.full((rows, k), -1, dtype=np.int64)
+        scores = np.zeros((rows, k), dtype=np.float32)
+        ids[products], scores[products] = top_similar(vectors, products, k)
+        write_similar_products(products, ids[products], scores[products], full=True)
+        read = rewritten = len(products)
+    else:
+        counts, idf, ids, scores, started_at = state
+        # a product saved before that but committed after the last build
+        # read the changes is read now; reading one again changes nothing
+        since = started_at - timedelta(seconds=settings.INCREMENTAL_BUILD_OVERLAP)
+        changed, names = read_names(Product.objects.filter(updated_time__gte=since))
+        existing = read_ids(Product.objects.all())
+        held = np.flatnonzero(np.diff(counts.indptr))
+        deleted = np.setdiff1d(held, existing)
+        stale = np.union1d(changed, deleted)
+
+        rows = max(counts.shape[0], int(changed.max(initial=-1)) + 1)
+        counts = grow(counts, (rows, NGRAM_COLUMNS))
+        if len(ids) < rows:
+            ids = np.vstack([ids, np.full((rows - len(ids), k), -1, dtype=np.int64)])
+            scores = np.vstack([scores, np.zeros((rows - len(scores), k), dtype=np.float32)])
+
+        keep = np.ones(rows, dtype=np.float32)
+        keep[stale] = 0
+        counts = (sparse.diags(keep) @ counts + count_matrix(changed, names, rows)).tocsr()
+        counts.eliminate_zeros()
+        vectors = tfidf_vectors(counts, idf)
+
+        # products whose neighbours changed or were deleted, and products
+        # the changed ones may now be among the neighbours of
+        affected = np.isin(ids, stale).any(axis=1)
+        new_ids = np.full((len(changed), k), -1, dtype=np.int64)
+        new_scores = np.zeros((len(changed), k), dtype=np.float32)
+        for start, block in similarity_blocks(vectors, changed):
+            affected |= ((block > 0) & (block >= scores[:, -1] - TOLERANCE)).any(axis=0)
+            new_ids[start:start + len(block)], new_scores[start:start + len(block)] = top_k(block, k)
+        affected[stale] = False
+        affected = np.intersect1d(np.flatnonzero(affected), existing)
+
+        before = (ids[changed], scores[changed]), (ids[affected], scores[affected])
+        ids[deleted] = -1
+        scores[deleted] = 0
+        ids[changed], scores[changed] = new_ids, new_scores
+        ids[affected], scores[affected] = top_similar(vectors, affected, k)
+
+        products = np.union1d(
+            changed[changed_rows(before[0], (new_ids, new_scores))],
+            affected[changed_rows(before[1], (ids[affected], scores[affected]))],
+        )
+        write_similar_products(products, ids[products], scores[products], full=False)
+        read = len(stale)
+        rewritten = len(products)
+
+    save_state(path, counts, idf, ids, scores, started)
+    return BuildResult(state is None, read, rewritten, SimilarProduct.objects.count())
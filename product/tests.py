@@ -1,5 +1,19 @@
-from django.test import TestCase
+import os
+import random
+import tempfile
+from collections import Counter
+from datetime import timedelta
+from itertools import combinations
+from unittest import skipIf
+from decimal import Decimal
+from io import StringIO
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, transaction
+from django.test import TestCase, override_settings
 from .models import *
+from .recommendations import load_state as load_recommendations_state, np
+from .similar_products import count_matrix, load_state, read_names, tfidf_vectors, top_similar
+from .top_products import deleting_category, refresh_top_products
 from django.contrib.auth import get_user_model
 
 
@@ -84,3 +98,378 @@ class WishlistTest(TestCase):
         self.assertEqual(list(wishlist.products.all()), [product1, product2])
         
 
+
+
+
+class ImportProductsTest(TestCase):
+
+    def import_file(self, content, suffix='.csv', *args):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+
+        out, err = StringIO(), StringIO()
+        call_command('import_products', f.name, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_csv(self):
+        existing = Category.objects.create(name='toys')
+        out, err = self.import_file(
+            'name,category,price,rank\n'
+            'teddy,toys,10.50,3\n'
+            'kite,toys,4,1\n'
+            'mug,kitchen,7.25,2\n'
+            ',kitchen,1,1\n'
+            'pan,kitchen,abc,1\n'
+            'pot,kitchen,1.001,1\n',
+            '.csv', '--batch-size', '2',
+        )
+
+        self.assertIn('3 created', out)
+        self.assertIn('3 skipped', out)
+        self.assertIn('Line 6 skipped', err)
+        self.assertEqual(Category.objects.count(), 2)
+        teddy = Product.objects.get(name='teddy')
+        self.assertEqual(teddy.category, existing)
+        self.assertEqual(teddy.price, Decimal('10.50'))
+        self.assertEqual(Product.objects.get(name='mug').category.name, 'kitchen')
+        self.assertEqual(
+            set(TopProduct.objects.values_list('product__name', flat=True)), {'teddy', 'kite', 'mug'}
+        )
+
+    def test_import_jsonl_upsert(self):
+        cat = Category.objects.create(name='toys')
+        Product.objects.create(name='teddy', price=10, rank=3, category=cat)
+
+        out, err = self.import_file(
+            '{"name": "teddy", "category": "toys", "price": 12.99, "rank": 5}\n'
+            '{"name": "kite", "category": "toys", "price": "4.00", "rank": 1}\n'
+            'not json\n',
+            '.jsonl', '--upsert',
+        )
+
+        self.assertIn('1 created, 1 updated, 1 skipped', out)
+        self.assertEqual(Product.objects.count(), 2)
+        teddy = Product.objects.get(name='teddy')
+        self.assertEqual((teddy.price, teddy.rank), (Decimal('12.99'), 5))
+        self.assertEqual(TopProduct.objects.get(product=teddy).rank, 5)
+
+
+
+class SeedBenchmarkTest(TestCase):
+
+    def test_seed(self):
+        out = StringIO()
+        call_command(
+            'seed_benchmark', '--users', '10', '--categories', '4', '--products', '50',
+            '--wishlist-size', '3', stdout=out,
+        )
+
+        self.assertIn('Created 10 users, 4 categories, 50 products and 30 wishlist items', out.getvalue())
+        self.assertEqual(Product.objects.count(), 50)
+        self.assertEqual(WishList.objects.count(), 10)
+        self.assertEqual(TopProduct.objects.count(), 40)
+        # at most one product per category, like the api allows
+        for wishlist in WishList.objects.all():
+            categories = list(wishlist.products.values_list('category_id', flat=True))
+            self.assertEqual(len(set(categories)), 3)
+        self.assertTrue(self.client.login(email='benchmark0@example.com', password='benchpass'))
+
+        with self.assertRaises(CommandError):
+            call_command('seed_benchmark', '--users', '1', stdout=out)
+
+
+
+@override_settings(TOP_PRODUCTS_PER_CATEGORY=3)
+class TopProductsTest(TestCase):
+
+    def setUp(self):
+        self.toys = Category.objects.create(name='toys')
+        self.books = Category.objects.create(name='books')
+
+    def assertTopProducts(self):
+        # the rows must match ranking the whole table
+        for category in Category.objects.all():
+            expected = list(
+                Product.objects.filter(category=category).order_by('rank', 'pk').values_list('pk', 'rank')[:3]
+            )
+            rows = list(
+                TopProduct.objects.filter(category=category).order_by('rank', 'pk').values_list('product', 'rank')
+            )
+            self.assertEqual(rows, expected)
+        self.assertEqual(TopProduct.objects.count(), sum(min(3, c.product_set.count()) for c in Category.objects.all()))
+
+    def create(self, rank, category=None):
+        return Product.objects.create(name=f'product {rank}', price=1, rank=rank, category=category or self.toys)
+
+    def test_maintained_on_save_and_delete(self):
+        products = [self.create(rank) for rank in (5, 3, 8, 9)]
+        self.assertTopProducts()
+        self.assertFalse(TopProduct.objects.filter(product=products[3]).exists())
+
+        best = self.create(1)
+        self.assertTopProducts()
+        self.assertFalse(TopProduct.objects.filter(product=products[2]).exists())
+
+        # ranked lower than a product outside the top
+        best.rank = 10
+        best.save()
+        self.assertTopProducts()
+        products[3].rank = 2
+        products[3].save()
+        self.assertTopProducts()
+
+        products[1].category = self.books
+        products[1].save()
+        self.assertTopProducts()
+        self.assertEqual(TopProduct.objects.get(product=products[1]).category, self.books)
+
+        products[0].delete()
+        self.assertTopProducts()
+        self.toys.delete()
+        self.assertTopProducts()
+
+    def test_failed_category_delete_stops_skipping(self):
+        products = [self.create(rank) for rank in (5, 3, 8, 9)]
+        with self.assertRaises(DatabaseError):
+            with transaction.atomic(), deleting_category(self.toys.pk):
+                Product.objects.get(pk=products[1].pk).delete()
+                raise DatabaseError
+        self.assertTopProducts()
+
+        # the next deletes refill the category again
+        products[1].delete()
+        self.assertTopProducts()
+
+    def test_other_fields_leave_it_alone(self):
+        product = self.create(1)
+        TopProduct.objects.all().delete()
+        product.name = 'renamed'
+        product.save(update_fields=['name'])
+        self.assertFalse(TopProduct.objects.exists())
+
+        refresh_top_products([self.toys.pk])
+        self.assertTopProducts()
+
+    def test_random_writes(self):
+        rng = random.Random(0)
+        categories = [self.toys, self.books, Category.objects.create(name='games')]
+        products = []
+        for _ in range(200):
+            action = rng.random()
+            if action < 0.4 or not products:
+                products.append(self.create(rng.randint(1, 10), rng.choice(categories)))
+            elif action < 0.8:
+                product = rng.choice(products)
+                product.rank = rng.randint(1, 10)
+                if rng.random() < 0.3:
+                    product.category = rng.choice(categories)
+                product.save()
+            else:
+                products.pop(rng.randrange(len(products))).delete()
+            self.assertTopProducts()
+
+    def test_refresh_command(self):
+        for rank in range(5):
+            self.create(rank)
+        Product.objects.update(rank=7)
+        Product.objects.bulk_create([Product(name='new', price=1, rank=1, category=self.books)])
+
+        out = StringIO()
+        call_command('refresh_top_products', stdout=out)
+        self.assertIn('4 rows', out.getvalue())
+        self.assertTopProducts()
+
+        with self.settings(TOP_PRODUCTS_PER_CATEGORY=1):
+            call_command('refresh_top_products', '--category', str(self.toys.pk), stdout=out)
+        self.assertEqual(TopProduct.objects.filter(category=self.toys).count(), 1)
+
+
+
+@skipIf(np is None, 'numpy and scipy are not installed')
+@override_settings(RECOMMENDATIONS_PER_PRODUCT=3, INCREMENTAL_BUILD_OVERLAP=0)
+class BuildRecommendationsTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state = os.path.join(directory.name, 'recommendations.npz')
+
+        self.random = random.Random(0)
+        self.categories = [Category.objects.create(name=f'category {i}') for i in range(6)]
+        self.products = [
+            Product.objects.create(name=f'product {i}', price=1, rank=1, category=self.categories[i % 6])
+            for i in range(12)
+        ]
+        self.wishlists = []
+        for i in range(30):
+            wishlist = WishList.objects.create(user=User.objects.create_user(email=f'user{i}@example.com', password=None))
+            self.fill(wishlist)
+            self.wishlists.append(wishlist)
+
+    def fill(self, wishlist):
+        # one product of some of the categories the wishlist doesn't have one of
+        taken = set(wishlist.products.values_list('category', flat=True))
+        products = [p for p in self.products if p.category_id not in taken and self.random.random() < 0.3]
+        by_category = {product.category_id: product for product in products}
+        wishlist.products.add(*by_category.values())
+
+    def build(self, *args):
+        out = StringIO()
+        call_command('build_recommendations', '--state', self.state, *args, stdout=out)
+        return out.getvalue()
+
+    def assertRecommendations(self):
+        # counted one wishlist at a time
+        counts = Counter()
+        for wishlist in WishList.objects.all():
+            for a, b in combinations(wishlist.products.values_list('pk', flat=True), 2):
+                counts[a, b] += 1
+                counts[b, a] += 1
+        expected = set()
+        for product in Product.objects.values_list('pk', flat=True):
+            companions = sorted((-count, b) for (a, b), count in counts.items() if a == product)
+            expected.update((product, b, -count) for count, b in companions[:3])
+
+        rows = set(Recommendation.objects.values_list('product', 'recommended', 'score'))
+        self.assertEqual(rows, expected)
+        for product, recommended, score in rows:
+            self.assertNotEqual(Product.objects.get(pk=product).category_id, Product.objects.get(pk=recommended).category_id)
+
+    def test_full_and_incremental_builds(self):
+        self.assertIn('Full build: read 30 wishlists', self.build())
+        self.assertRecommendations()
+
+        self.wishlists[0].products.clear()
+        self.wishlists[1].products.remove(*self.wishlists[1].products.all()[:1])
+        self.fill(self.wishlists[2])
+        self.wishlists[3].user.delete()
+        self.products[0].delete()
+        new = Product.objects.create(name='new', price=1, rank=1, category=self.categories[0])
+        for wishlist in self.wishlists[4:8]:
+            wishlist.products.remove(*wishlist.products.filter(category=self.categories[0]))
+            wishlist.products.add(new)
+
+        out = self.build()
+        self.assertIn('Incremental build', out)
+        self.assertRecommendations()
+        # nothing changed since
+        self.assertIn('read 0 wishlists', self.build())
+        self.assertRecommendations()
+
+        before = set(Recommendation.objects.values_list('product', 'recommended', 'score'))
+        self.assertIn('Full build', self.build('--full'))
+        self.assertEqual(set(Recommendation.objects.values_list('product', 'recommended', 'score')), before)
+
+    @override_settings(INCREMENTAL_BUILD_OVERLAP=60)
+    def test_late_commits_are_read(self):
+        self.build()
+        built_at = load_recommendations_state(self.state)[-1]
+        wishlist = next(wishlist for wishlist in self.wishlists if wishlist.products.count() > 1)
+        # saved just before the build started, committed after it read the changes
+        wishlist.products.clear()
+        WishList.objects.filter(pk=wishlist.pk).update(updated_time=built_at - timedelta(seconds=1))
+
+        self.assertIn('Incremental build', self.build())
+        self.assertRecommendations()
+
+    def test_state_for_another_limit(self):
+        self.build()
+        with self.settings(RECOMMENDATIONS_PER_PRODUCT=5):
+            self.assertIn('Full build', self.build())
+
+
+
+
+@skipIf(np is None, 'numpy and scipy are not installed')
+@override_settings(SIMILAR_PRODUCTS_PER_PRODUCT=3, INCREMENTAL_BUILD_OVERLAP=0)
+class BuildSimilarProductsTest(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state = os.path.join(directory.name, 'similar_products.npz')
+
+        self.random = random.Random(0)
+        self.toys = Category.objects.create(name='toys')
+        self.books = Category.objects.create(name='books')
+        words = ('red', 'blue', 'teddy', 'bear', 'kite', 'puzzle', 'atlas', 'novel')
+        self.products = [
+            Product.objects.create(name=self.name(words), price=1, rank=1, category=self.toys)
+            for _ in range(20)
+        ]
+
+    def name(self, words):
+        return ' '.join(self.random.sample(words, 2))
+
+    def build(self, *args):
+        out = StringIO()
+        call_command('build_similar_products', '--state', self.state, *args, stdout=out)
+        return out.getvalue()
+
+    def rows(self):
+        return set(SimilarProduct.objects.values_list('product', 'similar', 'score'))
+
+    def assertSimilarProducts(self):
+        # every product's computed again with the weights of the last full build
+        counts, idf, _, _, _ = load_state(self.state)
+        products, names = read_names(Product.objects.all())
+        ids, scores = top_similar(tfidf_vectors(count_matrix(products, names, counts.shape[0]), idf), products, 3)
+        expected = {
+            (product, similar, score)
+            for product, row, row_scores in zip(products.tolist(), ids.tolist(), scores.tolist())
+            for similar, score in zip(row, row_scores) if similar >= 0
+        }
+        self.assertEqual(self.rows(), expected)
+
+    def test_similar_names(self):
+        bear = Product.objects.create(name='Teddy Bear', price=1, rank=1, category=self.books)
+        red = Product.objects.create(name='red  teddy bear', price=1, rank=1, category=self.books)
+        chess = Product.objects.create(name='chess', price=1, rank=1, category=self.books)
+        self.build()
+        self.assertEqual(bear.similar_products.order_by('-score', 'similar').first().similar, red)
+        # a name sharing no trigram with any other has no similar products
+        self.assertFalse(chess.similar_products.exists())
+        for product, similar, score in self.rows():
+            self.assertNotEqual(product, similar)
+            self.assertTrue(0 < score <= 1.0001)
+
+    def test_full_and_incremental_builds(self):
+        self.assertIn('Full build: read 20 products', self.build())
+        self.assertSimilarProducts()
+
+        for product in self.products[:3]:
+            product.name = self.name(('green', 'kite', 'puzzle', 'chess'))
+            product.save()
+        self.products[3].delete()
+        Product.objects.create(name='blue teddy', price=1, rank=1, category=self.books)
+        Product.objects.create(name='xylophone', price=1, rank=1, category=self.books)
+        # saves that don't change the name change nothing
+        self.products[4].save()
+
+        out = self.build()
+        self.assertIn('Incremental build: read 7 products', out)
+        self.assertSimilarProducts()
+        # nothing changed since
+        self.assertIn('read 0 products, rewrote the similar products of 0 products', self.build())
+        self.assertSimilarProducts()
+
+        self.assertIn('Full build', self.build('--full'))
+        self.assertSimilarProducts()
+
+    @override_settings(INCREMENTAL_BUILD_OVERLAP=60)
+    def test_late_commits_are_read(self):
+        self.build()
+        built_at = load_state(self.state)[-1]
+        # saved just before the build started, committed after it read the changes
+        Product.objects.filter(pk=self.products[0].pk).update(
+            name='green chess', updated_time=built_at - timedelta(seconds=1),
+        )
+
+        self.assertIn('Incremental build', self.build())
+        self.assertSimilarProducts()
+
+    def test_state_for_another_limit(self):
+        self.build()
+        with self.settings(SIMILAR_PRODUCTS_PER_PRODUCT=5):
+            self.assertIn('Full build', self.build())
@@ -0,0 +1,162 @@
+"""
+The best ranked products of each category, kept in the TopProduct table.
+
+Ranking a category's products on every request would sort all of them;
+instead each category keeps its TOP_PRODUCTS_PER_CATEGORY products with
+the lowest rank (the oldest first among equal ranks) in TopProduct, which
+the top products endpoint reads as is.
+
+Saving or deleting a product updates its category's rows through the
+signals in product/signals.py, looking only at those rows unless the
+product drops out of them, in which case the next best product is looked
+up (an index scan on product_category_rank_id_idx). Bulk writes, which
+send no signals, call `refresh_top_products()` for the categories they
+touched; `manage.py refresh_top_products` rebuilds every category.
+
+"""
+
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Category, Product, TopProduct
+
+
+# categories being deleted, the deletion of their products has nothing to refill
+_deleting = ContextVar('deleting_categories', default=frozenset())
+
+
+def lock_categories(query):
+    """
+    Locks the categories matching `query`, in id order so that concurrent
+    writers can't deadlock, until the transaction ends. Writers to the top
+    products of a category must hold its lock, or two of them could both
+    see room for their product.
+    """
+    return set(
+        Category.objects.select_for_update(of=('self',)).filter(query).order_by('pk').values_list('pk', flat=True)
+    )
+
+
+def refill(category_id, current=None):
+    """
+    Replaces the top products of a category with the best ranked products
+    of the product table. `current` are its rows, {product id: rank}, when
+    they have already been read.
+    """
+    best = dict(
+        Product.objects.filter(category=category_id)
+        .order_by('rank', 'pk').values_list('pk', 'rank')[:settings.TOP_PRODUCTS_PER_CATEGORY]
+    )
+    if current is None:
+        current = dict(TopProduct.objects.filter(category=category_id).values_list('product_id', 'rank'))
+
+    stale = [pk for pk in current if pk not in best]
+    if stale:
+        TopProduct.objects.filter(pk__in=stale).delete()
+    added = [
+        TopProduct(product_id=pk, category_id=category_id, rank=rank)
+        for pk, rank in best.items() if pk not in current
+    ]
+    if added:
+        TopProduct.objects.bulk_create(added)
+    changed = [
+        TopProduct(product_id=pk, category_id=category_id, rank=rank)
+        for pk, rank in best.items() if pk in current and current[pk] != rank
+    ]
+    if changed:
+        TopProduct.objects.bulk_update(changed, ['rank'])
+
+
+def product_saved(product):
+    """
+    Updates the top products after `product` was created or saved.
+    """
+    limit = settings.TOP_PRODUCTS_PER_CATEGORY
+    with transaction.atomic(savepoint=False):
+        # the product's category, and the one it moved from if it was a top product there
+        moved_from = TopProduct.objects.filter(pk=product.pk).values('category')
+        lock_categories(Q(pk=product.category_id) | Q(pk__in=moved_from))
+        rows = TopProduct.objects.filter(Q(category=product.category_id) | Q(category__in=moved_from))
+        current = {}
+        previous = None
+        old_category = {}
+        for pk, category_id, rank in rows.values_list('pk', 'category_id', 'rank'):
+            if pk == product.pk:
+                previous = (category_id, rank)
+            if category_id == product.category_id:
+                current[pk] = rank
+            else:
+                old_category[pk] = rank
+
+        if previous is not None and previous[0] != product.category_id:
+            # moved to another category, the old one takes its next best product
+            refill(previous[0], old_category)
+            previous = None
+
+        if previous is not None:
+            if product.rank == previous[1]:
+                return
+            if product.rank < previous[1] or len(current) < limit:
+                TopProduct.objects.filter(pk=product.pk).update(rank=product.rank)
+            else:
+                # ranked lower, a product outside the top may now beat it
+                refill(product.category_id, current)
+        elif len(current) < limit:
+            # a category with room in its top has all its products there
+            TopProduct.objects.create(product_id=product.pk, category_id=product.category_id, rank=product.rank)
+        else:
+            worst = max((rank, pk) for pk, rank in current.items())
+            if (product.rank, product.pk) < worst:
+                # the worst row becomes the product's
+                TopProduct.objects.filter(pk=worst[1]).update(product=product.pk, rank=product.rank)
+
+
+def product_deleted(product):
+    """
+    Fills the place a deleted product leaves in its category's top products.
+    """
+    if is_being_deleted(product.category_id):
+        return
+    with transaction.atomic(savepoint=False):
+        lock_categories(Q(pk=product.category_id))
+        current = dict(TopProduct.objects.filter(category=product.category_id).values_list('product_id', 'rank'))
+        # its row was deleted with it, so a full top never had it
+        if len(current) < settings.TOP_PRODUCTS_PER_CATEGORY:
+            refill(product.category_id, current)
+
+
+def is_being_deleted(category_id):
+    return category_id in _deleting.get()
+
+
+@contextmanager
+def deleting_category(category_id):
+    """
+    Skips the per-product work of the deletion of a category's products,
+    deleted with it one by one: refilling its top products, and touching
+    the wishlists holding them, which the category's pre_delete receiver
+    does in one query. The skip ends with the block, even when the delete
+    fails.
+    """
+    token = _deleting.set(_deleting.get() | {category_id})
+    try:
+        yield
+    finally:
+        _deleting.reset(token)
+
+
+def refresh_top_products(category_ids=None):
+    """
+    Rebuilds the top products of the given categories, every category by
+    default, from the product table.
+    """
+    with transaction.atomic(savepoint=False):
+        query = Q() if category_ids is None else Q(pk__in=list(category_ids))
+        category_ids = lock_categories(query)
+        for category_id in sorted(category_ids):
+            refill(category_id)